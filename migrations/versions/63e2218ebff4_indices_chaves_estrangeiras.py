@@ -0,0 +1,41 @@
+"""Indices nas chaves estrangeiras usadas pela listagem de remessas
+
+Revision ID: 63e2218ebff4
+Revises: b2d9f8a6b5db
+Create Date: 2026-10-18 10:41:15.208634
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '63e2218ebff4'
+down_revision = 'b2d9f8a6b5db'
+branch_labels = None
+depends_on = None
+
+
+# O PostgreSQL nao cria indice para FK. Sem eles, os JOINs da listagem, o
+# LATERAL da primeira conta e as verificacoes de dependencia nas exclusoes
+# (SELECT 1 ... WHERE id_x = %s LIMIT 1) varrem a tabela inteira.
+INDICES = {
+    'ix_remessa_id_concedente': 'remessa (id_concedente)',
+    'ix_remessa_id_usuario': 'remessa (id_usuario)',
+    'ix_remessa_id_banco': 'remessa (id_banco)',
+    'ix_conta_convenio_remessa_agencia': 'conta_convenio (id_remessa, id_agencia)',
+    'ix_conta_convenio_id_agencia': 'conta_convenio (id_agencia)',
+    'ix_agencia_id_banco': 'agencia (id_banco)',
+}
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for nome, definicao in INDICES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {definicao}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nome in INDICES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
@@ -0,0 +1,60 @@
+"""Busca textual com pg_trgm + unaccent e indices GIN trigram
+
+Revision ID: 7c1f04d93a2e
+Revises: 63e2218ebff4
+Create Date: 2026-10-18 11:20:36.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1f04d93a2e'
+down_revision = '63e2218ebff4'
+branch_labels = None
+depends_on = None
+
+
+# Colunas pesquisadas com ILIKE '%termo%' nas listagens
+INDICES_TRIGRAM = {
+    'ix_remessa_nome_proponente_trgm': ('remessa', 'nome_proponente'),
+    'ix_agencia_nome_agencia_trgm': ('agencia', 'nome_agencia'),
+    'ix_banco_nome_trgm': ('banco', 'nome'),
+    'ix_concedente_sigla_trgm': ('concedente', 'sigla'),
+    'ix_concedente_nome_trgm': ('concedente', 'nome'),
+    'ix_usuario_nome_trgm': ('usuario', 'nome'),
+}
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+
+    # unaccent() e STABLE (depende do dicionario em search_path) e nao pode
+    # ir para um indice; o wrapper fixa o dicionario e pode ser IMMUTABLE.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS $$
+            SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """)
+
+    with op.get_context().autocommit_block():
+        for nome, (tabela, coluna) in INDICES_TRIGRAM.items():
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} "
+                f"ON {tabela} USING gin (f_unaccent({coluna}) gin_trgm_ops)"
+            )
+        # Busca por prefixo do numero da agencia (num_agencia::text LIKE '12%')
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_agencia_num_agencia_prefixo "
+            "ON agencia ((num_agencia::text) text_pattern_ops)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_agencia_num_agencia_prefixo")
+        for nome in INDICES_TRIGRAM:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
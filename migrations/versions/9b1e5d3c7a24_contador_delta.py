@@ -0,0 +1,74 @@
+"""Contadores do dashboard em linhas de delta (sem linha quente por chave)
+
+Revision ID: 9b1e5d3c7a24
+Revises: e3a9c7b5d2f1
+Create Date: 2026-10-18 19:20:14.502817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1e5d3c7a24'
+down_revision = 'e3a9c7b5d2f1'
+branch_labels = None
+depends_on = None
+
+
+# Com um UPSERT na mesma linha por chave (df60a9f00dfb), toda escrita em
+# remessa disputava o lock de 'remessa' e 'remessa:<situacao>' ate o COMMIT:
+# gerar o arquivo do banco ou uma importacao em lote travava cada
+# criar_remessa. Agora o trigger so acrescenta uma linha (chave, delta), sem
+# conflito entre transacoes; o dashboard soma por chave e o job
+# compactar-contadores junta os deltas em uma linha por chave.
+AJUSTA_DELTA = """
+    CREATE OR REPLACE FUNCTION contador_ajusta(p_chave TEXT, p_delta BIGINT) RETURNS void AS $$
+    BEGIN
+        IF p_delta <> 0 THEN
+            INSERT INTO contador_delta (chave, delta) VALUES (p_chave, p_delta);
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+AJUSTA_UPSERT = """
+    CREATE OR REPLACE FUNCTION contador_ajusta(p_chave TEXT, p_delta BIGINT) RETURNS void AS $$
+    BEGIN
+        IF p_delta <> 0 THEN
+            INSERT INTO contador (chave, total) VALUES (p_chave, p_delta)
+            ON CONFLICT (chave) DO UPDATE SET total = contador.total + EXCLUDED.total;
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE contador_delta (
+            id BIGSERIAL PRIMARY KEY,
+            chave VARCHAR(60) NOT NULL,
+            delta BIGINT NOT NULL
+        )
+    """)
+
+    # Trava os contadores ate o COMMIT: nenhum ajuste se perde entre a copia
+    # dos totais e a troca da funcao
+    op.execute("LOCK TABLE contador IN ACCESS EXCLUSIVE MODE")
+    op.execute(AJUSTA_DELTA)
+    op.execute("INSERT INTO contador_delta (chave, delta) SELECT chave, total FROM contador WHERE total <> 0")
+    op.execute("DROP TABLE contador")
+
+
+def downgrade():
+    op.execute("""
+        CREATE TABLE contador (
+            chave VARCHAR(60) PRIMARY KEY,
+            total BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    op.execute("LOCK TABLE contador_delta IN ACCESS EXCLUSIVE MODE")
+    op.execute(AJUSTA_UPSERT)
+    op.execute("INSERT INTO contador (chave, total) SELECT chave, SUM(delta) FROM contador_delta GROUP BY chave")
+    op.execute("DROP TABLE contador_delta")
@@ -0,0 +1,69 @@
+"""Indices das ordenacoes das listagens (?sort=), texto com collation pt-BR ICU
+
+Revision ID: a3f6d2c8e9b1
+Revises: d9b4e2a6c3f8
+Create Date: 2026-10-18 16:24:05.730114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f6d2c8e9b1'
+down_revision = 'd9b4e2a6c3f8'
+branch_labels = None
+depends_on = None
+
+
+COLLATION = '"pt-BR-x-icu"'
+
+# Um indice por ordenacao de listagem (produto.views, LISTA_*.ordenacoes), com
+# as mesmas colunas e a mesma collation do ORDER BY; ?dir=desc le o mesmo
+# indice de tras para frente. Ja cobertos por indice unico: banco (id_banco),
+# concedente (codigo_secretaria), usuario (login).
+INDICES = {
+    'ix_banco_nome_pt_br': f'banco (nome COLLATE {COLLATION}, id_banco)',
+    'ix_agencia_nome_pt_br': f'agencia (nome_agencia COLLATE {COLLATION}, num_agencia, id_agencia)',
+    'ix_agencia_num_id': 'agencia (num_agencia, id_agencia)',
+    'ix_concedente_sigla_pt_br': f'concedente (sigla COLLATE {COLLATION}, id_concedente)',
+    'ix_concedente_nome_pt_br': f'concedente (nome COLLATE {COLLATION}, id_concedente)',
+    'ix_usuario_nome_pt_br': f'usuario (nome COLLATE {COLLATION}, id_usuario)',
+    'ix_remessa_nome_proponente_pt_br': f'remessa (nome_proponente COLLATE {COLLATION}, id_remessa)',
+    'ix_remessa_dt_remessa_id': 'remessa (dt_remessa, id_remessa)',
+    'ix_conta_convenio_dt_abertura_id': 'conta_convenio (dt_abertura, id_conta_convenio)',
+}
+
+# Indices de b2d9f8a6b5db na collation padrao: o ORDER BY pt-BR nao os usa
+SUBSTITUIDOS = {
+    'ix_remessa_nome_proponente_id': 'remessa (nome_proponente, id_remessa)',
+    'ix_agencia_nome_num_id': 'agencia (nome_agencia, num_agencia, id_agencia)',
+    'ix_usuario_nome_id': 'usuario (nome, id_usuario)',
+}
+
+
+def upgrade():
+    conn = op.get_bind()
+    disponivel = conn.execute(
+        sa.text("SELECT 1 FROM pg_collation WHERE collname = 'pt-BR-x-icu'")
+    ).scalar()
+    if not disponivel:
+        raise RuntimeError(
+            "collation pt-BR-x-icu ausente: o PostgreSQL precisa ser compilado com ICU "
+            "(as listagens ordenam texto com ela)"
+        )
+
+    # CONCURRENTLY nao bloqueia escritas, mas nao roda dentro de transacao
+    with op.get_context().autocommit_block():
+        for nome, definicao in INDICES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {definicao}")
+        for nome in SUBSTITUIDOS:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nome, definicao in SUBSTITUIDOS.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {definicao}")
+        for nome in INDICES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
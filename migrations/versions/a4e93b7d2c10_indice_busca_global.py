@@ -0,0 +1,114 @@
+"""Indice de busca global (remessas, contas e agencias) mantido por trigger
+
+Revision ID: a4e93b7d2c10
+Revises: 7c1f04d93a2e
+Create Date: 2026-10-18 12:05:51.337160
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e93b7d2c10'
+down_revision = '7c1f04d93a2e'
+branch_labels = None
+depends_on = None
+
+
+# Texto pesquisavel de cada entidade (normalizado por busca_indice_grava)
+TERMOS_REMESSA = """concat_ws(' ', {r}.nome_proponente, {r}.num_processo, {r}.num_convenio,
+                          {r}.cpf_cnpj, regexp_replace({r}.cpf_cnpj, '\\D', '', 'g'))"""
+TERMOS_CONTA = """concat_ws(' ', {c}.num_conta, {c}.num_conta || {c}.dv_conta,
+                          {c}.num_conta || '-' || {c}.dv_conta)"""
+TERMOS_AGENCIA = """concat_ws(' ', {a}.nome_agencia, {a}.num_agencia::text,
+                          {a}.num_agencia || '-' || {a}.dv_agencia, {a}.cidade)"""
+
+# entidade -> (tabela, chave, termos, colunas que disparam a atualizacao)
+ENTIDADES = {
+    'remessa': ('remessa', 'id_remessa', TERMOS_REMESSA.format(r='NEW'),
+                'nome_proponente, num_processo, num_convenio, cpf_cnpj'),
+    'conta': ('conta_convenio', 'id_conta_convenio', TERMOS_CONTA.format(c='NEW'),
+              'num_conta, dv_conta'),
+    'agencia': ('agencia', 'id_agencia', TERMOS_AGENCIA.format(a='NEW'),
+                'nome_agencia, num_agencia, dv_agencia, cidade'),
+}
+
+
+def upgrade():
+    # Uma linha por registro pesquisavel. Os dados exibidos (nome, agencia,
+    # banco...) sao lidos por JOIN na hora da busca, entao alterar uma
+    # entidade nunca deixa outra desatualizada no indice.
+    op.execute("""
+        CREATE TABLE busca_indice (
+            entidade VARCHAR(10) NOT NULL,
+            id_entidade INTEGER NOT NULL,
+            termos TEXT NOT NULL,
+            documento TSVECTOR NOT NULL,
+            PRIMARY KEY (entidade, id_entidade)
+        )
+    """)
+
+    op.execute("""
+        CREATE FUNCTION busca_indice_grava(p_entidade TEXT, p_id INTEGER, p_texto TEXT)
+        RETURNS void AS $$
+        DECLARE
+            v_termos TEXT := lower(f_unaccent(coalesce(p_texto, '')));
+        BEGIN
+            INSERT INTO busca_indice (entidade, id_entidade, termos, documento)
+            VALUES (p_entidade, p_id, v_termos, to_tsvector('simple', v_termos))
+            ON CONFLICT (entidade, id_entidade) DO UPDATE
+               SET termos = EXCLUDED.termos,
+                   documento = EXCLUDED.documento;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    for entidade, (tabela, chave, termos, colunas) in ENTIDADES.items():
+        op.execute(f"""
+            CREATE FUNCTION busca_indice_{tabela}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    DELETE FROM busca_indice
+                     WHERE entidade = '{entidade}' AND id_entidade = OLD.{chave};
+                    RETURN OLD;
+                END IF;
+                PERFORM busca_indice_grava('{entidade}', NEW.{chave}, {termos});
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        op.execute(f"""
+            CREATE TRIGGER trg_busca_indice AFTER INSERT OR DELETE OR UPDATE OF {colunas}
+            ON {tabela} FOR EACH ROW EXECUTE FUNCTION busca_indice_{tabela}()
+        """)
+
+    # Carga inicial
+    op.execute(f"""
+        INSERT INTO busca_indice (entidade, id_entidade, termos, documento)
+        SELECT entidade, id, t, to_tsvector('simple', t)
+          FROM (
+                SELECT 'remessa' AS entidade, r.id_remessa AS id,
+                       lower(f_unaccent({TERMOS_REMESSA.format(r='r')})) AS t
+                  FROM remessa r
+                UNION ALL
+                SELECT 'conta', c.id_conta_convenio,
+                       lower(f_unaccent({TERMOS_CONTA.format(c='c')}))
+                  FROM conta_convenio c
+                UNION ALL
+                SELECT 'agencia', a.id_agencia,
+                       lower(f_unaccent({TERMOS_AGENCIA.format(a='a')}))
+                  FROM agencia a
+          ) x
+    """)
+
+    op.execute("CREATE INDEX ix_busca_indice_documento ON busca_indice USING gin (documento)")
+    op.execute("CREATE INDEX ix_busca_indice_termos_trgm ON busca_indice USING gin (termos gin_trgm_ops)")
+
+
+def downgrade():
+    for _entidade, (tabela, _chave, _termos, _colunas) in ENTIDADES.items():
+        op.execute(f"DROP TRIGGER IF EXISTS trg_busca_indice ON {tabela}")
+        op.execute(f"DROP FUNCTION IF EXISTS busca_indice_{tabela}()")
+    op.execute("DROP FUNCTION IF EXISTS busca_indice_grava(TEXT, INTEGER, TEXT)")
+    op.execute("DROP TABLE IF EXISTS busca_indice")
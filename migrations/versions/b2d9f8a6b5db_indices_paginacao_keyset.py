@@ -0,0 +1,39 @@
+"""Indices compostos para paginacao por keyset
+
+Revision ID: b2d9f8a6b5db
+Revises: df60a9f00dfb
+Create Date: 2026-10-18 10:02:47.551093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d9f8a6b5db'
+down_revision = 'df60a9f00dfb'
+branch_labels = None
+depends_on = None
+
+
+# Um indice por ordenacao de listagem (mesmas colunas, mesma ordem do keyset).
+# banco (id_banco) e concedente (codigo_secretaria) ja tem indice unico.
+INDICES = {
+    'ix_remessa_nome_proponente_id': 'remessa (nome_proponente, id_remessa)',
+    'ix_agencia_nome_num_id': 'agencia (nome_agencia, num_agencia, id_agencia)',
+    'ix_usuario_nome_id': 'usuario (nome, id_usuario)',
+    'ix_conta_convenio_remessa_id': 'conta_convenio (id_remessa, id_conta_convenio)',
+}
+
+
+def upgrade():
+    # CONCURRENTLY nao bloqueia escritas, mas nao roda dentro de transacao
+    with op.get_context().autocommit_block():
+        for nome, definicao in INDICES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {definicao}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nome in INDICES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
@@ -0,0 +1,32 @@
+"""Indice (situacao, dt_remessa) para o filtro de periodo das remessas
+
+Revision ID: b7e1c4f9a2d6
+Revises: a3f6d2c8e9b1
+Create Date: 2026-10-18 17:05:31.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1c4f9a2d6'
+down_revision = 'a3f6d2c8e9b1'
+branch_labels = None
+depends_on = None
+
+
+# ?situacao=&date_from=&date_to= (igualdade + intervalo semiaberto) vira um
+# range scan neste indice. So periodo usa ix_remessa_dt_remessa_id; o periodo
+# das contas usa ix_conta_convenio_dt_abertura_id (ambos de a3f6d2c8e9b1).
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_remessa_situacao_dt_remessa "
+            "ON remessa (situacao, dt_remessa)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_remessa_situacao_dt_remessa")
@@ -0,0 +1,70 @@
+"""CPF/CNPJ so com digitos (remessa.cpf_cnpj_digits) e indice de igualdade
+
+Revision ID: c5e2f8a1b4d7
+Revises: b7e1c4f9a2d6
+Create Date: 2026-10-18 17:48:12.660391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e2f8a1b4d7'
+down_revision = 'b7e1c4f9a2d6'
+branch_labels = None
+depends_on = None
+
+
+# Remessas por UPDATE da carga inicial (cada lote e uma transacao)
+LOTE = 5000
+
+DIGITOS = "NULLIF(regexp_replace({coluna}, '\\D', '', 'g'), '')"
+
+
+def upgrade():
+    # Coluna comum mantida por trigger, e nao GENERATED ... STORED: adicionar
+    # uma coluna gerada reescreve a tabela inteira sob ACCESS EXCLUSIVE. Assim
+    # o ADD COLUMN e instantaneo e a carga roda em lotes sem travar a tela.
+    op.execute("ALTER TABLE remessa ADD COLUMN cpf_cnpj_digits VARCHAR(18)")
+    op.execute(f"""
+        CREATE FUNCTION remessa_cpf_cnpj_digits() RETURNS trigger AS $$
+        BEGIN
+            NEW.cpf_cnpj_digits := {DIGITOS.format(coluna='NEW.cpf_cnpj')};
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_remessa_cpf_cnpj_digits BEFORE INSERT OR UPDATE OF cpf_cnpj
+        ON remessa FOR EACH ROW EXECUTE FUNCTION remessa_cpf_cnpj_digits()
+    """)
+
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        # Carga por faixas da PK: cada lote le so o seu trecho do indice
+        inicio, fim = conn.execute(sa.text("SELECT min(id_remessa), max(id_remessa) FROM remessa")).one()
+        while inicio is not None and inicio <= fim:
+            conn.execute(
+                sa.text(f"""
+                    UPDATE remessa
+                       SET cpf_cnpj_digits = {DIGITOS.format(coluna='cpf_cnpj')}
+                     WHERE id_remessa >= :inicio AND id_remessa < :fim
+                       AND cpf_cnpj_digits IS NULL
+                """),
+                {"inicio": inicio, "fim": inicio + LOTE},
+            )
+            inicio += LOTE
+
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_remessa_cpf_cnpj_digits "
+            "ON remessa (cpf_cnpj_digits)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_remessa_cpf_cnpj_digits")
+    op.execute("DROP TRIGGER IF EXISTS trg_remessa_cpf_cnpj_digits ON remessa")
+    op.execute("DROP FUNCTION IF EXISTS remessa_cpf_cnpj_digits()")
+    op.execute("ALTER TABLE remessa DROP COLUMN IF EXISTS cpf_cnpj_digits")
@@ -0,0 +1,59 @@
+"""Versao dos dados de referencia (concedente, banco, agencia) para o cache
+
+Revision ID: c8f3a1d5e7b4
+Revises: e5b0c6f1d872
+Create Date: 2026-10-18 13:12:08.415927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f3a1d5e7b4'
+down_revision = 'e5b0c6f1d872'
+branch_labels = None
+depends_on = None
+
+
+TABELAS = ('concedente', 'banco', 'agencia')
+
+
+def upgrade():
+    # Uma linha por tabela cacheada; o app compara a versao com a da carga
+    op.execute("""
+        CREATE TABLE dados_referencia (
+            chave VARCHAR(30) PRIMARY KEY,
+            versao BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    op.execute(
+        "INSERT INTO dados_referencia (chave) VALUES "
+        + ", ".join(f"('{tabela}')" for tabela in TABELAS)
+    )
+
+    # Por comando (nao por linha): um UPDATE em massa incrementa uma vez.
+    # O NOTIFY so e entregue quando a transacao confirma.
+    op.execute("""
+        CREATE FUNCTION dados_referencia_alterados() RETURNS trigger AS $$
+        BEGIN
+            UPDATE dados_referencia SET versao = versao + 1 WHERE chave = TG_TABLE_NAME;
+            PERFORM pg_notify('dados_referencia', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    for tabela in TABELAS:
+        op.execute(f"""
+            CREATE TRIGGER trg_dados_referencia
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabela}
+            FOR EACH STATEMENT EXECUTE FUNCTION dados_referencia_alterados()
+        """)
+
+
+def downgrade():
+    for tabela in TABELAS:
+        op.execute(f"DROP TRIGGER IF EXISTS trg_dados_referencia ON {tabela}")
+    op.execute("DROP FUNCTION IF EXISTS dados_referencia_alterados()")
+    op.execute("DROP TABLE IF EXISTS dados_referencia")
@@ -0,0 +1,101 @@
+"""Numero de agencia unico por banco (upsert do catalogo de agencias)
+
+Revision ID: d9b4e2a6c3f8
+Revises: f2a7c49e03d1
+Create Date: 2026-10-18 15:10:42.318907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b4e2a6c3f8'
+down_revision = 'f2a7c49e03d1'
+branch_labels = None
+depends_on = None
+
+
+# Colunas de dados da agencia: duplicatas so sao unificadas se todas batem
+COLUNAS = "nome_agencia, dv_agencia, logadouro, cidade, uf"
+
+# Conflitos listados na mensagem de erro
+MAX_CONFLITOS_EXIBIDOS = 50
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    # Bloqueia escritas em agencia ate o COMMIT (leituras seguem): nenhuma
+    # duplicata nova entra entre a verificacao e a criacao do indice
+    op.execute("LOCK TABLE agencia IN SHARE ROW EXCLUSIVE MODE")
+
+    # Indice invalido deixado por uma tentativa anterior com CONCURRENTLY
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_index
+                        WHERE indexrelid = to_regclass('uq_agencia_banco_num_agencia')
+                          AND NOT indisvalid) THEN
+                DROP INDEX uq_agencia_banco_num_agencia;
+            END IF;
+        END
+        $$
+    """)
+
+    # Mesmo numero no mesmo banco com dados diferentes: nao ha como escolher
+    # qual manter sem perder informacao. Aborta e lista para correcao manual.
+    conflitos = conn.execute(sa.text(f"""
+        SELECT id_banco, num_agencia, string_agg(id_agencia::text, ', ' ORDER BY id_agencia) AS ids
+          FROM agencia
+         GROUP BY id_banco, num_agencia
+        HAVING COUNT(DISTINCT ({COLUNAS})) > 1
+         ORDER BY id_banco, num_agencia
+    """)).fetchall()
+    if conflitos:
+        linhas = [f"banco {b} agencia {n}: id_agencia {ids}" for b, n, ids in conflitos[:MAX_CONFLITOS_EXIBIDOS]]
+        if len(conflitos) > MAX_CONFLITOS_EXIBIDOS:
+            linhas.append(f"... e mais {len(conflitos) - MAX_CONFLITOS_EXIBIDOS}")
+        raise RuntimeError(
+            f"{len(conflitos)} numeros de agencia repetidos no mesmo banco com dados diferentes; "
+            "unifique-os manualmente (contas em conta_convenio.id_agencia) e rode de novo:\n  "
+            + "\n  ".join(linhas)
+        )
+
+    # Restam so copias identicas: unificadas na de menor id, as contas passam
+    # para ela e as demais saem
+    op.execute("""
+        CREATE TEMP TABLE agencia_duplicada ON COMMIT DROP AS
+        SELECT id_agencia,
+               min(id_agencia) OVER (PARTITION BY id_banco, num_agencia) AS id_mantida
+          FROM agencia
+    """)
+    op.execute("""
+        UPDATE conta_convenio cc
+           SET id_agencia = d.id_mantida
+          FROM agencia_duplicada d
+         WHERE cc.id_agencia = d.id_agencia
+           AND d.id_agencia <> d.id_mantida
+    """)
+    op.execute("""
+        DELETE FROM agencia a
+         USING agencia_duplicada d
+         WHERE a.id_agencia = d.id_agencia
+           AND d.id_agencia <> d.id_mantida
+    """)
+
+    # Na mesma transacao, sob o lock (sem CONCURRENTLY): o catalogo de
+    # agencias e pequeno e assim nenhum INSERT concorrente quebra o indice.
+    # Alvo do ON CONFLICT da importacao e busca por numero dentro do banco
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_agencia_banco_num_agencia "
+        "ON agencia (id_banco, num_agencia)"
+    )
+    # Coberto pelo prefixo do indice unico
+    op.execute("DROP INDEX IF EXISTS ix_agencia_id_banco")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_agencia_id_banco ON agencia (id_banco)")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uq_agencia_banco_num_agencia")
@@ -0,0 +1,145 @@
+"""Contadores do dashboard mantidos por trigger
+
+Revision ID: df60a9f00dfb
+Revises: 5d6ecbcfefe6
+Create Date: 2026-10-18 09:12:03.418227
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df60a9f00dfb'
+down_revision = '5d6ecbcfefe6'
+branch_labels = None
+depends_on = None
+
+
+TABELAS = ('usuario', 'banco', 'agencia', 'remessa', 'concedente', 'conta_convenio')
+
+
+def upgrade():
+    # Uma linha por tabela ('remessa') e por situacao ('remessa:Enviado');
+    # o dashboard le tudo com um unico SELECT, sem varrer as tabelas.
+    op.execute("""
+        CREATE TABLE contador (
+            chave VARCHAR(60) PRIMARY KEY,
+            total BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+
+    # Triggers por comando (com tabelas de transicao): um INSERT/COPY em lote
+    # atualiza o contador uma unica vez, nao uma vez por linha.
+    op.execute("""
+        CREATE FUNCTION contador_ajusta(p_chave TEXT, p_delta BIGINT) RETURNS void AS $$
+        BEGIN
+            IF p_delta <> 0 THEN
+                INSERT INTO contador (chave, total) VALUES (p_chave, p_delta)
+                ON CONFLICT (chave) DO UPDATE SET total = contador.total + EXCLUDED.total;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION contador_tabela_ins() RETURNS trigger AS $$
+        BEGIN
+            PERFORM contador_ajusta(TG_TABLE_NAME, (SELECT COUNT(*) FROM novas));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION contador_tabela_del() RETURNS trigger AS $$
+        BEGIN
+            PERFORM contador_ajusta(TG_TABLE_NAME, -(SELECT COUNT(*) FROM antigas));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION contador_situacao_ins() RETURNS trigger AS $$
+        BEGIN
+            PERFORM contador_ajusta('remessa:' || s.situacao, s.n)
+               FROM (SELECT situacao::text AS situacao, COUNT(*) AS n FROM novas GROUP BY 1) s;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION contador_situacao_del() RETURNS trigger AS $$
+        BEGIN
+            PERFORM contador_ajusta('remessa:' || s.situacao, -s.n)
+               FROM (SELECT situacao::text AS situacao, COUNT(*) AS n FROM antigas GROUP BY 1) s;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION contador_situacao_upd() RETURNS trigger AS $$
+        BEGIN
+            PERFORM contador_ajusta('remessa:' || d.situacao, d.n)
+               FROM (
+                    SELECT situacao, SUM(n) AS n
+                      FROM (SELECT situacao::text AS situacao, COUNT(*) AS n FROM novas GROUP BY 1
+                            UNION ALL
+                            SELECT situacao::text, -COUNT(*) FROM antigas GROUP BY 1) x
+                     GROUP BY situacao
+               ) d;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    for tabela in TABELAS:
+        op.execute(f"""
+            CREATE TRIGGER trg_contador_ins AFTER INSERT ON {tabela}
+            REFERENCING NEW TABLE AS novas
+            FOR EACH STATEMENT EXECUTE FUNCTION contador_tabela_ins()
+        """)
+        op.execute(f"""
+            CREATE TRIGGER trg_contador_del AFTER DELETE ON {tabela}
+            REFERENCING OLD TABLE AS antigas
+            FOR EACH STATEMENT EXECUTE FUNCTION contador_tabela_del()
+        """)
+
+    op.execute("""
+        CREATE TRIGGER trg_contador_situacao_ins AFTER INSERT ON remessa
+        REFERENCING NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION contador_situacao_ins()
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_contador_situacao_del AFTER DELETE ON remessa
+        REFERENCING OLD TABLE AS antigas
+        FOR EACH STATEMENT EXECUTE FUNCTION contador_situacao_del()
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_contador_situacao_upd AFTER UPDATE ON remessa
+        REFERENCING OLD TABLE AS antigas NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION contador_situacao_upd()
+    """)
+
+    # Carga inicial (a tabela fica travada so durante a migration)
+    for tabela in TABELAS:
+        op.execute(f"LOCK TABLE {tabela} IN SHARE MODE")
+        op.execute(f"INSERT INTO contador (chave, total) SELECT '{tabela}', COUNT(*) FROM {tabela}")
+    op.execute("""
+        INSERT INTO contador (chave, total)
+        SELECT 'remessa:' || situacao::text, COUNT(*) FROM remessa GROUP BY situacao
+    """)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS trg_contador_situacao_upd ON remessa")
+    op.execute("DROP TRIGGER IF EXISTS trg_contador_situacao_del ON remessa")
+    op.execute("DROP TRIGGER IF EXISTS trg_contador_situacao_ins ON remessa")
+    for tabela in TABELAS:
+        op.execute(f"DROP TRIGGER IF EXISTS trg_contador_del ON {tabela}")
+        op.execute(f"DROP TRIGGER IF EXISTS trg_contador_ins ON {tabela}")
+    op.execute("DROP FUNCTION IF EXISTS contador_situacao_upd()")
+    op.execute("DROP FUNCTION IF EXISTS contador_situacao_del()")
+    op.execute("DROP FUNCTION IF EXISTS contador_situacao_ins()")
+    op.execute("DROP FUNCTION IF EXISTS contador_tabela_del()")
+    op.execute("DROP FUNCTION IF EXISTS contador_tabela_ins()")
+    op.execute("DROP FUNCTION IF EXISTS contador_ajusta(TEXT, BIGINT)")
+    op.execute("DROP TABLE IF EXISTS contador")
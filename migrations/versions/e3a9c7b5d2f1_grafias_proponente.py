@@ -0,0 +1,111 @@
+"""Grafias do nome do proponente por CPF/CNPJ e fila da deduplicacao incremental
+
+Revision ID: e3a9c7b5d2f1
+Revises: c5e2f8a1b4d7
+Create Date: 2026-10-18 18:32:40.915826
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9c7b5d2f1'
+down_revision = 'c5e2f8a1b4d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Resultado do job deduplicar-proponentes: cada grafia de um documento e o
+    # nome canonico do seu grupo. A PK atende a tela do proponente.
+    op.execute("""
+        CREATE TABLE proponente_grafia (
+            documento VARCHAR(18) NOT NULL,
+            nome_proponente VARCHAR(100) NOT NULL,
+            nome_canonico VARCHAR(100) NOT NULL,
+            remessas INTEGER NOT NULL,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (documento, nome_proponente)
+        )
+    """)
+
+    # Documentos cujas remessas mudaram desde a ultima execucao do job
+    op.execute("""
+        CREATE TABLE proponente_pendente (
+            documento VARCHAR(18) PRIMARY KEY,
+            desde TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+    # Triggers por comando (com tabelas de transicao), como os contadores do
+    # dashboard: uma importacao em lote enfileira cada documento uma vez.
+    # No UPDATE so entram as linhas em que nome ou documento mudou.
+    op.execute("""
+        CREATE FUNCTION proponente_enfileira(p_documentos TEXT[]) RETURNS void AS $$
+        BEGIN
+            INSERT INTO proponente_pendente (documento)
+            SELECT DISTINCT d FROM unnest(p_documentos) d WHERE d IS NOT NULL
+            ON CONFLICT (documento) DO NOTHING;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION proponente_pendente_ins() RETURNS trigger AS $$
+        BEGIN
+            PERFORM proponente_enfileira(ARRAY(SELECT cpf_cnpj_digits FROM novas));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION proponente_pendente_del() RETURNS trigger AS $$
+        BEGIN
+            PERFORM proponente_enfileira(ARRAY(SELECT cpf_cnpj_digits FROM antigas));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE FUNCTION proponente_pendente_upd() RETURNS trigger AS $$
+        BEGIN
+            PERFORM proponente_enfileira(ARRAY(
+                SELECT unnest(ARRAY[o.cpf_cnpj_digits, n.cpf_cnpj_digits])
+                  FROM antigas o
+                  JOIN novas n ON n.id_remessa = o.id_remessa
+                 WHERE (o.nome_proponente, o.cpf_cnpj_digits) IS DISTINCT FROM (n.nome_proponente, n.cpf_cnpj_digits)
+            ));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_proponente_pendente_ins AFTER INSERT ON remessa
+        REFERENCING NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION proponente_pendente_ins()
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_proponente_pendente_del AFTER DELETE ON remessa
+        REFERENCING OLD TABLE AS antigas
+        FOR EACH STATEMENT EXECUTE FUNCTION proponente_pendente_del()
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_proponente_pendente_upd AFTER UPDATE ON remessa
+        REFERENCING OLD TABLE AS antigas NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION proponente_pendente_upd()
+    """)
+
+    # Primeira execucao do job processa todos os documentos
+    op.execute("""
+        INSERT INTO proponente_pendente (documento)
+        SELECT DISTINCT cpf_cnpj_digits FROM remessa WHERE cpf_cnpj_digits IS NOT NULL
+    """)
+
+
+def downgrade():
+    for operacao in ('ins', 'del', 'upd'):
+        op.execute(f"DROP TRIGGER IF EXISTS trg_proponente_pendente_{operacao} ON remessa")
+        op.execute(f"DROP FUNCTION IF EXISTS proponente_pendente_{operacao}()")
+    op.execute("DROP FUNCTION IF EXISTS proponente_enfileira(TEXT[])")
+    op.execute("DROP TABLE IF EXISTS proponente_pendente")
+    op.execute("DROP TABLE IF EXISTS proponente_grafia")
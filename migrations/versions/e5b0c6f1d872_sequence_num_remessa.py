@@ -0,0 +1,46 @@
+"""Numeracao de remessa por sequence
+
+Revision ID: e5b0c6f1d872
+Revises: a4e93b7d2c10
+Create Date: 2026-10-18 13:10:09.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b0c6f1d872'
+down_revision = 'a4e93b7d2c10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nextval() nao bloqueia e nunca repete, mesmo com varios operadores
+    # criando remessas ao mesmo tempo. Um INSERT desfeito deixa um buraco
+    # na numeracao (comportamento normal de sequence).
+    op.execute("CREATE SEQUENCE IF NOT EXISTS remessa_num_remessa_seq OWNED BY remessa.num_remessa")
+    op.execute("LOCK TABLE remessa IN SHARE ROW EXCLUSIVE MODE")
+    op.execute("""
+        SELECT setval('remessa_num_remessa_seq',
+                      (SELECT COALESCE(MAX(num_remessa), 0) + 1 FROM remessa), false)
+    """)
+    op.execute("ALTER TABLE remessa ALTER COLUMN num_remessa SET DEFAULT nextval('remessa_num_remessa_seq')")
+
+    # Garante a unicidade no banco; so cria se os numeros ja gerados pelo
+    # antigo MAX()+1 nao tiverem colidido
+    duplicados = op.get_bind().execute(sa.text(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM remessa GROUP BY num_remessa HAVING COUNT(*) > 1) d"
+    )).scalar()
+    if duplicados:
+        print(f"⚠️ {duplicados} num_remessa duplicados: indice unico nao criado. Corrija e rode "
+              "CREATE UNIQUE INDEX ux_remessa_num_remessa ON remessa (num_remessa)")
+    else:
+        op.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_remessa_num_remessa ON remessa (num_remessa)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ux_remessa_num_remessa")
+    op.execute("ALTER TABLE remessa ALTER COLUMN num_remessa DROP DEFAULT")
+    op.execute("DROP SEQUENCE IF EXISTS remessa_num_remessa_seq")
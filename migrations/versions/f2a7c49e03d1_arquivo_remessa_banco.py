@@ -0,0 +1,56 @@
+"""Arquivos de remessa enviados ao banco e vinculo remessa -> arquivo
+
+Revision ID: f2a7c49e03d1
+Revises: c8f3a1d5e7b4
+Create Date: 2026-10-18 14:02:31.776540
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7c49e03d1'
+down_revision = 'c8f3a1d5e7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nsa: numero sequencial do arquivo, por banco (vai no header do arquivo)
+    op.execute("""
+        CREATE TABLE arquivo_remessa (
+            id_arquivo_remessa SERIAL PRIMARY KEY,
+            id_banco INTEGER NOT NULL REFERENCES banco(id_banco),
+            nsa INTEGER NOT NULL,
+            nome_arquivo VARCHAR(100) NOT NULL,
+            qtd_remessas INTEGER NOT NULL DEFAULT 0,
+            dt_geracao TIMESTAMP NOT NULL DEFAULT now(),
+            id_usuario INTEGER REFERENCES usuario(id_usuario),
+            CONSTRAINT uq_arquivo_remessa_banco_nsa UNIQUE (id_banco, nsa)
+        )
+    """)
+    op.execute(
+        "ALTER TABLE remessa ADD COLUMN id_arquivo_remessa INTEGER "
+        "REFERENCES arquivo_remessa(id_arquivo_remessa)"
+    )
+
+    with op.get_context().autocommit_block():
+        # Leitura das remessas de um arquivo (geracao e conciliacao do retorno)
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_remessa_id_arquivo_remessa "
+            "ON remessa (id_arquivo_remessa)"
+        )
+        # Selecao das remessas em preparacao de um banco
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_remessa_banco_situacao "
+            "ON remessa (id_banco, situacao)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_remessa_banco_situacao")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_remessa_id_arquivo_remessa")
+    op.execute("ALTER TABLE remessa DROP COLUMN IF EXISTS id_arquivo_remessa")
+    op.execute("DROP TABLE IF EXISTS arquivo_remessa")
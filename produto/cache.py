@@ -0,0 +1,157 @@
+# cache.py - Cache em processo dos dados de referencia (concedentes, bancos, agencias)
+
+import os
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class ReferenceCache:
+    """
+    Guarda em memória listas pouco alteradas usadas nos dropdowns.
+
+    Cada escrita em concedente/banco/agencia incrementa, por trigger, a versão
+    da tabela em ``dados_referencia`` e emite ``NOTIFY dados_referencia``.
+    Uma thread por processo escuta o canal e invalida as entradas que
+    dependem da tabela alterada: em regime, ler um dropdown não custa
+    nenhuma query.
+
+    Se o LISTEN cair, as versões passam a ser conferidas no banco no máximo a
+    cada ``poll_interval`` segundos até a escuta voltar. Sem a tabela de
+    versões (migration não aplicada) o cache fica desligado e sempre recarrega.
+    """
+
+    CHANNEL = "dados_referencia"
+
+    def __init__(self, conn_kwargs, poll_interval=5.0):
+        self.conn_kwargs = dict(conn_kwargs)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._entries = {}      # chave -> (dados, {tabela: geracao})
+        self._generation = {}   # tabela -> contador local de invalidacoes
+        self._db_versions = {}  # tabela -> ultima versao lida de dados_referencia
+        self._checked_at = 0.0
+        self._enabled = None
+        self._listening = False
+        self._pid = None
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, tables, loader, fetch_versions):
+        """
+        Retorna os dados de ``key``, chamando ``loader()`` só quando alguma
+        das ``tables`` mudou desde a última carga. Um ``loader()`` que
+        devolve None (erro) não é guardado.
+
+        fetch_versions: função que retorna {tabela: versao} de
+        dados_referencia, ou None se a tabela não existir. Só é chamada
+        enquanto o LISTEN não está ativo.
+        """
+        self._ensure_listener()
+        if not self._listening:
+            self._poll_versions(fetch_versions)
+        if not self._enabled:
+            return loader()
+
+        with self._lock:
+            snapshot = {table: self._generation.get(table, 0) for table in tables}
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == snapshot:
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        data = loader()
+        if data is None:
+            return None
+        with self._lock:
+            # Não guarda se uma invalidação chegou durante a carga
+            if snapshot == {table: self._generation.get(table, 0) for table in tables}:
+                self._entries[key] = (data, snapshot)
+        return data
+
+    def invalidate(self, *tables):
+        """Invalida as entradas que dependem de ``tables`` (todas se vazio)."""
+        with self._lock:
+            self._invalidate(tables)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "listening": self._listening,
+                "enabled": bool(self._enabled),
+            }
+
+    def _invalidate(self, tables):
+        if not tables:
+            self._entries.clear()
+            tables = list(self._generation)
+        for table in tables:
+            self._generation[table] = self._generation.get(table, 0) + 1
+
+    def _poll_versions(self, fetch_versions):
+        now = time.monotonic()
+        if self._enabled is not None and now - self._checked_at < self.poll_interval:
+            return
+        versions = fetch_versions()
+        with self._lock:
+            self._checked_at = now
+            self._enabled = versions is not None
+            for table, version in (versions or {}).items():
+                if self._db_versions.get(table) != version:
+                    self._db_versions[table] = version
+                    self._invalidate([table])
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # Processo novo (inclusive filho de fork): a thread do pai não existe aqui
+            self._pid = pid
+            self._listening = False
+            self._invalidate(())
+        threading.Thread(
+            target=self._listen_loop, args=(pid,), name="reference-cache-listener", daemon=True
+        ).start()
+
+    def _listen_loop(self, pid):
+        while self._pid == pid:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.conn_kwargs)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute("SELECT to_regclass('dados_referencia') IS NOT NULL")
+                    if not cur.fetchone()[0]:
+                        return
+                    cur.execute(f"LISTEN {self.CHANNEL}")
+                with self._lock:
+                    # Avisos enviados enquanto estava desconectado foram perdidos
+                    self._invalidate(())
+                    self._enabled = True
+                    self._listening = True
+                while self._pid == pid:
+                    if select.select([conn], [], [], 60.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        with self._lock:
+                            self._invalidate({n.payload for n in conn.notifies})
+                        conn.notifies.clear()
+            except psycopg2.Error as e:
+                print(f"[CACHE] LISTEN {self.CHANNEL} interrompido: {e}")
+            finally:
+                with self._lock:
+                    self._listening = False
+                if conn is not None and not conn.closed:
+                    conn.close()
+            time.sleep(self.poll_interval)
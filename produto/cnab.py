@@ -0,0 +1,198 @@
+# cnab.py - Arquivo de remessa para o banco (layout posicional estilo CNAB 240)
+
+import re
+import unicodedata
+
+
+TAMANHO_REGISTRO = 240
+FIM_DE_LINHA = "\r\n"
+VERSAO_LAYOUT = "001"
+NOME_EMPRESA = "ABERTURA DE CONTAS"
+
+# Campos de cada registro: (nome, tamanho, tipo). "N" = numerico alinhado a
+# direita com zeros; "A" = alfanumerico maiusculo sem acento, alinhado a
+# esquerda com brancos. Os campos somam TAMANHO_REGISTRO.
+HEADER_ARQUIVO = [
+    ("banco", 3, "N"),
+    ("lote", 4, "N"),
+    ("tipo_registro", 1, "N"),
+    ("brancos_1", 9, "A"),
+    ("nome_empresa", 30, "A"),
+    ("nome_banco", 30, "A"),
+    ("codigo_remessa", 1, "N"),
+    ("data_geracao", 8, "N"),
+    ("hora_geracao", 6, "N"),
+    ("nsa", 6, "N"),
+    ("versao_layout", 3, "N"),
+    ("brancos_2", 139, "A"),
+]
+
+DETALHE = [
+    ("banco", 3, "N"),
+    ("lote", 4, "N"),
+    ("tipo_registro", 1, "N"),
+    ("sequencial", 5, "N"),
+    ("segmento", 1, "A"),
+    ("num_remessa", 10, "N"),
+    ("id_remessa", 10, "N"),
+    ("tipo_inscricao", 2, "N"),
+    ("inscricao", 14, "N"),
+    ("nome_proponente", 60, "A"),
+    ("num_convenio", 30, "A"),
+    ("num_processo", 30, "A"),
+    ("data_remessa", 8, "N"),
+    ("brancos", 62, "A"),
+]
+
+TRAILER_ARQUIVO = [
+    ("banco", 3, "N"),
+    ("lote", 4, "N"),
+    ("tipo_registro", 1, "N"),
+    ("brancos_1", 9, "A"),
+    ("qtd_lotes", 6, "N"),
+    ("qtd_registros", 6, "N"),
+    ("brancos_2", 211, "A"),
+]
+
+# Retorno do banco: o header e o trailer seguem o layout acima; cada detalhe
+# (segmento "B") informa a conta aberta para um processo, ou a ocorrencia
+# que impediu a abertura.
+RETORNO_DETALHE = [
+    ("banco", 3, "N"),
+    ("lote", 4, "N"),
+    ("tipo_registro", 1, "N"),
+    ("sequencial", 5, "N"),
+    ("segmento", 1, "A"),
+    ("num_processo", 30, "A"),
+    ("tipo_inscricao", 2, "N"),
+    ("inscricao", 14, "N"),
+    ("num_agencia", 5, "N"),
+    ("dv_agencia", 1, "A"),
+    ("num_conta", 12, "N"),
+    ("dv_conta", 1, "A"),
+    ("data_abertura", 8, "N"),
+    ("ocorrencia", 2, "N"),
+    ("brancos", 151, "A"),
+]
+
+# Ocorrencia do retorno que significa conta aberta
+OCORRENCIA_CONTA_ABERTA = "00"
+
+for _layout in (HEADER_ARQUIVO, DETALHE, TRAILER_ARQUIVO, RETORNO_DETALHE):
+    assert sum(tamanho for _, tamanho, _ in _layout) == TAMANHO_REGISTRO
+
+_NAO_DIGITOS = re.compile(r"\D")
+
+
+def _alfanumerico(valor, tamanho):
+    texto = unicodedata.normalize("NFKD", "" if valor is None else str(valor))
+    texto = texto.encode("ascii", "ignore").decode("ascii").upper()
+    return texto[:tamanho].ljust(tamanho)
+
+
+def _numerico(valor, tamanho):
+    digitos = _NAO_DIGITOS.sub("", "" if valor is None else str(valor))
+    if len(digitos) > tamanho:
+        raise ValueError(f"valor {valor!r} nao cabe em {tamanho} posicoes")
+    return digitos.zfill(tamanho)
+
+
+def tamanho_campo(layout, nome):
+    """Número de posições do campo ``nome`` no layout."""
+    return next(tamanho for campo, tamanho, _tipo in layout if campo == nome)
+
+
+def chave_texto(valor, tamanho=30):
+    """Texto como sai no arquivo (maiúsculo, sem acento, cortado), sem brancos."""
+    return _alfanumerico(valor, tamanho).strip()
+
+
+def formatar_registro(layout, valores):
+    """Monta uma linha de TAMANHO_REGISTRO posições a partir de ``valores``."""
+    partes = []
+    for nome, tamanho, tipo in layout:
+        valor = valores.get(nome)
+        if tipo == "N":
+            partes.append(_numerico(valor, tamanho))
+        else:
+            partes.append(_alfanumerico(valor, tamanho))
+    return "".join(partes) + FIM_DE_LINHA
+
+
+def ler_registro(layout, linha):
+    """Fatia uma linha posicional em {campo: texto sem brancos nas pontas}."""
+    valores = {}
+    inicio = 0
+    for nome, tamanho, _tipo in layout:
+        valores[nome] = linha[inicio:inicio + tamanho].strip()
+        inicio += tamanho
+    return valores
+
+
+def tipo_registro(linha):
+    """Tipo do registro (posição 8): 0 header, 3 detalhe, 9 trailer."""
+    return linha[7:8]
+
+
+def inscricao(cpf_cnpj):
+    """(tipo_inscricao, digitos): 1 = CPF, 2 = CNPJ."""
+    digitos = _NAO_DIGITOS.sub("", cpf_cnpj or "")
+    return (1 if len(digitos) <= 11 else 2), digitos
+
+
+def nome_arquivo(id_banco, nsa, gerado_em):
+    return f"REM{int(id_banco):03d}_{gerado_em:%Y%m%d}_{int(nsa):06d}.rem"
+
+
+def escrever_arquivo(destino, banco, nsa, gerado_em, lotes):
+    """
+    Grava o arquivo em ``destino`` (arquivo texto aberto) a partir de
+    ``lotes`` de remessas (listas de dicts), um lote por vez. Retorna a
+    quantidade de registros de detalhe.
+    """
+    base = {"banco": banco["id_banco"]}
+    destino.write(formatar_registro(HEADER_ARQUIVO, {
+        **base,
+        "lote": 0,
+        "tipo_registro": 0,
+        "nome_empresa": NOME_EMPRESA,
+        "nome_banco": banco["nome"],
+        "codigo_remessa": 1,
+        "data_geracao": f"{gerado_em:%d%m%Y}",
+        "hora_geracao": f"{gerado_em:%H%M%S}",
+        "nsa": nsa,
+        "versao_layout": VERSAO_LAYOUT,
+    }))
+
+    sequencial = 0
+    for lote in lotes:
+        linhas = []
+        for remessa in lote:
+            sequencial += 1
+            tipo, digitos = inscricao(remessa["cpf_cnpj"])
+            dt = remessa["dt_remessa"]
+            linhas.append(formatar_registro(DETALHE, {
+                **base,
+                "lote": 1,
+                "tipo_registro": 3,
+                "sequencial": sequencial,
+                "segmento": "A",
+                "num_remessa": remessa["num_remessa"],
+                "id_remessa": remessa["id_remessa"],
+                "tipo_inscricao": tipo,
+                "inscricao": digitos,
+                "nome_proponente": remessa["nome_proponente"],
+                "num_convenio": remessa["num_convenio"],
+                "num_processo": remessa["num_processo"],
+                "data_remessa": f"{dt:%d%m%Y}" if dt else "",
+            }))
+        destino.write("".join(linhas))
+
+    destino.write(formatar_registro(TRAILER_ARQUIVO, {
+        **base,
+        "lote": 9999,
+        "tipo_registro": 9,
+        "qtd_lotes": 1,
+        "qtd_registros": sequencial + 2,
+    }))
+    return sequencial
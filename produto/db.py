@@ -0,0 +1,293 @@
+# db.py - Pool de conexões PostgreSQL usado pela camada de views
+
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo de espera configurado."""
+
+
+class ConnectionPool:
+    """
+    Pool de conexões psycopg2 thread-safe.
+
+    - mantém entre ``minconn`` e ``maxconn`` conexões abertas;
+    - valida a conexão no checkout (``SELECT 1``) quando ela ficou ociosa
+      por mais de ``ping_after`` segundos;
+    - recicla conexões com mais de ``max_lifetime`` segundos de vida;
+    - é seguro sob servidores pre-fork: o processo filho descarta as
+      conexões herdadas do pai sem fechá-las (fechar enviaria Terminate
+      no socket compartilhado e derrubaria a sessão do pai);
+    - registra contadores de espera no checkout e de esgotamento do pool.
+    """
+
+    def __init__(self, conn_kwargs, minconn=1, maxconn=10, max_lifetime=1800,
+                 timeout=10.0, ping_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Tamanho de pool invalido: minconn=%s maxconn=%s" % (minconn, maxconn))
+
+        self.conn_kwargs = dict(conn_kwargs)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()   # (conn, criada_em, devolvida_em)
+        self._born = {}        # id(conn) -> criada_em, para conexões emprestadas
+        self._size = 0
+        self._pid = os.getpid()
+        self._orphans = []
+        self._prefilled = False
+        self._reset_stats()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    # ---------------------------
+    # Checkout / devolução
+    # ---------------------------
+
+    def getconn(self):
+        """Retira uma conexão do pool, aguardando até ``timeout`` segundos."""
+        self._check_pid()
+        if not self._prefilled:
+            self._prefill()
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                entry = None
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    if not waited:
+                        waited = True
+                        self._stats["exhausted"] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            "Pool esgotado: %d conexoes em uso ha %.1fs" % (self.maxconn, self.timeout)
+                        )
+                    self._cond.wait(remaining)
+
+            conn = self._checkout(entry)
+            if conn is not None:
+                break
+
+        wait = time.monotonic() - started
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_total"] += wait
+            if wait > self._stats["wait_max"]:
+                self._stats["wait_max"] = wait
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Devolve a conexão ao pool (ou a fecha, se ``discard`` ou inválida)."""
+        if conn is None:
+            return
+        if os.getpid() != self._pid:
+            # Conexão herdada do processo pai: não pertence a este pool.
+            self._orphans.append(conn)
+            return
+
+        with self._cond:
+            born = self._born.pop(id(conn), None)
+        if born is None:
+            # Conexão que não saiu deste pool (ou já devolvida).
+            return
+
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if not discard and self._expired(born):
+            discard = True
+            self._bump("recycled")
+
+        if discard or conn.closed:
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append((conn, born, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Fecha todas as conexões ociosas do pool."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn, _born, _returned in idle:
+            self._close(conn)
+
+    # ---------------------------
+    # Métricas
+    # ---------------------------
+
+    def stats(self):
+        """Retorna um retrato dos contadores do pool."""
+        with self._cond:
+            data = dict(self._stats)
+            data.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=len(self._born),
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+            )
+        checkouts = data["checkouts"]
+        data["wait_avg"] = data["wait_total"] / checkouts if checkouts else 0.0
+        return data
+
+    # ---------------------------
+    # Internos
+    # ---------------------------
+
+    def _reset_stats(self):
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "failed_checks": 0,
+            "exhausted": 0,
+            "timeouts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    def _bump(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.conn_kwargs)
+        self._bump("created")
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _expired(self, born):
+        return self.max_lifetime and time.monotonic() - born > self.max_lifetime
+
+    def _healthy(self, conn, returned):
+        if conn.closed:
+            return False
+        if self.ping_after is None or time.monotonic() - returned < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self, entry):
+        """
+        Valida (ou cria) a conexão reservada em ``getconn``.
+        Retorna None quando a conexão ociosa estava inválida; o chamador
+        tenta de novo sem perder a vaga no pool.
+        """
+        if entry is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            born = time.monotonic()
+        else:
+            conn, born, returned = entry
+            if self._expired(born):
+                self._bump("recycled")
+                valid = False
+            else:
+                valid = self._healthy(conn, returned)
+                if not valid:
+                    self._bump("failed_checks")
+            if not valid:
+                self._close(conn)
+                with self._cond:
+                    self._size -= 1
+                return None
+
+        with self._cond:
+            self._born[id(conn)] = born
+        return conn
+
+    def _prefill(self):
+        with self._cond:
+            if self._prefilled:
+                return
+            self._prefilled = True
+            missing = max(self.minconn - self._size, 0)
+            self._size += missing
+        for _ in range(missing):
+            try:
+                conn = self._connect()
+            except Exception as e:
+                print(f"[DB POOL] Erro ao pre-abrir conexao: {e}")
+                with self._cond:
+                    self._size -= 1
+                continue
+            now = time.monotonic()
+            with self._cond:
+                self._idle.append((conn, now, now))
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._after_fork()
+
+    def _after_fork(self):
+        # As conexões herdadas compartilham o socket com o processo pai.
+        # Guardamos as referências (para o GC não fechá-las) e recomeçamos.
+        self._orphans.extend(conn for conn, _born, _returned in self._idle)
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._born = {}
+        self._size = 0
+        self._pid = os.getpid()
+        self._prefilled = False
+        self._reset_stats()
+
+
+def pool_from_env(conn_kwargs):
+    """Cria o pool lendo os limites das variáveis de ambiente DB_POOL_*."""
+    return ConnectionPool(
+        conn_kwargs,
+        minconn=int(os.environ.get("DB_POOL_MIN", 1)),
+        maxconn=int(os.environ.get("DB_POOL_MAX", 10)),
+        max_lifetime=float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800)),
+        timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        ping_after=float(os.environ.get("DB_POOL_PING_AFTER", 30)),
+    )
@@ -0,0 +1,33 @@
+# documentos.py - Validacao de CPF/CNPJ (digitos verificadores)
+
+import re
+
+
+_NAO_DIGITOS = re.compile(r"\D")
+
+
+def _digito(digitos, pesos):
+    resto = sum(int(d) * p for d, p in zip(digitos, pesos)) % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+
+def cpf_valido(digitos):
+    if len(digitos) != 11 or digitos == digitos[0] * 11:
+        return False
+    dv1 = _digito(digitos[:9], range(10, 1, -1))
+    dv2 = _digito(digitos[:9] + dv1, range(11, 1, -1))
+    return digitos[9:] == dv1 + dv2
+
+
+def cnpj_valido(digitos):
+    if len(digitos) != 14 or digitos == digitos[0] * 14:
+        return False
+    pesos = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+    dv1 = _digito(digitos[:12], pesos)
+    dv2 = _digito(digitos[:12] + dv1, [6] + pesos)
+    return digitos[12:] == dv1 + dv2
+
+
+def cpf_cnpj_valido(valor):
+    digitos = _NAO_DIGITOS.sub("", valor or "")
+    return cpf_valido(digitos) if len(digitos) <= 11 else cnpj_valido(digitos)
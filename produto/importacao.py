@@ -0,0 +1,282 @@
+# importacao.py - Leitura e validacao de planilhas de importacao (CSV/XLSX):
+# remessas e catalogo de agencias de um banco
+
+import csv
+import itertools
+import re
+import zipfile
+from datetime import date, datetime
+
+from produto.documentos import cpf_cnpj_valido
+
+
+# Colunas aceitas (cabecalho, sem diferenciar maiusculas). concedente aceita
+# codigo_secretaria ou sigla; banco e o codigo (id_banco).
+COLUNAS_OBRIGATORIAS = ("num_processo", "nome_proponente", "cpf_cnpj", "num_convenio", "concedente")
+COLUNAS_OPCIONAIS = ("banco", "situacao", "dt_remessa")
+
+# Tamanhos das colunas de remessa
+TAMANHOS = {"num_processo": 100, "nome_proponente": 100, "cpf_cnpj": 18, "num_convenio": 100}
+
+_NAO_DIGITOS = re.compile(r"\D")
+
+
+class ErroImportacao(ValueError):
+    """Arquivo que não pode ser lido (formato, cabeçalho)."""
+
+
+def xlsx_leitura_disponivel():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# ---------------------------
+# Leitura
+# ---------------------------
+
+def _texto(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        # Numero digitado em celula numerica (ex.: codigo do banco)
+        return str(int(valor))
+    if isinstance(valor, (datetime, date)):
+        return valor.strftime("%Y-%m-%d")
+    return str(valor).strip()
+
+
+def _decodifica(stream):
+    # Planilhas salvas pelo Excel costumam vir em latin-1
+    for numero, bruta in enumerate(stream):
+        try:
+            linha = bruta.decode("utf-8")
+        except UnicodeDecodeError:
+            linha = bruta.decode("latin-1")
+        yield linha.lstrip("\ufeff") if numero == 0 else linha
+
+
+def _linhas_csv(stream):
+    linhas = _decodifica(stream)
+    cabecalho = next(linhas, "")
+    delimitador = ";" if cabecalho.count(";") >= cabecalho.count(",") else ","
+    yield from csv.reader(itertools.chain([cabecalho], linhas), delimiter=delimitador)
+
+
+def _linhas_xlsx(stream):
+    try:
+        import openpyxl
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ErroImportacao("leitura de XLSX requer o pacote openpyxl")
+    # read_only: as linhas sao lidas do XML sob demanda, sem carregar a planilha
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        # Arquivo corrompido ou renomeado (KeyError: zip sem as partes do XLSX)
+        raise ErroImportacao("arquivo XLSX inválido")
+    try:
+        for linha in workbook.active.iter_rows(values_only=True):
+            yield linha
+    finally:
+        workbook.close()
+
+
+def ler_linhas(stream, nome_arquivo, obrigatorias=COLUNAS_OBRIGATORIAS, sinonimos=None):
+    """
+    Gera (numero_da_linha, {coluna: texto}) de um CSV ou XLSX com cabeçalho.
+    Linhas totalmente vazias são puladas; ``sinonimos`` renomeia colunas
+    do cabeçalho ({nome no arquivo: nome esperado}).
+    """
+    if nome_arquivo.lower().endswith((".xlsx", ".xlsm")):
+        linhas = _linhas_xlsx(stream)
+    else:
+        linhas = _linhas_csv(stream)
+
+    try:
+        cabecalho = [_texto(c).lower() for c in next(linhas)]
+    except StopIteration:
+        raise ErroImportacao("arquivo vazio")
+    if sinonimos:
+        cabecalho = [sinonimos.get(c, c) for c in cabecalho]
+    faltando = [c for c in obrigatorias if c not in cabecalho]
+    if faltando:
+        raise ErroImportacao(f"colunas ausentes: {', '.join(faltando)}")
+
+    for numero, valores in enumerate(linhas, start=2):
+        valores = [_texto(v) for v in valores]
+        if not any(valores):
+            continue
+        yield numero, dict(zip(cabecalho, valores))
+
+
+# ---------------------------
+# Validacao
+# ---------------------------
+
+def _data(texto):
+    for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    return None
+
+
+class ValidadorRemessas:
+    """
+    Valida linhas de remessa contra mapas em memória (concedentes por código
+    e sigla, bancos por código, situações válidas) e contra o próprio
+    arquivo (num_processo repetido). ``validar`` devolve (remessa, erros).
+    """
+
+    def __init__(self, concedentes, bancos, situacoes, situacao_padrao):
+        self.concedentes = {}
+        for concedente in concedentes:
+            self.concedentes[str(concedente["codigo_secretaria"]).strip().upper()] = concedente["id_concedente"]
+            self.concedentes.setdefault(str(concedente["sigla"]).strip().upper(), concedente["id_concedente"])
+        self.bancos = {int(banco["id_banco"]) for banco in bancos}
+        self.situacoes = {s.lower(): s for s in situacoes}
+        self.situacao_padrao = situacao_padrao
+        self.processos = {}
+
+    def validar(self, numero, linha):
+        erros = []
+        remessa = {"linha": numero}
+
+        for coluna in ("num_processo", "nome_proponente", "cpf_cnpj", "num_convenio"):
+            valor = linha.get(coluna, "")
+            if not valor:
+                erros.append(f"{coluna} obrigatorio")
+            elif len(valor) > TAMANHOS[coluna]:
+                erros.append(f"{coluna} com mais de {TAMANHOS[coluna]} caracteres")
+            remessa[coluna] = valor
+
+        if remessa["cpf_cnpj"] and not cpf_cnpj_valido(remessa["cpf_cnpj"]):
+            erros.append("CPF/CNPJ invalido (digito verificador)")
+
+        concedente = linha.get("concedente", "").upper()
+        remessa["id_concedente"] = self.concedentes.get(concedente)
+        if not concedente:
+            erros.append("concedente obrigatorio")
+        elif remessa["id_concedente"] is None:
+            erros.append(f"concedente {linha.get('concedente')!r} nao cadastrado")
+
+        banco = linha.get("banco", "")
+        remessa["id_banco"] = None
+        if banco:
+            if not (banco.isascii() and banco.isdigit()) or int(banco) not in self.bancos:
+                erros.append(f"banco {banco!r} nao cadastrado")
+            else:
+                remessa["id_banco"] = int(banco)
+
+        situacao = linha.get("situacao", "")
+        remessa["situacao"] = self.situacoes.get(situacao.lower()) if situacao else self.situacao_padrao
+        if remessa["situacao"] is None:
+            erros.append(f"situacao {situacao!r} invalida")
+
+        dt_remessa = linha.get("dt_remessa", "")
+        remessa["dt_remessa"] = _data(dt_remessa) if dt_remessa else None
+        if dt_remessa and remessa["dt_remessa"] is None:
+            erros.append(f"dt_remessa {dt_remessa!r} invalida (use AAAA-MM-DD ou DD/MM/AAAA)")
+
+        processo = remessa["num_processo"]
+        if processo:
+            if processo in self.processos:
+                erros.append(f"num_processo repetido no arquivo (linha {self.processos[processo]})")
+            else:
+                self.processos[processo] = numero
+
+        return remessa, erros
+
+
+# Ordem das colunas no COPY para a tabela de staging
+COLUNAS_STAGING = (
+    "linha", "num_processo", "nome_proponente", "cpf_cnpj", "num_convenio",
+    "id_concedente", "id_banco", "situacao", "dt_remessa",
+)
+
+
+def escrever_staging(writer, remessa):
+    """Uma linha CSV para o COPY ... (FORMAT csv); None vira campo vazio (NULL)."""
+    writer.writerow(["" if remessa[c] is None else remessa[c] for c in COLUNAS_STAGING])
+
+
+# ---------------------------
+# Catalogo de agencias
+# ---------------------------
+
+COLUNAS_AGENCIA = ("num_agencia", "dv_agencia", "nome_agencia", "logadouro", "cidade", "uf")
+COLUNAS_AGENCIA_OBRIGATORIAS = ("num_agencia", "nome_agencia", "logadouro", "cidade")
+
+# Cabecalhos alternativos aceitos nos catalogos dos bancos
+SINONIMOS_AGENCIA = {"agencia": "num_agencia", "dv": "dv_agencia", "nome": "nome_agencia",
+                     "logradouro": "logadouro", "endereco": "logadouro", "municipio": "cidade"}
+
+TAMANHOS_AGENCIA = {"nome_agencia": 100, "logadouro": 300, "cidade": 100}
+
+UFS = frozenset(
+    "AC AL AP AM BA CE DF ES GO MA MT MS MG PA PB PR PE PI RJ RN RS RO RR SC SP SE TO".split()
+)
+
+_DV = re.compile(r"^[0-9A-Za-z]$")
+
+
+class ValidadorAgencias:
+    """
+    Valida linhas do catálogo de agências de um banco. A chave é
+    num_agencia (o dígito acompanha o número); número repetido no arquivo
+    é erro, pois o upsert não pode atualizar a mesma agência duas vezes.
+    """
+
+    def __init__(self, id_banco):
+        self.id_banco = id_banco
+        self.numeros = {}
+
+    def validar(self, numero, linha):
+        erros = []
+        agencia = {"linha": numero, "id_banco": self.id_banco}
+
+        num_agencia = linha.get("num_agencia", "")
+        dv_agencia = linha.get("dv_agencia", "")
+        if "-" in num_agencia and not dv_agencia:
+            # "1234-5" numa coluna so
+            num_agencia, _, dv_agencia = num_agencia.rpartition("-")
+        num_agencia = _NAO_DIGITOS.sub("", num_agencia)
+        agencia["num_agencia"] = int(num_agencia) if num_agencia and len(num_agencia) <= 9 else None
+        if agencia["num_agencia"] is None:
+            erros.append(f"num_agencia {linha.get('num_agencia')!r} invalido")
+        agencia["dv_agencia"] = dv_agencia.strip().upper()
+        if not _DV.match(agencia["dv_agencia"]):
+            erros.append(f"dv_agencia {dv_agencia!r} invalido")
+
+        for coluna, tamanho in TAMANHOS_AGENCIA.items():
+            valor = linha.get(coluna, "")
+            if not valor:
+                erros.append(f"{coluna} obrigatorio")
+            elif len(valor) > tamanho:
+                erros.append(f"{coluna} com mais de {tamanho} caracteres")
+            agencia[coluna] = valor
+
+        uf = linha.get("uf", "").upper()
+        agencia["uf"] = uf or None
+        if uf and uf not in UFS:
+            erros.append(f"uf {uf!r} invalida")
+
+        chave = agencia["num_agencia"]
+        if chave is not None:
+            if chave in self.numeros:
+                erros.append(f"agencia repetida no arquivo (linha {self.numeros[chave]})")
+            else:
+                self.numeros[chave] = numero
+
+        return agencia, erros
+
+
+COLUNAS_STAGING_AGENCIA = ("linha", "id_banco") + COLUNAS_AGENCIA
+
+
+def escrever_staging_agencia(writer, agencia):
+    writer.writerow(["" if agencia[c] is None else agencia[c] for c in COLUNAS_STAGING_AGENCIA])
@@ -0,0 +1,241 @@
+# listagem.py - Consultas das telas de listagem, declaradas por view
+
+import re
+from datetime import date
+
+from produto.documentos import cpf_cnpj_valido
+
+
+# As buscas textuais dependem da migration 7c1f04d93a2e (pg_trgm, unaccent,
+# funcao f_unaccent e indices GIN trigram nas colunas pesquisadas)
+
+def like_pattern(term, prefix=False):
+    """Escapa os curingas do LIKE e monta o padrão (%termo% ou termo%)."""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%" if prefix else f"%{escaped}%"
+
+
+def text_search(column):
+    """ILIKE sem acento ("Joao" encontra "João"), servido pelo índice trigram."""
+    return f"f_unaccent({column}) ILIKE f_unaccent(%s)"
+
+
+_DOCUMENTO = re.compile(r"^[\d.\-/\s]+$", re.ASCII)
+
+
+def documento_cpf_cnpj(termo):
+    """
+    Dígitos de um termo de busca que é um CPF/CNPJ válido (com ou sem
+    pontuação), no formato de remessa.cpf_cnpj_digits; None caso contrário.
+    """
+    if not _DOCUMENTO.match(termo):
+        return None
+    digitos = re.sub(r"\D", "", termo)
+    if len(digitos) not in (11, 14) or not cpf_cnpj_valido(digitos):
+        return None
+    return digitos
+
+
+# Ordenacao de texto em pt-BR (acentos, maiusculas) pela ICU; os indices das
+# colunas ordenaveis usam a mesma collation, entao o ORDER BY e um index scan
+# (migration a3f6d2c8e9b1)
+COLLATION_PT_BR = '"pt-BR-x-icu"'
+
+
+def texto_pt_br(expr):
+    """Expressão de ordenação de texto com a collation pt-BR dos índices."""
+    return f"{expr} COLLATE {COLLATION_PT_BR}"
+
+
+def data_iso(valor):
+    """Normalizador de filtro de data: AAAA-MM-DD válida ou "" (filtro ignorado)."""
+    try:
+        return date.fromisoformat(valor).isoformat()
+    except ValueError:
+        return ""
+
+
+# Condicoes de filtro de periodo (filtros da Listagem). Intervalo semiaberto
+# na coluna pura: "ate" inclui o dia inteiro sem aplicar funcao na coluna, e
+# o indice em (..., coluna) responde com um range scan
+DESDE = ">= %s::date"
+ATE = "< %s::date + 1"
+
+
+def _nome_coluna(expr):
+    """Nome da coluna no resultado: o alias (AS) ou o que vem depois do ponto."""
+    partes = re.split(r"\s+AS\s+", expr.strip(), flags=re.IGNORECASE)
+    return partes[-1].split(".")[-1].strip()
+
+
+def _filtro(spec):
+    """(expressão, normaliza, condição) de uma entrada de Listagem.filtros."""
+    if not isinstance(spec, tuple):
+        return spec, None, "= %s"
+    if len(spec) == 2:
+        return spec + ("= %s",)
+    return spec
+
+
+def _referencia(alias, texto):
+    return re.search(rf"(?<![\w.]){re.escape(alias)}\.", texto) is not None
+
+
+class Consulta:
+    """SQL de uma listagem para os filtros de um request (ver Listagem.consulta)."""
+
+    def __init__(self, listagem, busca, valores, sort, descendente, select_sql, from_sql, where_clause, params):
+        self.listagem = listagem
+        self.busca = busca
+        self.valores = valores
+        self.sort = sort
+        self.descendente = descendente
+        self.ordem = listagem.ordenacoes[sort]
+        self.select_sql = select_sql
+        self.from_sql = from_sql
+        self.where_clause = where_clause
+        self.params = params
+
+    @property
+    def dir(self):
+        return "desc" if self.descendente else "asc"
+
+    @property
+    def order_by(self):
+        direcao = " DESC" if self.descendente else ""
+        return " ORDER BY " + ", ".join(f"{expr}{direcao}" for expr, _ in self.ordem)
+
+    @property
+    def count_query(self):
+        return f"SELECT COUNT(*) AS count FROM {self.from_sql}{self.where_clause}"
+
+    def argumentos(self):
+        """Filtros preenchidos, como parâmetros de URL."""
+        argumentos = {"search": self.busca} if self.busca else {}
+        argumentos.update((chave, valor) for chave, valor in self.valores.items() if valor)
+        if self.sort != self.listagem.sort_padrao or self.descendente:
+            argumentos.update(sort=self.sort, dir=self.dir)
+        return argumentos
+
+
+class Listagem:
+    """
+    Declaração de uma tela de listagem; ``consulta`` monta o SQL.
+
+    tabela: "tabela alias" (ex.: "remessa r").
+    colunas: expressões projetadas na página (nada de SELECT *).
+    ordenacoes: {nome no ?sort=: [(expressão, coluna no resultado)]}; a
+        primeira é a padrão. Cada uma termina em coluna única, serve ao
+        OFFSET, ao keyset e à exportação (?dir=desc inverte todas as
+        colunas) e precisa de um índice composto nas mesmas colunas; texto
+        usa texto_pt_br(). Ordenação por coluna de tabela do join não tem
+        índice que a sirva: nunca é a padrão e fica comentada na
+        declaração como exceção. Colunas da ordenação que não estão projetadas
+        entram no SELECT automaticamente. Só essas chaves são aceitas.
+    joins: {alias: "JOIN ..."} na ordem em que dependem uns dos outros.
+        LEFT JOIN por chave não muda o número de linhas e só entra quando o
+        alias é usado (projeção, filtro, ordem ou outro join); JOIN interno
+        entra sempre, inclusive na contagem.
+    busca: colunas do ?search= (ILIKE sem acento, OR entre elas).
+    busca_numero: (expressão, "igual" | "prefixo") somada à busca quando o
+        termo é só dígitos (ex.: código do banco, número da agência).
+    busca_documento: coluna de dígitos de CPF/CNPJ; um termo que é um
+        documento válido vira só igualdade nela (índice btree), sem ILIKE.
+    filtros: {parâmetro: expressão} ou {parâmetro: (expressão, normaliza)},
+        igualdade exata, ou (expressão, normaliza, condição) com a condição
+        em SQL (ex.: DESDE/ATE para períodos); o mesmo parâmetro nunca gera
+        dois predicados.
+    colunas_exportacao: projeção do ?format= (padrão: colunas).
+    agrupamentos: abas do XLSX, repassadas a export_response.
+    """
+
+    def __init__(self, nome, tabela, colunas, ordenacoes, joins=None, busca=(), busca_numero=None,
+                 busca_documento=None, filtros=None, colunas_exportacao=None, agrupamentos=None):
+        self.nome = nome
+        self.tabela = tabela
+        self.nome_tabela = tabela.split()[0]
+        self.ordenacoes = {chave: list(ordem) for chave, ordem in ordenacoes.items()}
+        self.sort_padrao = next(iter(self.ordenacoes))
+        self.colunas = self._com_ordem(colunas)
+        self.colunas_exportacao = self._com_ordem(colunas_exportacao) if colunas_exportacao else self.colunas
+        self.joins = dict(joins or {})
+        self.busca = tuple(busca)
+        self.busca_numero = busca_numero
+        self.busca_documento = busca_documento
+        self.filtros = {parametro: _filtro(spec) for parametro, spec in (filtros or {}).items()}
+        self.agrupamentos = agrupamentos
+
+    def _com_ordem(self, colunas):
+        colunas = list(colunas)
+        nomes = {_nome_coluna(coluna) for coluna in colunas}
+        for ordem in self.ordenacoes.values():
+            for expr, chave in ordem:
+                if chave not in nomes:
+                    nomes.add(chave)
+                    expr = expr.split(" COLLATE ")[0]
+                    colunas.append(expr if _nome_coluna(expr) == chave else f"{expr} AS {chave}")
+        return colunas
+
+    def _joins(self, *textos):
+        """Joins necessários para os trechos de SQL dados, na ordem declarada."""
+        texto = " ".join(textos)
+        usados = []
+        for alias, sql in reversed(list(self.joins.items())):
+            if not sql.lstrip().upper().startswith("LEFT") or _referencia(alias, texto):
+                usados.append(sql)
+                texto += " " + sql
+        return "".join(f" {sql.strip()}" for sql in reversed(usados))
+
+    def _filtros(self, args):
+        predicados = []
+        params = []
+        busca = (args.get("search") or "").strip()
+        documento = documento_cpf_cnpj(busca) if busca and self.busca_documento else None
+        if documento:
+            predicados.append(f"{self.busca_documento} = %s")
+            params.append(documento)
+        elif busca:
+            termos = [text_search(coluna) for coluna in self.busca]
+            params.extend(like_pattern(busca) for _ in self.busca)
+            # isdigit() aceita "²" e outros digitos Unicode que int() recusa
+            if self.busca_numero and busca.isascii() and busca.isdigit():
+                expr, modo = self.busca_numero
+                if modo == "prefixo":
+                    termos.append(f"{expr} LIKE %s")
+                    params.append(like_pattern(busca, prefix=True))
+                elif len(busca) <= 9:
+                    # Acima de 9 digitos nao cabe em INTEGER
+                    termos.append(f"{expr} = %s")
+                    params.append(int(busca))
+            if termos:
+                predicados.append(termos[0] if len(termos) == 1 else "(" + " OR ".join(termos) + ")")
+
+        valores = {}
+        for parametro, (expr, normaliza, condicao) in self.filtros.items():
+            valor = (args.get(parametro) or "").strip()
+            if normaliza and valor:
+                valor = normaliza(valor)
+            valores[parametro] = valor
+            if valor:
+                predicados.append(f"{expr} {condicao}")
+                params.append(valor)
+        return busca, valores, predicados, params
+
+    def consulta(self, args, exportacao=False):
+        """Consulta para os filtros em ``args`` (request.args ou request.form)."""
+        busca, valores, predicados, params = self._filtros(args)
+        where_clause = " WHERE " + " AND ".join(predicados) if predicados else ""
+
+        # Fora da lista de ordenacoes, vale a padrao: nunca vira SQL
+        sort = args.get("sort") or ""
+        if sort not in self.ordenacoes:
+            sort = self.sort_padrao
+        descendente = args.get("dir") == "desc"
+
+        colunas = self.colunas_exportacao if exportacao else self.colunas
+        projecao = ",\n            ".join(colunas)
+        ordem = " ".join(expr for expr, _ in self.ordenacoes[sort])
+        joins_select = self._joins(projecao, where_clause, ordem)
+        select_sql = f"SELECT\n            {projecao}\n        FROM {self.tabela}{joins_select}"
+        from_sql = self.tabela + self._joins(where_clause)
+        return Consulta(self, busca, valores, sort, descendente, select_sql, from_sql, where_clause, params)
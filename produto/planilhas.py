@@ -0,0 +1,129 @@
+# planilhas.py - Planilhas XLSX em memoria constante (relatorios de auditoria)
+
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+
+# Limites do formato XLSX
+MAX_LINHAS_ABA = 1048576
+MAX_NOME_ABA = 31
+
+# Acima disso, os grupos restantes vao para uma aba "Outros" (cada aba
+# mantem um arquivo temporario aberto ate o fechamento da planilha)
+MAX_ABAS = 100
+
+_CARACTERES_INVALIDOS = re.compile(r"[\[\]:*?/\\]")
+
+
+def xlsx_disponivel():
+    try:
+        import xlsxwriter  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_OUTROS = object()
+
+
+class _Aba:
+    def __init__(self, worksheet, colunas, formato_cabecalho):
+        self.worksheet = worksheet
+        worksheet.write_row(0, 0, colunas, formato_cabecalho)
+        worksheet.freeze_panes(1, 0)
+        self.linha = 1
+
+
+class PlanilhaAgrupada:
+    """
+    Planilha com uma aba de resumo e uma aba por grupo (situação, concedente...).
+
+    Usa o XlsxWriter em ``constant_memory``: cada linha é gravada em disco
+    assim que a próxima começa, então a memória não cresce com o número de
+    linhas. As linhas precisam chegar em ordem dentro de cada aba, o que
+    vale para qualquer cursor (o grupo só escolhe a aba).
+    """
+
+    def __init__(self, destino, colunas, coluna_grupo, titulo_grupo):
+        import xlsxwriter
+
+        self.colunas = list(colunas)
+        self.indice_grupo = self.colunas.index(coluna_grupo)
+        self.titulo_grupo = titulo_grupo
+        self.workbook = xlsxwriter.Workbook(
+            destino,
+            {"constant_memory": True, "strings_to_numbers": False, "default_date_format": "dd/mm/yyyy"},
+        )
+        self.formatos = {
+            "cabecalho": self.workbook.add_format({"bold": True, "bg_color": "#DDEBF7"}),
+            "data_hora": self.workbook.add_format({"num_format": "dd/mm/yyyy hh:mm"}),
+            "total": self.workbook.add_format({"bold": True}),
+        }
+        # Resumo criado primeiro para ser a primeira aba; preenchido no fim
+        self.resumo = self.workbook.add_worksheet("Resumo")
+        self.abas = {}
+        self.nomes = set()
+        self.totais = {}
+
+    def _nome_aba(self, grupo):
+        if grupo is _OUTROS:
+            nome = "Outros"
+        else:
+            nome = _CARACTERES_INVALIDOS.sub(" ", "" if grupo is None else str(grupo))
+            nome = nome.strip("' ")[:MAX_NOME_ABA] or "(sem valor)"
+        base, n = nome, 2
+        while nome.lower() in self.nomes or nome.lower() == "resumo":
+            sufixo = f" ({n})"
+            nome = base[: MAX_NOME_ABA - len(sufixo)] + sufixo
+            n += 1
+        self.nomes.add(nome.lower())
+        return nome
+
+    def _aba(self, grupo):
+        if grupo not in self.abas and len(self.abas) >= MAX_ABAS:
+            grupo = _OUTROS
+        aba = self.abas.get(grupo)
+        if aba is None or aba.linha >= MAX_LINHAS_ABA:
+            # Grupo novo, ou aba cheia: continua em "Nome (2)"
+            worksheet = self.workbook.add_worksheet(self._nome_aba(grupo))
+            aba = self.abas[grupo] = _Aba(worksheet, self.colunas, self.formatos["cabecalho"])
+        return aba
+
+    def escrever(self, linhas):
+        for linha in linhas:
+            grupo = linha[self.indice_grupo]
+            aba = self._aba(grupo)
+            for coluna, valor in enumerate(linha):
+                self._celula(aba.worksheet, aba.linha, coluna, valor)
+            aba.linha += 1
+            self.totais[grupo] = self.totais.get(grupo, 0) + 1
+
+    def _celula(self, worksheet, linha, coluna, valor):
+        if valor is None:
+            return
+        if isinstance(valor, datetime):
+            worksheet.write_datetime(linha, coluna, valor.replace(tzinfo=None), self.formatos["data_hora"])
+        elif isinstance(valor, date):
+            worksheet.write_datetime(linha, coluna, datetime(valor.year, valor.month, valor.day))
+        elif isinstance(valor, bool):
+            worksheet.write_boolean(linha, coluna, valor)
+        elif isinstance(valor, (int, float, Decimal)):
+            worksheet.write_number(linha, coluna, float(valor))
+        else:
+            # Texto sempre como texto: CPF/CNPJ e numeros de conta com zero a esquerda
+            worksheet.write_string(linha, coluna, str(valor))
+
+    def fechar(self):
+        """Preenche o resumo (total por grupo) e grava o arquivo."""
+        self.resumo.write_row(0, 0, [self.titulo_grupo, "Quantidade"], self.formatos["cabecalho"])
+        linha = 1
+        for grupo, quantidade in sorted(self.totais.items(), key=lambda item: str(item[0] or "")):
+            self.resumo.write_string(linha, 0, str(grupo if grupo is not None else "(sem valor)"))
+            self.resumo.write_number(linha, 1, quantidade)
+            linha += 1
+        self.resumo.write_string(linha, 0, "Total", self.formatos["total"])
+        self.resumo.write_number(linha, 1, sum(self.totais.values()), self.formatos["total"])
+        self.resumo.set_column(0, 0, 40)
+        self.resumo.set_column(1, 1, 14)
+        self.workbook.close()
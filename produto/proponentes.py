@@ -0,0 +1,41 @@
+# proponentes.py - Agrupamento das grafias do nome de um proponente (mesmo CPF/CNPJ)
+
+# Similaridade trigram (pg_trgm, nomes sem acento e minusculos) a partir da
+# qual duas grafias do mesmo documento sao tratadas como o mesmo nome
+LIMIAR_SIMILARIDADE = 0.6
+
+
+def agrupar_grafias(grafias, pares):
+    """
+    Agrupa as grafias de um documento em componentes conexos dos pares
+    semelhantes (se A~B e B~C, as três ficam juntas).
+
+    grafias: {nome: (remessas com essa grafia, menor id_remessa)}.
+    pares: [(nome_a, nome_b)] com similaridade >= LIMIAR_SIMILARIDADE.
+
+    Retorna {nome: nome canônico}; o canônico do grupo é a grafia mais
+    usada e, no empate, a mais antiga.
+    """
+    pai = {nome: nome for nome in grafias}
+
+    def raiz(nome):
+        while pai[nome] != nome:
+            pai[nome] = pai[pai[nome]]
+            nome = pai[nome]
+        return nome
+
+    for nome_a, nome_b in pares:
+        raiz_a, raiz_b = raiz(nome_a), raiz(nome_b)
+        if raiz_a != raiz_b:
+            pai[raiz_b] = raiz_a
+
+    grupos = {}
+    for nome in grafias:
+        grupos.setdefault(raiz(nome), []).append(nome)
+
+    canonicos = {}
+    for nomes in grupos.values():
+        canonico = max(nomes, key=lambda nome: (grafias[nome][0], -grafias[nome][1]))
+        for nome in nomes:
+            canonicos[nome] = canonico
+    return canonicos
@@ -0,0 +1,225 @@
+# retorno.py - Leitura do arquivo de retorno do banco e conciliacao com as remessas
+
+import csv
+import io
+import re
+from datetime import date, datetime
+
+from produto import cnab
+
+
+# Colunas do retorno em CSV (separador ";" ou ",", com cabecalho)
+CAMPOS_CSV = ("num_processo", "cpf_cnpj", "num_agencia", "dv_agencia", "num_conta", "dv_conta", "dt_abertura")
+
+_DIGITOS = re.compile(r"^\d+$", re.ASCII)
+_DV = re.compile(r"^[0-9A-Za-z]$")
+_NAO_DIGITOS = re.compile(r"\D", re.ASCII)
+
+
+class RegistroInvalido(ValueError):
+    """Linha do retorno que não vira conta (vai para o relatório de rejeitados)."""
+
+
+def _linhas_texto(stream):
+    """Decodifica as linhas de um upload binário, uma por vez."""
+    for numero, bruta in enumerate(stream, start=1):
+        try:
+            linha = bruta.decode("utf-8")
+        except UnicodeDecodeError:
+            linha = bruta.decode("latin-1")
+        if numero == 1:
+            linha = linha.lstrip("\ufeff")
+        yield numero, linha.rstrip("\r\n")
+
+
+def _data(texto):
+    for formato in ("%d%m%Y", "%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise RegistroInvalido(f"data de abertura invalida: {texto!r}")
+
+
+def _normaliza(bruto):
+    """Valida e padroniza os campos comuns aos dois formatos."""
+    num_conta = (bruto.get("num_conta") or "").strip()
+    num_agencia = _NAO_DIGITOS.sub("", bruto.get("num_agencia") or "")
+    dv_conta = (bruto.get("dv_conta") or "").strip().upper()
+    if not num_conta or not _DIGITOS.match(num_conta) or len(num_conta) > 20:
+        raise RegistroInvalido("numero da conta invalido")
+    if not _DV.match(dv_conta):
+        raise RegistroInvalido("digito da conta invalido")
+    if not num_agencia:
+        raise RegistroInvalido("agencia nao informada")
+    return {
+        "num_processo": cnab.chave_texto(bruto.get("num_processo")),
+        "documento": _NAO_DIGITOS.sub("", bruto.get("cpf_cnpj") or ""),
+        "num_agencia": int(num_agencia),
+        "num_conta": num_conta,
+        "dv_conta": dv_conta,
+        "dt_abertura": _data((bruto.get("dt_abertura") or "").strip()),
+    }
+
+
+def detectar_formato(primeira_linha):
+    linha = primeira_linha.rstrip(b"\r\n")
+    return "cnab" if len(linha) == cnab.TAMANHO_REGISTRO and linha[:8].isdigit() else "csv"
+
+
+def ler_cnab(stream, id_banco):
+    """
+    Gera (linha, registro, erro) para cada detalhe de um retorno posicional.
+    Header de outro banco ou trailer com total divergente viram erro.
+    """
+    detalhes = 0
+    for numero, linha in _linhas_texto(stream):
+        if not linha.strip():
+            continue
+        if len(linha) != cnab.TAMANHO_REGISTRO:
+            yield numero, linha, f"registro com {len(linha)} posicoes (esperado {cnab.TAMANHO_REGISTRO})"
+            continue
+        tipo = cnab.tipo_registro(linha)
+        if tipo == "0":
+            banco_arquivo = int(linha[0:3]) if _DIGITOS.match(linha[0:3]) else None
+            if banco_arquivo != id_banco:
+                raise RegistroInvalido(f"arquivo do banco {linha[0:3]}, esperado {id_banco:03d}")
+            continue
+        if tipo == "9":
+            campos = cnab.ler_registro(cnab.TRAILER_ARQUIVO, linha)
+            if _DIGITOS.match(campos["qtd_registros"]) and int(campos["qtd_registros"]) != detalhes + 2:
+                yield numero, linha, (
+                    f"trailer informa {int(campos['qtd_registros'])} registros; arquivo tem {detalhes + 2}"
+                )
+            continue
+        if tipo != "3":
+            yield numero, linha, f"tipo de registro desconhecido: {tipo!r}"
+            continue
+
+        detalhes += 1
+        campos = cnab.ler_registro(cnab.RETORNO_DETALHE, linha)
+        if campos["ocorrencia"] != cnab.OCORRENCIA_CONTA_ABERTA:
+            yield numero, linha, f"banco nao abriu a conta (ocorrencia {campos['ocorrencia']})"
+            continue
+        # Campo numerico do layout: os zeros a esquerda sao preenchimento, nao
+        # digitos da conta (no CSV a conta fica como o banco enviou)
+        campos["num_conta"] = campos["num_conta"].lstrip("0")
+        campos["cpf_cnpj"] = campos["inscricao"]
+        campos["dt_abertura"] = campos["data_abertura"]
+        try:
+            yield numero, _normaliza(campos), None
+        except RegistroInvalido as e:
+            yield numero, linha, str(e)
+
+
+def ler_csv(stream):
+    """Gera (linha, registro, erro) para cada linha de um retorno em CSV."""
+    linhas = _linhas_texto(stream)
+    try:
+        _, cabecalho = next(linhas)
+    except StopIteration:
+        return
+    delimitador = ";" if cabecalho.count(";") >= cabecalho.count(",") else ","
+    colunas = [c.strip().lower() for c in next(csv.reader([cabecalho], delimiter=delimitador))]
+    faltando = [c for c in CAMPOS_CSV[2:] if c not in colunas]
+    if "num_processo" not in colunas and "cpf_cnpj" not in colunas:
+        faltando.insert(0, "num_processo ou cpf_cnpj")
+    if faltando:
+        raise RegistroInvalido(f"colunas ausentes no CSV: {', '.join(faltando)}")
+
+    for numero, linha in linhas:
+        if not linha.strip():
+            continue
+        valores = next(csv.reader([linha], delimiter=delimitador))
+        try:
+            yield numero, _normaliza(dict(zip(colunas, valores))), None
+        except RegistroInvalido as e:
+            yield numero, linha, str(e)
+
+
+class Conciliador:
+    """
+    Casa registros do retorno com remessas por índices em memória (dicts):
+    num_processo primeiro, CPF/CNPJ quando o processo não bate e o documento
+    identifica uma única remessa pendente. Processos ou documentos que
+    coincidem em mais de uma remessa são rejeitados como ambíguos. A agência
+    é resolvida pelo número dentro do banco do arquivo.
+    """
+
+    _AMBIGUO = object()
+
+    def __init__(self, remessas, agencias):
+        self.por_processo = {}
+        self.por_documento = {}
+        for id_remessa, num_processo, cpf_cnpj in remessas:
+            # chave_texto trunca e normaliza: processos distintos podem colidir
+            self._indexar(self.por_processo, cnab.chave_texto(num_processo), id_remessa)
+            documento = _NAO_DIGITOS.sub("", cpf_cnpj or "")
+            if documento:
+                self._indexar(self.por_documento, documento, id_remessa)
+        self.agencias = {num_agencia: id_agencia for id_agencia, num_agencia in agencias}
+        self.vistos = set()
+
+    def _indexar(self, indice, chave, id_remessa):
+        atual = indice.get(chave)
+        indice[chave] = id_remessa if atual in (None, id_remessa) else self._AMBIGUO
+
+    def conciliar(self, registro):
+        """Tupla para o COPY (id_remessa, id_agencia, num_conta, dv_conta, dt_abertura)."""
+        id_remessa = self.por_processo.get(registro["num_processo"])
+        if id_remessa is self._AMBIGUO:
+            raise RegistroInvalido("processo corresponde a mais de uma remessa pendente")
+        if id_remessa is None and registro["documento"]:
+            id_remessa = self.por_documento.get(registro["documento"])
+            if id_remessa is self._AMBIGUO:
+                raise RegistroInvalido("CPF/CNPJ com mais de uma remessa pendente; informe o processo")
+        if id_remessa is None:
+            raise RegistroInvalido("nenhuma remessa aguardando conta com este processo/CPF-CNPJ")
+
+        id_agencia = self.agencias.get(registro["num_agencia"])
+        if id_agencia is None:
+            raise RegistroInvalido(f"agencia {registro['num_agencia']} nao cadastrada para o banco")
+
+        chave = (id_remessa, registro["num_conta"], registro["dv_conta"])
+        if chave in self.vistos:
+            raise RegistroInvalido("conta repetida no arquivo")
+        self.vistos.add(chave)
+        return id_remessa, id_agencia, registro["num_conta"], registro["dv_conta"], registro["dt_abertura"]
+
+
+def linha_copy(valores):
+    """Linha no formato texto do COPY (campos já validados: sem tab nem barra)."""
+    return "\t".join(v.isoformat() if isinstance(v, date) else str(v) for v in valores) + "\n"
+
+
+class RelatorioRejeitados:
+    """
+    Relatório CSV (linha;motivo;conteudo) dos registros não conciliados,
+    gravado à medida que aparecem; guarda só uma amostra para a tela.
+    """
+
+    AMOSTRA = 100
+
+    def __init__(self, destino):
+        self.writer = csv.writer(destino, delimiter=";")
+        self.writer.writerow(["linha", "motivo", "conteudo"])
+        self.total = 0
+        self.amostra = []
+
+    def adicionar(self, numero, motivo, registro):
+        conteudo = texto_registro(registro)
+        self.writer.writerow([numero, motivo, conteudo])
+        self.total += 1
+        if len(self.amostra) < self.AMOSTRA:
+            self.amostra.append({"linha": numero, "motivo": motivo, "conteudo": conteudo})
+
+
+def texto_registro(registro):
+    if isinstance(registro, str):
+        return registro
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=";").writerow(
+        [registro["num_processo"], registro["documento"], registro["num_agencia"],
+         registro["num_conta"], registro["dv_conta"], registro["dt_abertura"]]
+    )
+    return buffer.getvalue().rstrip("\r\n")
@@ -14,7 +14,15 @@
 
     flash,
 
-    make_response,
+    Response,
+
+    send_file,
+
+    current_app,
+
+    g,
+
+    has_request_context,
 
 )
 
@@ -22,13 +30,51 @@ import psycopg2
 
 from psycopg2.extras import RealDictCursor
 
+from produto.db import pool_from_env
+
+from produto.cache import ReferenceCache
+
+from produto.planilhas import PlanilhaAgrupada, xlsx_disponivel
+
+from produto import cnab
+
+from produto import retorno
+from produto import importacao
+from produto import proponentes
+from produto.listagem import (
+    ATE, DESDE, Listagem, data_iso, documento_cpf_cnpj, like_pattern, text_search, texto_pt_br,
+)
+
 import bcrypt
+import click
 
 import io
 
+import csv
+
+import os
+
+import tempfile
+
+import time
+
+import base64
+
+import binascii
+
+import json
+
+import re
+
+import threading
+
+import unicodedata
+
+from contextlib import contextmanager
+
 from functools import wraps
 
-from datetime import date
+from datetime import date, datetime
 
 
 
@@ -62,14 +108,21 @@ DB_CONFIG = {
 
 
 
+# Pool de conexoes (limites via DB_POOL_MIN, DB_POOL_MAX, DB_POOL_MAX_LIFETIME,
+# DB_POOL_TIMEOUT e DB_POOL_PING_AFTER)
+
+db_pool = pool_from_env(DB_CONFIG)
+
+
+
 # Conexo com o banco de dados
 
 def get_db_connection():
 
-    """Cria uma conexo com o banco de dados PostgreSQL."""
+    """Retira uma conexão do pool de conexões PostgreSQL."""
     try:
 
-        return psycopg2.connect(**DB_CONFIG)
+        return db_pool.getconn()
 
     except Exception as e:
 
@@ -79,6 +132,230 @@ def get_db_connection():
 
 
 
+# Devolve a conexao ao pool
+
+def release_db_connection(conn, discard=False):
+
+    """Devolve a conexão ao pool; conexões quebradas são descartadas."""
+
+    db_pool.putconn(conn, discard=discard)
+
+
+
+# Conexao por request / transacao explicita
+
+# Dentro de um request, todas as queries usam a mesma conexao (guardada em
+
+# flask.g) e a mesma transacao, confirmada ao final do request. Fora de um
+
+# request (scripts), transaction() usa uma conexao propria da thread.
+
+_db_local = threading.local()
+
+
+
+def _db_scope():
+
+    return g if has_request_context() else _db_local
+
+
+
+# Conexao vinculada ao request
+
+def get_request_connection():
+
+    """Retorna a conexão vinculada ao request atual, abrindo-a no primeiro uso."""
+
+    if not has_request_context():
+
+        return None
+
+    conn = g.get("db_conn")
+
+    if conn is None:
+
+        conn = get_db_connection()
+
+        if conn is None:
+
+            return None
+
+        g.db_conn = conn
+
+        g.db_tx_depth = 0
+
+        g.db_rollback_only = False
+
+        g.db_pendente = False
+
+    return conn
+
+
+
+def _bound_connection():
+
+    """Conexão em uso no escopo atual (request ou transaction()), se houver."""
+
+    if has_request_context():
+
+        return get_request_connection()
+
+    return getattr(_db_local, "db_conn", None)
+
+
+
+# Transacao explicita para escritas com varios comandos
+
+@contextmanager
+
+def transaction():
+
+    """
+
+    Executa várias escritas como uma unidade atômica.
+
+    Dentro do bloco, erros de SQL são propagados (em vez de retornar None) e
+
+    desfazem tudo o que o bloco executou. Blocos aninhados usam SAVEPOINT.
+
+    """
+
+    scope = _db_scope()
+
+    conn = _bound_connection()
+
+    owned = False
+
+    if conn is None:
+
+        if has_request_context():
+
+            raise psycopg2.OperationalError("Sem conexão com o banco de dados")
+
+        conn = get_db_connection()
+
+        if conn is None:
+
+            raise psycopg2.OperationalError("Sem conexão com o banco de dados")
+
+        owned = True
+
+        scope.db_conn = conn
+
+        scope.db_tx_depth = 0
+
+    depth = scope.db_tx_depth
+
+    savepoint = f"sp_{depth}"
+
+    if depth > 0:
+
+        with conn.cursor() as cur:
+
+            cur.execute(f"SAVEPOINT {savepoint}")
+
+    scope.db_tx_depth = depth + 1
+
+    try:
+
+        yield conn
+
+    except Exception:
+
+        if depth > 0:
+
+            with conn.cursor() as cur:
+
+                cur.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+
+        else:
+
+            conn.rollback()
+
+            scope.db_pendente = False
+
+        raise
+
+    else:
+
+        if depth > 0:
+
+            with conn.cursor() as cur:
+
+                cur.execute(f"RELEASE SAVEPOINT {savepoint}")
+
+        elif getattr(scope, "db_rollback_only", False):
+
+            # O request ja foi desfeito; confirmar agora gravaria so a metade
+
+            conn.rollback()
+
+            raise psycopg2.InternalError("Transação do request marcada para desfazer; commit recusado")
+
+        else:
+
+            conn.commit()
+
+            scope.db_pendente = False
+
+    finally:
+
+        scope.db_tx_depth = depth
+
+        if owned:
+
+            scope.db_conn = None
+
+            release_db_connection(conn)
+
+
+
+# Confirma a transacao do request antes de enviar a resposta; assim uma falha
+
+# no COMMIT vira erro 500 em vez de uma mensagem de sucesso falsa.
+
+@views_bp.after_app_request
+
+def _commit_request_connection(response):
+
+    conn = g.get("db_conn")
+
+    if conn is not None and not g.get("db_rollback_only") and response.status_code < 500:
+
+        conn.commit()
+
+    return response
+
+
+
+# Desfaz o que nao foi confirmado e devolve a conexao ao pool
+
+@views_bp.teardown_app_request
+
+def _release_request_connection(exc):
+
+    conn = g.pop("db_conn", None)
+
+    if conn is None:
+
+        return
+
+    try:
+
+        if not conn.closed:
+
+            conn.rollback()
+
+    except psycopg2.Error as e:
+
+        print(f"[DB] Erro ao finalizar transacao do request: {e}")
+
+    finally:
+
+        release_db_connection(conn)
+
+
+
 # Funcao generica para executar queries
 
 def _run_query(query, params=None, fetch_mode="all"):
@@ -101,9 +378,11 @@ def _run_query(query, params=None, fetch_mode="all"):
 
     """
 
-    # Abre conexao
+    # Usa a conexao do request/transacao atual ou abre uma avulsa
 
-    conn = get_db_connection()
+    bound_conn = _bound_connection()
+
+    conn = bound_conn or get_db_connection()
 
     if not conn:
 
@@ -115,12 +394,32 @@ def _run_query(query, params=None, fetch_mode="all"):
 
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
+    # Comando avulso na conexao do request. So vai para um SAVEPOINT quando ha
+
+    # escritas do request ainda nao confirmadas (db_pendente): uma falha
+
+    # desfaz so ele, e nao elas. Sem escritas pendentes (a maioria dos
+
+    # requests so le), o ROLLBACK nao perde nada e o comando custa um round trip
+
+    scope = _db_scope()
+
+    avulso = bool(bound_conn) and getattr(scope, "db_tx_depth", 0) == 0
+
+    protegido = avulso and getattr(scope, "db_pendente", False)
+
     # Execucao da query
 
     try:
 
+        if protegido:
+
+            cursor.execute("SAVEPOINT sp_avulso")
+
         cursor.execute(query, params)
 
+        comando = (cursor.statusmessage or "").split(" ", 1)[0]
+
     # Obtem resultado conforme modo
 
         if fetch_mode == "all":
@@ -141,27 +440,69 @@ def _run_query(query, params=None, fetch_mode="all"):
 
 
 
-        conn.commit()
+        if protegido:
+
+            cursor.execute("RELEASE SAVEPOINT sp_avulso")
+
+        if not bound_conn:
+
+            conn.commit()
+
+        elif avulso and comando not in ("SELECT", "SHOW"):
+
+            # Escrita que so sera confirmada no fim do request
+
+            scope.db_pendente = True
 
         return result
 
     except Exception as e:
 
-        conn.rollback()
-
         print(f"[DB] ERRO SQL - Query: {query}")
 
         print(f"[DB] ERRO SQL - Params: {params}")
 
         print(f"[DB] ERRO SQL - Detalhes: {e} ({type(e).__name__})")
 
+        # Dentro de transaction() o erro sobe para o bloco desfazer tudo
+
+        if bound_conn and not avulso:
+
+            raise
+
+        if not protegido:
+
+            conn.rollback()
+
+            return None
+
+        # Fora dela, com escritas pendentes, desfaz so o comando que falhou
+
+        try:
+
+            cursor.execute("ROLLBACK TO SAVEPOINT sp_avulso")
+
+            cursor.execute("RELEASE SAVEPOINT sp_avulso")
+
+        except psycopg2.Error:
+
+            # Sem como desfazer so o comando: o request inteiro sera desfeito
+
+            conn.rollback()
+
+            if has_request_context():
+
+                g.db_rollback_only = True
+
         return None
 
     finally:
 
         cursor.close()
 
-        conn.close()
+        if not bound_conn:
+
+            release_db_connection(conn)
 
 
 
@@ -214,6 +555,450 @@ def count(table_name, where_clause=None, params=None):
 
 
 
+# ===========================
+
+# PAGINACAO
+
+# ===========================
+
+
+
+# Modo de paginacao por listagem: "offset" (?page=N) ou "keyset" (?after=token).
+# O keyset e opt-in: pode ser ligado por view em app.config["PAGINACAO"],
+# ex.: {"remessas": "keyset"}. Um link com after/before sempre usa keyset.
+PAGINACAO_PADRAO = {
+    "bancos": "offset",
+    "agencias": "offset",
+    "concedentes": "offset",
+    "usuarios": "offset",
+    "remessas": "offset",
+    "contas_convenio": "offset",
+}
+
+
+def pagination_mode(view_name):
+    """Retorna o modo de paginação ("offset" ou "keyset") da listagem."""
+    if request.args.get("after") or request.args.get("before"):
+        return "keyset"
+    modos = current_app.config.get("PAGINACAO", {})
+    return modos.get(view_name, PAGINACAO_PADRAO.get(view_name, "offset"))
+
+
+def pagination_args():
+    """Filtros atuais da listagem, para repetir nos links de paginação."""
+    return {
+        chave: valor
+        for chave, valor in request.args.items()
+        if chave not in ("page", "after", "before") and valor
+    }
+
+
+def sort_args():
+    """Filtros atuais sem a ordenação, para os links dos cabeçalhos (voltam à página 1)."""
+    return {
+        chave: valor
+        for chave, valor in pagination_args().items()
+        if chave not in ("sort", "dir")
+    }
+
+
+# Modo de contagem do total por listagem:
+#   "exact"    -> SELECT COUNT(*) separado (uma varredura e um round trip a mais)
+#   "window"   -> COUNT(*) OVER() na propria consulta da pagina
+#   "estimate" -> pg_class.reltuples quando a lista nao tem filtro (exibido
+#                 como "~N"); com filtro, cai para "window"
+# Pode ser sobrescrito por view em app.config["CONTAGEM"].
+CONTAGEM_PADRAO = {
+    "bancos": "window",
+    "agencias": "window",
+    "concedentes": "window",
+    "usuarios": "window",
+    "remessas": "estimate",
+    "contas_convenio": "estimate",
+}
+
+# Abaixo disso a estimativa nao compensa: a contagem exata ja e barata
+ESTIMATIVA_MINIMA = 10000
+
+
+def count_mode(view_name, where_clause, paginacao):
+    """Resolve o modo de contagem efetivo da listagem."""
+    modos = current_app.config.get("CONTAGEM", {})
+    modo = modos.get(view_name, CONTAGEM_PADRAO.get(view_name, "exact"))
+    if modo == "estimate" and where_clause:
+        modo = "window"
+    # Com cursor o WHERE inclui o seek e a janela contaria so o que falta; o
+    # total segue no proprio cursor (cursor_total) e so cai aqui sem ele
+    if modo == "window" and paginacao == "keyset" and (request.args.get("after") or request.args.get("before")):
+        modo = "exact"
+    return modo
+
+
+def with_total_column(select_sql, contagem, table_name):
+    """Acrescenta a coluna total_count ao SELECT da página conforme o modo."""
+    if contagem == "window":
+        total_expr = "COUNT(*) OVER()"
+    elif contagem == "estimate":
+        total_expr = f"(SELECT reltuples FROM pg_class WHERE oid = '{table_name}'::regclass)::bigint"
+    else:
+        return select_sql
+    head, _, tail = select_sql.partition("SELECT")
+    return f"{head}SELECT {total_expr} AS total_count,{tail}"
+
+
+def list_total(contagem, count_query, count_params, rows, offset):
+    """
+    Retorna (total, estimado). Usa a coluna total_count da própria página
+    e só executa count_query quando ela não basta (página vazia, tabela
+    nunca analisada ou pequena demais para estimar).
+    """
+    if contagem != "exact" and rows:
+        total = rows[0]["total_count"]
+        if contagem == "window":
+            return total, False
+        if total is not None and total >= ESTIMATIVA_MINIMA:
+            return total, True
+    elif contagem == "window" and offset == 0:
+        return 0, False
+    row = fetch_one(count_query, count_params)
+    return (row["count"] if row else 0), False
+
+
+def encode_cursor(values, total=None):
+    """
+    Codifica a chave de ordenação de uma linha em um token opaco para a URL.
+    total: (total, estimado) contado na primeira página, repassado às
+    seguintes para que elas não contem de novo.
+    """
+    payload = {"k": list(values)}
+    if total is not None:
+        payload["t"] = [total[0], bool(total[1])]
+    raw = json.dumps(payload, default=str, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Decodifica um token de encode_cursor em (chave, total); (None, None) se for inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw.decode("utf-8"))
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None, None
+    if not isinstance(payload, dict):
+        return None, None
+    values, total = payload.get("k"), payload.get("t")
+    if not isinstance(values, list) or len(values) != size:
+        return None, None
+    if not (isinstance(total, list) and len(total) == 2 and isinstance(total[0], int)):
+        total = None
+    return values, (tuple(total) if total else None)
+
+
+def cursor_total(size):
+    """Total (total, estimado) carregado no ?after=/?before= do request, se houver."""
+    token = request.args.get("after") or request.args.get("before") or ""
+    return decode_cursor(token, size)[1]
+
+
+def fetch_keyset_page(select_sql, where_clause, params, keyset, per_page, descending=False):
+    """
+    Busca uma página por keyset (seek) em vez de OFFSET.
+
+    keyset: lista de (expressão SQL, chave na linha) que forma a ordenação,
+    sempre terminando em uma coluna única, ex.:
+    [("r.nome_proponente", "nome_proponente"), ("r.id_remessa", "id_remessa")].
+    Precisa de um índice composto nas mesmas colunas para que a página
+    5.000 custe o mesmo que a página 1. Com descending=True todas as
+    colunas são decrescentes (o mesmo índice, lido de trás para frente).
+
+    Retorna (linhas, chave_proxima, chave_anterior); as chaves viram token
+    com encode_cursor.
+    """
+    exprs = [expr for expr, _ in keyset]
+    row_expr = "(" + ", ".join(exprs) + ")"
+    placeholders = "(" + ", ".join(["%s"] * len(keyset)) + ")"
+    params = list(params)
+
+    after = decode_cursor(request.args.get("after", ""), len(keyset))[0]
+    before = None if after else decode_cursor(request.args.get("before", ""), len(keyset))[0]
+
+    seek = ""
+    forward, backward = ("<", ">") if descending else (">", "<")
+    if after:
+        seek = f"{row_expr} {forward} {placeholders}"
+        params.extend(after)
+    elif before:
+        seek = f"{row_expr} {backward} {placeholders}"
+        params.extend(before)
+    if seek:
+        where_clause = f"{where_clause} AND {seek}" if where_clause else f" WHERE {seek}"
+
+    # Para voltar uma pagina, le em ordem inversa e desinverte em memoria
+    direction = " DESC" if bool(before) != descending else ""
+    order_by = ", ".join(f"{expr}{direction}" for expr in exprs)
+    query = f"{select_sql}{where_clause} ORDER BY {order_by} LIMIT %s"
+    params.append(per_page + 1)
+
+    rows = fetch_all(query, params)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    first = [rows[0][key] for _, key in keyset]
+    last = [rows[-1][key] for _, key in keyset]
+    if before:
+        return rows, last, (first if has_more else None)
+    return rows, (last if has_more else None), (first if after else None)
+
+
+# Linhas por pagina nas listagens: padrao e opcoes do ?per_page=. O teto
+# vale para qualquer valor na URL (LIMIT e OFFSET nunca passam dele)
+POR_PAGINA = 5
+OPCOES_POR_PAGINA = (5, 10, 25, 50, 100)
+MAX_POR_PAGINA = 100
+
+
+def page_size(default=POR_PAGINA):
+    """Tamanho de página do ?per_page=, limitado a 1..MAX_POR_PAGINA."""
+    per_page = request.args.get("per_page", default, type=int)
+    return max(1, min(per_page, MAX_POR_PAGINA))
+
+
+def list_page(consulta, per_page=None):
+    """
+    Executa a página de uma listagem (produto.listagem.Consulta) no modo de
+    paginação e de contagem configurado para a view, na ordenação pedida
+    (?sort=/?dir=, já validada pela Listagem) e com o ?per_page= do usuário.
+    Retorna (linhas, contexto de paginação para o template).
+    """
+    listagem = consulta.listagem
+    per_page = per_page or page_size()
+    page = max(request.args.get("page", 1, type=int), 1)
+    offset = (page - 1) * per_page
+
+    paginacao = pagination_mode(listagem.nome)
+    # No keyset o total e contado so na primeira pagina e segue no cursor
+    carregado = cursor_total(len(consulta.ordem)) if paginacao == "keyset" else None
+    contagem = "cursor" if carregado else count_mode(listagem.nome, consulta.where_clause, paginacao)
+    select_sql = with_total_column(consulta.select_sql, contagem, listagem.nome_tabela)
+    next_cursor = prev_cursor = None
+    if paginacao == "keyset":
+        linhas, proxima, anterior = fetch_keyset_page(
+            select_sql, consulta.where_clause, consulta.params, consulta.ordem, per_page,
+            descending=consulta.descendente,
+        )
+    else:
+        linhas = fetch_all(
+            select_sql + consulta.where_clause + consulta.order_by + " LIMIT %s OFFSET %s",
+            consulta.params + [per_page, offset],
+        )
+
+    if carregado:
+        total_items, total_estimado = carregado
+    else:
+        total_items, total_estimado = list_total(contagem, consulta.count_query, consulta.params, linhas, offset)
+    if paginacao == "keyset":
+        total = (total_items, total_estimado)
+        next_cursor = encode_cursor(proxima, total) if proxima else None
+        prev_cursor = encode_cursor(anterior, total) if anterior else None
+    return linhas, {
+        "current_page": page,
+        "total_pages": (total_items + per_page - 1) // per_page,
+        "total_items": total_items,
+        "start_item": offset + 1 if linhas else 0,
+        "end_item": min(offset + per_page, total_items),
+        "total_estimado": total_estimado,
+        "paginacao": paginacao,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "pagination_args": pagination_args(),
+        "per_page": per_page,
+        "per_page_options": OPCOES_POR_PAGINA,
+        "sort": consulta.sort,
+        "sort_dir": consulta.dir,
+        "sort_args": sort_args(),
+    }
+
+
+def export_list(listagem, formato):
+    """Exportação (?format=) de uma listagem com os filtros do request."""
+    consulta = listagem.consulta(request.args, exportacao=True)
+    return export_response(
+        listagem.nome, formato,
+        consulta.select_sql + consulta.where_clause + consulta.order_by,
+        consulta.params,
+        agrupamentos=listagem.agrupamentos,
+    )
+
+
+
+
+
+# ===========================
+
+# BUSCA
+
+# ===========================
+
+
+
+# As buscas textuais dependem da migration 7c1f04d93a2e (pg_trgm, unaccent,
+# funcao f_unaccent e indices GIN trigram nas colunas pesquisadas).
+# like_pattern e text_search ficam em produto.listagem.
+
+
+
+
+
+# ===========================
+
+# EXPORTACAO (?format=csv | ?format=ndjson nas listagens)
+
+# ===========================
+
+
+
+EXPORT_FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson; charset=utf-8", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+# Linhas por FETCH do cursor nomeado (e por pedaco enviado ao cliente)
+EXPORT_LOTE = 2000
+
+
+def export_format():
+    """Formato pedido em ?format=, ou None para a listagem HTML normal."""
+    formato = request.args.get("format", "").strip().lower()
+    return formato if formato in EXPORT_FORMATOS else None
+
+
+def _export_chunk(formato, columns, rows):
+    if formato == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def export_response(nome, formato, query, params=None, agrupamentos=None):
+    """
+    Exporta o resultado de ``query`` sem carregar tudo em memoria.
+
+    As linhas vem de um cursor nomeado (server-side) em uma conexao propria
+    do pool, EXPORT_LOTE por vez, e cada lote e enviado ao cliente assim que
+    lido. A conexao volta ao pool quando a resposta termina ou o cliente
+    desconecta.
+
+    agrupamentos: {valor de ?agrupar=: (coluna, titulo)} das abas do XLSX;
+    sem ele a listagem nao oferece XLSX.
+    """
+    if formato == "xlsx" and not (agrupamentos and xlsx_disponivel()):
+        flash("Exportacao XLSX indisponivel para esta listagem.", "error")
+        return redirect(request.path)
+
+    conn = get_db_connection()
+    if not conn:
+        flash("Erro ao conectar ao banco para exportar.", "error")
+        return redirect(request.path)
+
+    cur = conn.cursor(name=f"exportacao_{nome}")
+    cur.itersize = EXPORT_LOTE
+    try:
+        cur.execute(query, params)
+        primeiro_lote = cur.fetchmany(EXPORT_LOTE)
+    except psycopg2.Error as e:
+        print(f"[ERRO EXPORTACAO {nome}] {e}")
+        release_db_connection(conn, discard=conn.closed != 0)
+        flash("Erro ao exportar os dados.", "error")
+        return redirect(request.path)
+
+    columns = [col.name for col in cur.description]
+
+    if formato == "xlsx":
+        coluna, titulo = agrupamentos.get(request.args.get("agrupar", ""), next(iter(agrupamentos.values())))
+        return _export_xlsx(nome, conn, cur, columns, primeiro_lote, coluna, titulo)
+
+    def gerar():
+        if formato == "csv":
+            # BOM: o Excel so reconhece UTF-8 (acentos) com ele
+            yield "\ufeff" + _export_chunk("csv", columns, [columns])
+        lote = primeiro_lote
+        while lote:
+            yield _export_chunk(formato, columns, lote)
+            lote = cur.fetchmany(EXPORT_LOTE)
+
+    def liberar():
+        try:
+            cur.close()
+        except psycopg2.Error:
+            pass
+        release_db_connection(conn, discard=conn.closed != 0)
+
+    mimetype, extensao = EXPORT_FORMATOS[formato]
+    response = Response(gerar(), mimetype=mimetype)
+    response.call_on_close(liberar)
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{nome}-{date.today().isoformat()}.{extensao}"'
+    )
+    return response
+
+
+def _export_xlsx(nome, conn, cur, columns, primeiro_lote, coluna_grupo, titulo_grupo):
+    """
+    Grava a planilha em arquivo temporario (XLSX e um zip: o indice central
+    so existe no fim) e a envia com Content-Length, para o navegador mostrar
+    o progresso. O arquivo ja e comprimido; no-transform evita gzip de proxy.
+    """
+    arquivo = tempfile.NamedTemporaryFile(prefix=f"{nome}-", suffix=".xlsx", delete=False)
+    arquivo.close()
+    inicio = time.perf_counter()
+    linhas = 0
+    try:
+        planilha = PlanilhaAgrupada(arquivo.name, columns, coluna_grupo, titulo_grupo)
+        lote = primeiro_lote
+        while lote:
+            planilha.escrever(lote)
+            linhas += len(lote)
+            lote = cur.fetchmany(EXPORT_LOTE)
+        planilha.fechar()
+    except Exception as e:
+        print(f"[ERRO EXPORTACAO {nome} XLSX] {e}")
+        os.remove(arquivo.name)
+        flash("Erro ao gerar a planilha.", "error")
+        return redirect(request.path)
+    finally:
+        try:
+            cur.close()
+        except psycopg2.Error:
+            pass
+        release_db_connection(conn, discard=conn.closed != 0)
+
+    print(f"[EXPORTACAO] {nome}.xlsx: {linhas} linhas em {time.perf_counter() - inicio:.1f}s")
+
+    mimetype, extensao = EXPORT_FORMATOS["xlsx"]
+    response = send_file(
+        arquivo.name,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"{nome}-{date.today().isoformat()}.{extensao}",
+        max_age=0,
+    )
+    response.headers["Cache-Control"] = "no-store, no-transform"
+    response.call_on_close(lambda: os.remove(arquivo.name))
+    return response
+
+
+
+
+
 # ===========================
 
 # SENHAS
@@ -681,170 +1466,429 @@ def logout():
 
 
 
+# SAUDE DA APLICACAO (conexao + metricas do pool)
+
+@views_bp.route("/health")
+
+def health():
+
+    conn = get_db_connection()
+
+    if not conn:
+
+        return {"status": "error", "database": "disconnected", "pool": db_pool.stats()}, 500
+
+    release_db_connection(conn)
+
+    return {
+        "status": "ok",
+        "database": "connected",
+        "pool": db_pool.stats(),
+        "reference_cache": reference_cache.stats(),
+    }
+
+
+
 
 
 # ===========================
 
-# DASHBOARD
+# DADOS DE REFERENCIA (cache dos dropdowns)
 
 # ===========================
 
 
 
+# Concedentes e bancos mudam pouco e aparecem em quase todo formulario.
+# Ficam em memoria e so sao relidos quando a versao da tabela em
+# dados_referencia muda (trigger + NOTIFY, ver produto/cache.py). O catalogo
+# de agencias e grande demais para ir inteiro na pagina: /api/agencias.
 
+reference_cache = ReferenceCache(DB_CONFIG)
 
-@views_bp.route("/dashboard")
 
-@login_required
 
-def dashboard():
+def _versoes_referencia():
 
-    stats = {
+    existe = fetch_one("SELECT to_regclass('dados_referencia') IS NOT NULL AS existe")
 
-        "total_usuarios": count("usuario"),
+    if not existe or not existe["existe"]:
 
-        "total_bancos": count("banco"),
+        return None
 
-        "total_agencias": count("agencia"),
+    rows = _run_query("SELECT chave, versao FROM dados_referencia", fetch_mode="all")
 
-        "total_remessas": count("remessa"),
+    if rows is None:
 
-        "total_concedentes": count("concedente"),
+        return None
 
-        "total_contas": count("conta_convenio"),
+    return {row["chave"]: row["versao"] for row in rows}
 
-    }
 
-    # Contagem por situacao de remessa
-    remessas = {
-        "preparacao": count("remessa", "situacao = 'Em Preparação'"),
-        "enviado": count("remessa", "situacao = 'Enviado'"),
-        "aguardando": count("remessa", "situacao = 'Aguardando retorno'"),
-        "pendente": count("remessa", "situacao = 'Pendente de envio'"),
-        "aberta": count("remessa", "situacao = 'Conta Aberta'"),
-        "erro": count("remessa", "situacao = 'Erro'"),
-    }
 
-    return render_template("dashboard.html", stats=stats, remessas=remessas)
+def _referencia(chave, tabelas, query):
 
+    # _run_query devolve None em erro: falha de carga nao entra no cache
+    loader = lambda: _run_query(query, fetch_mode="all")
 
-# ===========================
+    return reference_cache.get(chave, tabelas, loader, _versoes_referencia) or []
 
-# CRUD - BANCOS
 
-# ===========================
 
+def ref_concedentes():
 
+    return _referencia("concedentes", ("concedente",), "SELECT * FROM concedente ORDER BY nome")
 
 
 
+def ref_bancos():
 
+    return _referencia("bancos", ("banco",), "SELECT * FROM banco ORDER BY nome")
 
 
 
-@views_bp.route("/bancos")
+def reference_changed(*tabelas):
 
-@login_required
+    """
+    Invalida na hora o cache deste processo apos uma escrita. Os demais
+    processos sao avisados pelo NOTIFY do trigger quando a transacao confirmar.
+    """
 
-def bancos():
+    reference_cache.invalidate(*tabelas)
 
-    # Paginação
 
-    page = request.args.get("page", 1, type=int)
 
-    per_page = 5
 
-    offset = (page - 1) * per_page
 
-    
+# ===========================
 
-    search_term = request.args.get("search", "").strip()
-    situacao_filter = request.args.get("situacao", "").strip()
+# DASHBOARD
 
-    query = "SELECT * FROM banco"
+# ===========================
 
-    params = []
 
-    
 
-    where_clause = ""
 
-    if search_term:
 
-        where_clause = """
+# Chaves do dashboard -> tabela contada
+DASHBOARD_TABELAS = {
+    "total_usuarios": "usuario",
+    "total_bancos": "banco",
+    "total_agencias": "agencia",
+    "total_remessas": "remessa",
+    "total_concedentes": "concedente",
+    "total_contas": "conta_convenio",
+}
 
- WHERE (
+# Chaves do dashboard -> situacao de remessa
+DASHBOARD_SITUACOES = {
+    "preparacao": "Em Preparação",
+    "enviado": "Enviado",
+    "aguardando": "Aguardando retorno",
+    "pendente": "Pendente de envio",
+    "aberta": "Conta Aberta",
+    "erro": "Erro",
+}
 
-        CAST(id_banco AS TEXT) ILIKE %s OR
+# Os deltas dos contadores (mantidos por trigger) so existem apos a migration
+# 9b1e5d3c7a24; o job compactar-contadores mantem poucas linhas por chave
+_contador_disponivel = None
 
-        nome ILIKE %s
 
- )
+def _dashboard_contadores():
+    """Soma os deltas dos contadores por chave; None se a tabela ainda não existir."""
+    global _contador_disponivel
+    if _contador_disponivel is None:
+        row = fetch_one("SELECT to_regclass('contador_delta') IS NOT NULL AS existe")
+        if row is None:
+            return None
+        _contador_disponivel = row["existe"]
+    if not _contador_disponivel:
+        return None
+    rows = fetch_all("SELECT chave, SUM(delta)::bigint AS total FROM contador_delta GROUP BY chave")
+    totais = {row["chave"]: row["total"] for row in rows}
+    stats = {chave: totais.get(tabela, 0) for chave, tabela in DASHBOARD_TABELAS.items()}
+    remessas = {chave: totais.get(f"remessa:{situacao}", 0) for chave, situacao in DASHBOARD_SITUACOES.items()}
+    return stats, remessas
+
 
+def _dashboard_agregado():
+    """Calcula o dashboard inteiro em um unico comando (uma varredura de remessa)."""
+    row = fetch_one(
         """
+        SELECT
+            (SELECT COUNT(*) FROM usuario)        AS total_usuarios,
+            (SELECT COUNT(*) FROM banco)          AS total_bancos,
+            (SELECT COUNT(*) FROM agencia)        AS total_agencias,
+            (SELECT COUNT(*) FROM concedente)     AS total_concedentes,
+            (SELECT COUNT(*) FROM conta_convenio) AS total_contas,
+            r.*
+        FROM (
+            SELECT
+                COUNT(*)                                    AS total_remessas,
+                COUNT(*) FILTER (WHERE situacao = %(preparacao)s) AS preparacao,
+                COUNT(*) FILTER (WHERE situacao = %(enviado)s)    AS enviado,
+                COUNT(*) FILTER (WHERE situacao = %(aguardando)s) AS aguardando,
+                COUNT(*) FILTER (WHERE situacao = %(pendente)s)   AS pendente,
+                COUNT(*) FILTER (WHERE situacao = %(aberta)s)     AS aberta,
+                COUNT(*) FILTER (WHERE situacao = %(erro)s)       AS erro
+            FROM remessa
+        ) r
+        """,
+        DASHBOARD_SITUACOES,
+    ) or {}
+    stats = {chave: row.get(chave, 0) for chave in DASHBOARD_TABELAS}
+    remessas = {chave: row.get(chave, 0) for chave in DASHBOARD_SITUACOES}
+    return stats, remessas
 
-        like = f"%{search_term}%"
 
-        params.extend([like, like])
+def compactar_contadores():
+    """
+    Junta os deltas dos contadores em uma linha por chave, num único
+    comando. Deltas gravados durante a compactação não estão no snapshot do
+    DELETE e ficam para a próxima. Retorna quantas linhas foram removidas.
+    """
+    with transaction():
+        row = fetch_one(
+            """
+            WITH removidas AS (
+                DELETE FROM contador_delta RETURNING chave, delta
+            ), somadas AS (
+                INSERT INTO contador_delta (chave, delta)
+                SELECT chave, SUM(delta) FROM removidas GROUP BY chave HAVING SUM(delta) <> 0
+            )
+            SELECT COUNT(*) AS removidas FROM removidas
+            """
+        )
+    return row["removidas"] if row else 0
 
-    
 
-    # Contar total
+@views_bp.cli.command("compactar-contadores")
+def compactar_contadores_comando():
+    """Junta os deltas dos contadores do dashboard (rodar periodicamente)."""
+    inicio = time.perf_counter()
+    removidas = compactar_contadores()
+    click.echo(f"{removidas} deltas compactados ({time.perf_counter() - inicio:.1f}s)")
 
-    count_query = f"SELECT COUNT(*) as count FROM banco{where_clause}"
 
-    count_params = params[:]
+@views_bp.route("/dashboard")
+@login_required
+def dashboard():
+    # Contadores O(1) quando disponiveis; senao, um unico comando agregado
+    stats, remessas = _dashboard_contadores() or _dashboard_agregado()
 
-    result = fetch_one(count_query, count_params)
+    return render_template("dashboard.html", stats=stats, remessas=remessas)
 
-    total_items = result['count'] if result else 0
 
-    total_pages = (total_items + per_page - 1) // per_page
+# ===========================
+# BUSCA GLOBAL
+# ===========================
 
-    
+# Resultados por tipo de entidade (remessa, conta, agencia)
+BUSCA_LIMITE_PADRAO = 10
+BUSCA_LIMITE_MAXIMO = 50
 
-    query += where_clause
 
-    query += " ORDER BY id_banco, nome LIMIT %s OFFSET %s"
+def _normaliza_busca(termo):
+    """Minúsculas e sem acento, no mesmo formato de busca_indice.termos."""
+    decomposto = unicodedata.normalize("NFKD", termo.lower())
+    return "".join(ch for ch in decomposto if not unicodedata.combining(ch))
 
-    params.extend([per_page, offset])
 
+def buscar_global(termo, limite=BUSCA_LIMITE_PADRAO):
+    """
+    Busca em remessas, contas e agências no índice busca_indice (migration
+    a4e93b7d2c10), em um único comando: tsvector por prefixo de palavra ou
+    trigram por trecho (números de conta e processo). Um CPF/CNPJ válido vai
+    direto ao índice de cpf_cnpj_digits.
 
+    Retorna {"remessa": [...], "conta": [...], "agencia": [...]}, cada lista
+    com até ``limite`` itens ordenados por relevância.
+    """
+    resultados = {"remessa": [], "conta": [], "agencia": []}
+    documento = documento_cpf_cnpj(termo)
+    if documento:
+        rows = _buscar_documento(documento, limite)
+    else:
+        rows = _buscar_termos(termo, limite)
+
+    for row in rows or []:
+        entidade = row["entidade"]
+        if entidade == "remessa":
+            item = {
+                "titulo": row["nome_proponente"],
+                "detalhe": f"Processo {row['num_processo']} · Convênio {row['num_convenio']} · {row['cpf_cnpj']}",
+                "situacao": str(row["situacao"]),
+                "url": url_for("views.visualizar_remessa", id_remessa=row["id_entidade"]),
+            }
+        elif entidade == "conta":
+            item = {
+                "titulo": f"Conta {row['num_conta']}-{row['dv_conta']}",
+                "detalhe": f"{row['conta_proponente']} · {row['conta_agencia']}",
+                "url": url_for("views.editar_conta_convenio", id_conta_convenio=row["id_entidade"]),
+            }
+        else:
+            item = {
+                "titulo": row["nome_agencia"],
+                "detalhe": f"{row['num_agencia']}-{row['dv_agencia']} · {row['banco_nome']} · {row['cidade']}/{row['uf']}",
+                "url": url_for("views.editar_agencia", id_agencia=row["id_entidade"]),
+            }
+        item["id"] = row["id_entidade"]
+        item["relevancia"] = round(float(row["relevancia"]), 4)
+        resultados[entidade].append(item)
+    return resultados
+
+
+def _buscar_termos(termo, limite):
+    """Candidatos por palavra (tsvector) ou trecho (trigram) em busca_indice."""
+    normalizado = _normaliza_busca(termo)
+    palavras = re.findall(r"\w+", normalizado)
+    if not palavras:
+        return []
+
+    return fetch_all(
+        """
+        WITH candidatos AS (
+            SELECT bi.entidade, bi.id_entidade,
+                   GREATEST(ts_rank(bi.documento, to_tsquery('simple', %(tsquery)s)),
+                            similarity(bi.termos, %(termo)s)) AS relevancia
+              FROM busca_indice bi
+             WHERE bi.documento @@ to_tsquery('simple', %(tsquery)s)
+                OR bi.termos LIKE %(like)s
+        ), ranqueados AS (
+            SELECT c.*,
+                   ROW_NUMBER() OVER (PARTITION BY c.entidade
+                                      ORDER BY c.relevancia DESC, c.id_entidade) AS posicao
+              FROM candidatos c
+        )
+        SELECT h.entidade, h.id_entidade, h.relevancia,
+               r.nome_proponente, r.num_processo, r.num_convenio, r.cpf_cnpj, r.situacao,
+               cc.num_conta, cc.dv_conta, rc.nome_proponente AS conta_proponente,
+               ac.nome_agencia AS conta_agencia,
+               a.nome_agencia, a.num_agencia, a.dv_agencia, a.cidade, a.uf,
+               b.nome AS banco_nome
+          FROM ranqueados h
+          LEFT JOIN remessa r ON h.entidade = 'remessa' AND r.id_remessa = h.id_entidade
+          LEFT JOIN conta_convenio cc ON h.entidade = 'conta' AND cc.id_conta_convenio = h.id_entidade
+          LEFT JOIN remessa rc ON rc.id_remessa = cc.id_remessa
+          LEFT JOIN agencia ac ON ac.id_agencia = cc.id_agencia
+          LEFT JOIN agencia a ON h.entidade = 'agencia' AND a.id_agencia = h.id_entidade
+          LEFT JOIN banco b ON b.id_banco = a.id_banco
+         WHERE h.posicao <= %(limite)s
+         ORDER BY h.entidade, h.relevancia DESC, h.id_entidade
+        """,
+        {
+            "tsquery": " & ".join(f"{palavra}:*" for palavra in palavras),
+            "termo": normalizado,
+            "like": like_pattern(normalizado),
+            "limite": limite,
+        },
+    )
 
-    bancos_list = fetch_all(query, params)
 
-    
+def _buscar_documento(documento, limite):
+    """
+    CPF/CNPJ válido: igualdade em remessa.cpf_cnpj_digits (índice btree,
+    migration c5e2f8a1b4d7) para as remessas e as contas do documento,
+    sem passar pelo trigram.
+    """
+    return fetch_all(
+        """
+        (SELECT 'remessa' AS entidade, r.id_remessa AS id_entidade, 1.0 AS relevancia,
+                r.nome_proponente, r.num_processo, r.num_convenio, r.cpf_cnpj, r.situacao,
+                NULL AS num_conta, NULL AS dv_conta, NULL AS conta_proponente, NULL AS conta_agencia
+           FROM remessa r
+          WHERE r.cpf_cnpj_digits = %(documento)s
+          ORDER BY r.id_remessa DESC
+          LIMIT %(limite)s)
+        UNION ALL
+        (SELECT 'conta', cc.id_conta_convenio, 1.0,
+                NULL, NULL, NULL, NULL, NULL,
+                cc.num_conta, cc.dv_conta, r.nome_proponente, ag.nome_agencia
+           FROM remessa r
+           JOIN conta_convenio cc ON cc.id_remessa = r.id_remessa
+           LEFT JOIN agencia ag ON ag.id_agencia = cc.id_agencia
+          WHERE r.cpf_cnpj_digits = %(documento)s
+          ORDER BY cc.id_conta_convenio DESC
+          LIMIT %(limite)s)
+        """,
+        {"documento": documento, "limite": limite},
+    )
 
-    start_item = offset + 1 if bancos_list else 0
 
-    end_item = min(offset + per_page, total_items)
+def _busca_parametros():
+    termo = request.args.get("q", "").strip()
+    limite = request.args.get("limite", BUSCA_LIMITE_PADRAO, type=int)
+    return termo, max(1, min(limite, BUSCA_LIMITE_MAXIMO))
 
-    
 
+@views_bp.route("/buscar")
+@login_required
+def buscar():
+    termo, limite = _busca_parametros()
+    resultados = buscar_global(termo, limite) if len(termo) >= 2 else None
     return render_template(
+        "busca/resultados.html", termo=termo, resultados=resultados, documento=documento_cpf_cnpj(termo),
+    )
 
-        "bancos/list.html",
 
-        bancos=bancos_list,
+@views_bp.route("/api/buscar")
+@login_required
+def api_buscar():
+    termo, limite = _busca_parametros()
+    if len(termo) < 2:
+        return {"erro": "Informe ao menos 2 caracteres em q."}, 400
+    return {"termo": termo, "resultados": buscar_global(termo, limite)}
 
-        search_term=search_term,
 
-        current_page=page,
 
-        total_pages=total_pages,
 
-        total_items=total_items,
 
-        start_item=start_item,
+# ===========================
+
+# CRUD - BANCOS
+
+# ===========================
+
+
+
 
-        end_item=end_item,
 
+
+
+
+
+LISTA_BANCOS = Listagem(
+    "bancos", "banco",
+    colunas=["id_banco", "nome"],
+    ordenacoes={
+        "codigo": [("id_banco", "id_banco")],
+        "nome": [(texto_pt_br("nome"), "nome"), ("id_banco", "id_banco")],
+    },
+    busca=["nome"],
+    # Codigo numerico: igualdade na PK em vez de CAST de cada linha
+    busca_numero=("id_banco", "igual"),
+)
+
+
+@views_bp.route("/bancos")
+@login_required
+def bancos():
+    consulta = LISTA_BANCOS.consulta(request.args)
+    bancos_list, pagina = list_page(consulta)
+    return render_template(
+        "bancos/list.html",
+        bancos=bancos_list,
+        search_term=consulta.busca,
+        **pagina,
     )
 
 
 
 
 
+
+
 @views_bp.route("/bancos/criar", methods=["GET", "POST"])
 
 @login_required
@@ -884,6 +1928,8 @@ def criar_banco():
 
         if result and result > 0:
 
+            reference_changed("banco")
+
             flash("Banco criado com sucesso!", "success")
 
             return redirect(url_for("views.bancos"))
@@ -924,6 +1970,8 @@ def editar_banco(id_banco):
 
         if result and result > 0:
 
+            reference_changed("banco")
+
             flash("Banco atualizado com sucesso!", "success")
 
             return redirect(url_for("views.bancos"))
@@ -967,208 +2015,134 @@ def excluir_banco(id_banco):
 
 
 
-    if not banco:
-
-        flash("Banco no encontrado (id invlido).", "error")
-
-        return redirect(url_for("views.bancos"))
-
-
-
-    # Verifica dependencia: agencia vinculada
-
-    agencia_vinculada = fetch_one(
-
-        "SELECT 1 FROM agencia WHERE id_banco = %s LIMIT 1",
-
-        (id_banco,),
-
-    )
-
-    if agencia_vinculada:
-
-        flash(
-
-            "No  possvel excluir o banco: existem agncias vinculadas a ele.",
-
-            "error",
-
-        )
-
-        return redirect(url_for("views.bancos"))
-
-
-
-    # Tenta excluir
-
-    try:
-
-        result = execute("DELETE FROM banco WHERE id_banco = %s", (id_banco,))
-
-        print(f"[DEBUG] Resultado do DELETE banco: {result}")
-
-    except Exception as e:
-
-        print(f"[ERRO EXCLUIR BANCO] {e}")
-
-        flash("Erro ao excluir banco (restricao no banco de dados).", "error")
-
-        return redirect(url_for("views.bancos"))
-
-
-
-    if result and result > 0:
-
-        flash("Excluido com sucesso!", "success")
-
-    else:
-
-        flash("Erro ao excluir banco.", "error")
-
-
-
-    return redirect(url_for("views.bancos"))
-
-
-
-
-
-
-
-
-
-# ===========================
-
-# CRUD - AGENCIAS
-
-# ===========================
-
-
-
-
-
-@views_bp.route("/agencias")
-
-@login_required
-
-def agencias():
-
-    # Paginacao
-
-    page = request.args.get("page", 1, type=int)
-
-    per_page = 5
-
-    offset = (page - 1) * per_page
+    if not banco:
 
-    
+        flash("Banco no encontrado (id invlido).", "error")
 
-    search_term = request.args.get("search", "").strip()
+        return redirect(url_for("views.bancos"))
 
-    base_query = """
 
-        SELECT a.*,
 
-               (SELECT nome FROM banco WHERE banco.id_banco = a.id_banco) AS banco_nome
+    # Verifica dependencia: agencia vinculada
 
-          FROM agencia a
+    agencia_vinculada = fetch_one(
 
-    """
+        "SELECT 1 FROM agencia WHERE id_banco = %s LIMIT 1",
 
-    params = []
+        (id_banco,),
 
-    filters = []
+    )
 
+    if agencia_vinculada:
 
+        flash(
 
-    if search_term:
+            "No  possvel excluir o banco: existem agncias vinculadas a ele.",
 
-        filters.append(
+            "error",
 
-            """
+        )
 
-            (
+        return redirect(url_for("views.bancos"))
 
-                a.nome_agencia ILIKE %s OR
 
-                CAST(a.num_agencia AS TEXT) ILIKE %s
 
-            )
+    # Tenta excluir
 
-            """
+    try:
 
-        )
+        result = execute("DELETE FROM banco WHERE id_banco = %s", (id_banco,))
 
-        like = f"%{search_term}%"
+        print(f"[DEBUG] Resultado do DELETE banco: {result}")
 
-        params.extend([like, like])
+    except Exception as e:
 
-    
+        print(f"[ERRO EXCLUIR BANCO] {e}")
 
-    where_clause = ""
+        flash("Erro ao excluir banco (restricao no banco de dados).", "error")
 
-    if filters:
+        return redirect(url_for("views.bancos"))
 
-        where_clause = " WHERE " + " AND ".join(filters)
 
-    
 
-    # Contar total
+    if result and result > 0:
 
-    count_query = f"SELECT COUNT(*) as count FROM agencia a{where_clause}"
+        reference_changed("banco")
 
-    count_params = params[:]
+        flash("Excluido com sucesso!", "success")
 
-    result = fetch_one(count_query, count_params)
+    else:
 
-    total_items = result['count'] if result else 0
+        flash("Erro ao excluir banco.", "error")
 
-    total_pages = (total_items + per_page - 1) // per_page
 
-    
 
-    base_query += where_clause
+    return redirect(url_for("views.bancos"))
 
-    base_query += " ORDER BY a.nome_agencia, a.num_agencia LIMIT %s OFFSET %s" #offset serve para pular os primeiros registros
 
-    params.extend([per_page, offset])
 
 
 
-    agencias_list = fetch_all(base_query, params)
 
-    
 
-    start_item = offset + 1 if agencias_list else 0
 
-    end_item = min(offset + per_page, total_items)
 
-    
+# ===========================
 
-    return render_template(
+# CRUD - AGENCIAS
 
-        "agencias/list.html",
+# ===========================
 
-        agencias=agencias_list,
 
-        search_term=search_term,
 
-        current_page=page,
 
-        total_pages=total_pages,
 
-        total_items=total_items,
+LISTA_AGENCIAS = Listagem(
+    "agencias", "agencia a",
+    colunas=[
+        "a.id_agencia", "a.nome_agencia", "a.num_agencia", "a.dv_agencia",
+        "a.cidade", "a.uf", "b.nome AS banco_nome",
+    ],
+    colunas_exportacao=[
+        "a.id_agencia", "a.nome_agencia", "a.num_agencia", "a.dv_agencia", "a.logadouro",
+        "a.cidade", "a.uf", "a.id_banco", "b.nome AS banco_nome",
+    ],
+    joins={"b": "LEFT JOIN banco b ON b.id_banco = a.id_banco"},
+    ordenacoes={
+        "nome": [
+            (texto_pt_br("a.nome_agencia"), "nome_agencia"), ("a.num_agencia", "num_agencia"),
+            ("a.id_agencia", "id_agencia"),
+        ],
+        "numero": [("a.num_agencia", "num_agencia"), ("a.id_agencia", "id_agencia")],
+    },
+    busca=["a.nome_agencia"],
+    # Numero da agencia: prefixo no indice (num_agencia::text text_pattern_ops)
+    busca_numero=("a.num_agencia::text", "prefixo"),
+)
 
-        start_item=start_item,
 
-        end_item=end_item,
+@views_bp.route("/agencias")
+@login_required
+def agencias():
+    formato = export_format()
+    if formato:
+        return export_list(LISTA_AGENCIAS, formato)
 
+    consulta = LISTA_AGENCIAS.consulta(request.args)
+    agencias_list, pagina = list_page(consulta)
+    return render_template(
+        "agencias/list.html",
+        agencias=agencias_list,
+        search_term=consulta.busca,
+        **pagina,
     )
 
 
 
 
 
+
+
 @views_bp.route("/agencias/criar", methods=["GET", "POST"])
 
 @login_required
@@ -1181,7 +2155,7 @@ def criar_agencia():
 
     # Carrega bancos sempre
 
-    bancos = fetch_all("SELECT * FROM banco ORDER BY nome")
+    bancos = ref_bancos()
 
     # Carrega dados do formulario se houver
 
@@ -1232,6 +2206,8 @@ def criar_agencia():
 
         if result and result > 0:
 
+            reference_changed("agencia")
+
             flash("Agencia criada com sucesso!", "success")
 
             return redirect(url_for("views.agencias"))
@@ -1286,7 +2262,7 @@ def editar_agencia(id_agencia):
 
     # Carregar bancos para o select
 
-    bancos = fetch_all("SELECT * FROM banco ORDER BY nome")
+    bancos = ref_bancos()
 
 
 
@@ -1340,6 +2316,8 @@ def editar_agencia(id_agencia):
 
         if result and result > 0:
 
+            reference_changed("agencia")
+
             flash("Agencia atualizada com sucesso!", "success")
 
             return redirect(url_for("views.agencias"))
@@ -1431,6 +2409,8 @@ def excluir_agencia(id_agencia):
 
     if result and result > 0:
 
+        reference_changed("agencia")
+
         flash("Excluido com sucesso!", "success")
 
     else:
@@ -1444,115 +2424,300 @@ def excluir_agencia(id_agencia):
 
 
 
+# AUTOCOMPLETE DE AGENCIAS (modal de vincular conta e cadastro de conta)
 
+AGENCIAS_LIMITE_PADRAO = 20
+AGENCIAS_LIMITE_MAXIMO = 50
 
-# ===========================
+AGENCIA_SELECT = """
+    SELECT a.id_agencia, a.num_agencia, a.dv_agencia, a.nome_agencia, a.cidade,
+           a.id_banco, b.nome AS banco_nome
+      FROM agencia a
+      LEFT JOIN banco b ON b.id_banco = a.id_banco
+"""
 
-# CRUD - CONCEDENTES
 
-# ===========================
+def _agencia_json(row):
+    dv = f"-{row['dv_agencia']}" if row.get("dv_agencia") else ""
+    return {
+        "id_agencia": row["id_agencia"],
+        "num_agencia": row["num_agencia"],
+        "dv_agencia": row["dv_agencia"],
+        "nome_agencia": row["nome_agencia"],
+        "cidade": row["cidade"],
+        "id_banco": row["id_banco"],
+        "banco_nome": row["banco_nome"],
+        "rotulo": f"{row['banco_nome'] or '-'} - {row['nome_agencia']} ({row['num_agencia']}{dv})",
+    }
 
 
+def buscar_agencias(termo, id_banco=None, limite=AGENCIAS_LIMITE_PADRAO):
+    """
+    Agências em que cada palavra do termo casa com o início do número
+    (ou o código do banco) ou com parte do nome da agência/banco.
 
+    Número usa o índice de prefixo de num_agencia; texto, os índices trigram
+    de nome_agencia e banco.nome. Devolve (agencias, ha_mais).
+    """
+    conditions = []
+    params = []
+    for palavra in termo.split():
+        numero = re.fullmatch(r"(\d{1,9})(?:-\w?)?", palavra)
+        if numero:
+            conditions.append("(a.num_agencia::text LIKE %s OR a.id_banco = %s)")
+            params.extend([like_pattern(numero.group(1), prefix=True), int(numero.group(1))])
+        else:
+            conditions.append(f"({text_search('a.nome_agencia')} OR {text_search('b.nome')})")
+            params.extend([like_pattern(palavra)] * 2)
+    if id_banco:
+        conditions.append("a.id_banco = %s")
+        params.append(id_banco)
+    if not conditions:
+        return [], False
+
+    rows = fetch_all(
+        AGENCIA_SELECT
+        + " WHERE " + " AND ".join(conditions)
+        + " ORDER BY a.nome_agencia, a.num_agencia, a.id_agencia LIMIT %s",
+        params + [limite + 1],
+    )
+    return [_agencia_json(row) for row in rows[:limite]], len(rows) > limite
 
 
-@views_bp.route("/concedentes")
+def agencia_por_id(id_agencia):
+    """Uma agência no formato da API (para reexibir a escolhida num formulário)."""
+    if not id_agencia or not re.fullmatch(r"\d+", str(id_agencia), re.ASCII):
+        return None
+    row = fetch_one(AGENCIA_SELECT + " WHERE a.id_agencia = %s", (int(id_agencia),))
+    return _agencia_json(row) if row else None
 
+
+@views_bp.route("/api/agencias")
 @login_required
+def api_agencias():
+    termo = request.args.get("q", "").strip()
+    id_banco = request.args.get("id_banco", type=int)
+    limite = request.args.get("limite", AGENCIAS_LIMITE_PADRAO, type=int)
+    limite = max(1, min(limite, AGENCIAS_LIMITE_MAXIMO))
 
-def concedentes():
+    # Texto curto casaria metade do catálogo; número curto é prefixo seletivo
+    if not termo.isdigit() and len(termo) < 2 and not id_banco:
+        return {"termo": termo, "agencias": [], "mais": False}
 
-    # Paginao
+    agencias_encontradas, mais = buscar_agencias(termo, id_banco, limite)
+    return {"termo": termo, "agencias": agencias_encontradas, "mais": mais}
 
-    page = request.args.get("page", 1, type=int)
 
-    per_page = 5
 
-    offset = (page - 1) * per_page
 
-    
 
-    search_term = request.args.get("search", "").strip()
 
-    query = "SELECT * FROM concedente"
 
-    params = []
 
-    
+# ===========================
+
+# IMPORTACAO DO CATALOGO DE AGENCIAS
 
-    where_clause = ""
+# ===========================
 
-    if search_term:
 
-        where_clause = """
 
- WHERE (
+def importar_catalogo_agencias(stream, nome_arquivo, id_banco):
+    """
+    Sincroniza as agências de ``id_banco`` com um catálogo (CSV ou XLSX).
 
-        sigla ILIKE %s OR
+    As linhas válidas vão para uma tabela temporária via COPY e entram num
+    único INSERT ... ON CONFLICT (id_banco, num_agencia) DO UPDATE; o
+    WHERE do DO UPDATE pula as agências sem alteração, então só linhas
+    realmente novas ou diferentes são escritas. Agências fora do catálogo
+    não são removidas (podem ter contas vinculadas).
+    """
+    if id_banco not in {banco["id_banco"] for banco in ref_bancos()}:
+        raise importacao.ErroImportacao(f"banco {id_banco} nao cadastrado")
+    validador = importacao.ValidadorAgencias(id_banco)
+    resultado = {"lidas": 0, "validas": 0, "inseridas": 0, "atualizadas": 0, "inalteradas": 0, "erros": []}
+
+    with tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_MEMORIA, mode="w+", newline="", encoding="utf-8") as dados:
+        writer = csv.writer(dados)
+        linhas = importacao.ler_linhas(
+            stream, nome_arquivo, importacao.COLUNAS_AGENCIA_OBRIGATORIAS, importacao.SINONIMOS_AGENCIA
+        )
+        for numero, linha in linhas:
+            resultado["lidas"] += 1
+            agencia, erros = validador.validar(numero, linha)
+            if erros:
+                resultado["erros"].append({"linha": numero, "num_agencia": linha.get("num_agencia"), "erros": erros})
+                continue
+            importacao.escrever_staging_agencia(writer, agencia)
+            resultado["validas"] += 1
+        if not resultado["validas"]:
+            return resultado
+        dados.seek(0)
+
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    CREATE TEMP TABLE agencia_importacao (
+                        linha INTEGER NOT NULL,
+                        id_banco INTEGER NOT NULL,
+                        num_agencia INTEGER NOT NULL,
+                        dv_agencia VARCHAR(1) NOT NULL,
+                        nome_agencia VARCHAR(100) NOT NULL,
+                        logadouro VARCHAR(300) NOT NULL,
+                        cidade VARCHAR(100) NOT NULL,
+                        uf VARCHAR(2)
+                    ) ON COMMIT DROP
+                    """
+                )
+                cur.copy_expert(
+                    f"COPY agencia_importacao ({', '.join(importacao.COLUNAS_STAGING_AGENCIA)}) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    dados,
+                )
+                # xmax = 0 so na versao recem-inserida da linha
+                cur.execute(
+                    """
+                    WITH gravadas AS (
+                        INSERT INTO agencia (nome_agencia, num_agencia, dv_agencia, logadouro, cidade, uf, id_banco)
+                        SELECT t.nome_agencia, t.num_agencia, t.dv_agencia, t.logadouro, t.cidade, t.uf, t.id_banco
+                          FROM agencia_importacao t
+                         ORDER BY t.num_agencia
+                        ON CONFLICT (id_banco, num_agencia) DO UPDATE
+                           SET dv_agencia = EXCLUDED.dv_agencia,
+                               nome_agencia = EXCLUDED.nome_agencia,
+                               logadouro = EXCLUDED.logadouro,
+                               cidade = EXCLUDED.cidade,
+                               uf = EXCLUDED.uf
+                         WHERE (agencia.dv_agencia, agencia.nome_agencia, agencia.logadouro, agencia.cidade, agencia.uf)
+                               IS DISTINCT FROM
+                               (EXCLUDED.dv_agencia, EXCLUDED.nome_agencia, EXCLUDED.logadouro, EXCLUDED.cidade, EXCLUDED.uf)
+                        RETURNING (xmax = 0) AS inserida
+                    )
+                    SELECT count(*) FILTER (WHERE inserida) AS inseridas,
+                           count(*) FILTER (WHERE NOT inserida) AS atualizadas
+                      FROM gravadas
+                    """
+                )
+                resultado["inseridas"], resultado["atualizadas"] = cur.fetchone()
 
-        nome ILIKE %s
+    resultado["inalteradas"] = resultado["validas"] - resultado["inseridas"] - resultado["atualizadas"]
+    if resultado["inseridas"] or resultado["atualizadas"]:
+        reference_changed("agencia")
+    return resultado
 
- )
 
-        """
+@views_bp.route("/agencias/importar", methods=["GET", "POST"])
+@login_required
+def importar_agencias():
+    resultado = None
+    form_data = request.form.to_dict() if request.method == "POST" else {}
 
-        like = f"%{search_term}%"
+    if request.method == "POST":
+        id_banco = request.form.get("id_banco", type=int)
+        arquivo = request.files.get("arquivo")
+        if not id_banco or not arquivo or not arquivo.filename:
+            flash("Informe o banco e o arquivo do catalogo.", "error")
+            return render_template("agencias/importar.html", bancos=ref_bancos(), form_data=form_data)
 
-        params.extend([like, like])
+        inicio = time.perf_counter()
+        try:
+            resultado = importar_catalogo_agencias(arquivo.stream, arquivo.filename, id_banco)
+        except importacao.ErroImportacao as e:
+            flash(f"Catalogo rejeitado: {e}", "error")
+        except (psycopg2.Error, OSError) as e:
+            print(f"[ERRO CATALOGO AGENCIAS] {e}")
+            flash("Erro ao importar o catalogo de agencias.", "error")
+        else:
+            resultado["segundos"] = time.perf_counter() - inicio
+            print(
+                f"[CATALOGO AGENCIAS] banco {id_banco}: {resultado['inseridas']} inseridas, "
+                f"{resultado['atualizadas']} atualizadas, {resultado['inalteradas']} inalteradas, "
+                f"{len(resultado['erros'])} com erro em {resultado['segundos']:.1f}s"
+            )
+            flash(
+                f"Catalogo importado: {resultado['inseridas']} agencia(s) nova(s), "
+                f"{resultado['atualizadas']} atualizada(s), {resultado['inalteradas']} sem alteracao, "
+                f"{len(resultado['erros'])} linha(s) com erro.",
+                "success" if not resultado["erros"] else "warning",
+            )
 
-    
+    return render_template(
+        "agencias/importar.html",
+        bancos=ref_bancos(),
+        form_data=form_data,
+        resultado=resultado,
+        colunas=importacao.COLUNAS_AGENCIA,
+        xlsx=importacao.xlsx_leitura_disponivel(),
+    )
 
-    # Contar total
 
-    count_query = f"SELECT COUNT(*) as count FROM concedente{where_clause}"
+# flask --app manage views importar-agencias catalogo.csv --banco 1
+@views_bp.cli.command("importar-agencias")
+@click.argument("caminho", type=click.Path(exists=True, dir_okay=False))
+@click.option("--banco", "id_banco", type=int, required=True, help="codigo do banco do catalogo")
+def importar_agencias_comando(caminho, id_banco):
+    """Insere/atualiza as agências de um banco a partir de um catálogo CSV/XLSX."""
+    inicio = time.perf_counter()
+    with open(caminho, "rb") as stream:
+        try:
+            resultado = importar_catalogo_agencias(stream, os.path.basename(caminho), id_banco)
+        except importacao.ErroImportacao as e:
+            raise click.ClickException(f"catalogo rejeitado: {e}")
+
+    for erro in resultado["erros"]:
+        click.echo(f"linha {erro['linha']}: {'; '.join(erro['erros'])}", err=True)
+    click.echo(
+        f"{resultado['inseridas']} inseridas, {resultado['atualizadas']} atualizadas, "
+        f"{resultado['inalteradas']} inalteradas, {len(resultado['erros'])} com erro "
+        f"({time.perf_counter() - inicio:.1f}s)"
+    )
+
 
-    count_params = params[:]
 
-    result = fetch_one(count_query, count_params)
 
-    total_items = result['count'] if result else 0
 
-    total_pages = (total_items + per_page - 1) // per_page
 
-    
 
-    query += where_clause
+# ===========================
 
-    query += " ORDER BY codigo_secretaria, sigla LIMIT %s OFFSET %s"
+# CRUD - CONCEDENTES
 
-    params.extend([per_page, offset])
+# ===========================
 
 
 
-    concedentes_list = fetch_all(query, params)
 
-    
 
-    start_item = offset + 1 if concedentes_list else 0
+LISTA_CONCEDENTES = Listagem(
+    "concedentes", "concedente",
+    colunas=["id_concedente", "codigo_secretaria", "sigla", "nome"],
+    ordenacoes={
+        "codigo": [("codigo_secretaria", "codigo_secretaria")],
+        "sigla": [(texto_pt_br("sigla"), "sigla"), ("id_concedente", "id_concedente")],
+        "nome": [(texto_pt_br("nome"), "nome"), ("id_concedente", "id_concedente")],
+    },
+    busca=["sigla", "nome"],
+)
 
-    end_item = min(offset + per_page, total_items)
 
-    
+@views_bp.route("/concedentes")
+@login_required
+def concedentes():
+    formato = export_format()
+    if formato:
+        return export_list(LISTA_CONCEDENTES, formato)
 
+    consulta = LISTA_CONCEDENTES.consulta(request.args)
+    concedentes_list, pagina = list_page(consulta)
     return render_template(
-
         "concedentes/list.html",
-
         concedentes=concedentes_list,
+        search_term=consulta.busca,
+        **pagina,
+    )
 
-        search_term=search_term,
-
-        current_page=page,
-
-        total_pages=total_pages,
-
-        total_items=total_items,
-
-        start_item=start_item,
-
-        end_item=end_item,
 
-    )
 
 
 
@@ -1609,6 +2774,8 @@ def criar_concedente():
 
         if result and result > 0:
 
+            reference_changed("concedente")
+
             flash("Concedente criado com sucesso!", "success")
 
             return redirect(url_for("views.concedentes"))
@@ -1683,6 +2850,8 @@ def editar_concedente(id_concedente):
 
         if result and result > 0:
 
+            reference_changed("concedente")
+
             flash("Concedente atualizado com sucesso!", "success")
 
             return redirect(url_for("views.concedentes"))
@@ -1781,6 +2950,8 @@ def excluir_concedente(id_concedente):
 
     if result and result > 0:
 
+        reference_changed("concedente")
+
         flash("Excluido com sucesso!", "success")
 
     else:
@@ -1809,121 +2980,41 @@ def excluir_concedente(id_concedente):
 
 
 
-@views_bp.route("/usuarios")
+# Nunca projeta (nem exporta) o hash da senha
+LISTA_USUARIOS = Listagem(
+    "usuarios", "usuario",
+    colunas=["id_usuario", "nome", "email", "instituicao", "perfil_enum", "login", "status_enum"],
+    colunas_exportacao=[
+        "id_usuario", "nome", "matricula", "email", "instituicao", "perfil_enum", "login", "status_enum",
+    ],
+    ordenacoes={
+        "nome": [(texto_pt_br("nome"), "nome"), ("id_usuario", "id_usuario")],
+        "login": [("login", "login")],
+    },
+    busca=["nome"],
+    filtros={"perfil": ("perfil_enum", str.upper), "status": ("status_enum", str.upper)},
+)
 
-@login_required
 
+@views_bp.route("/usuarios")
+@login_required
 def usuarios():
+    formato = export_format()
+    if formato:
+        return export_list(LISTA_USUARIOS, formato)
 
-    # Paginação
-
-    page = request.args.get("page", 1, type=int)
-
-    per_page = 5
-
-    offset = (page - 1) * per_page
-
-    
-
-    search_term = request.args.get("search", "").strip()
-
-    perfil_filter = request.args.get("perfil", "").strip().upper()
-
-    status_filter = request.args.get("status", "").strip().upper()
-
-    query = "SELECT * FROM usuario"
-
-    params = []
-
-    filters = []
-
-
-
-    if search_term:
-
-        filters.append("nome ILIKE %s")
-
-        params.append(f"%{search_term}%")
-
-
-
-    if perfil_filter:
-
-        filters.append("perfil_enum = %s")
-
-        params.append(perfil_filter)
-
-
-
-    if status_filter:
-
-        filters.append("status_enum = %s")
-
-        params.append(status_filter)
-
-
-
-    where_clause = ""
-
-    if filters:
-
-        where_clause = " WHERE " + " AND ".join(filters)
-
-    
-
-    # Contar total
-
-    count_query = f"SELECT COUNT(*) as count FROM usuario{where_clause}"
-
-    result = fetch_one(count_query, params)
-
-    total_items = result['count'] if result else 0
-
-    total_pages = (total_items + per_page - 1) // per_page
-
-    
-
-    query += where_clause
-
-    query += " ORDER BY nome LIMIT %s OFFSET %s" #offset serve para pular os primeiros registros
-
-    params.extend([per_page, offset])
-
-
-
-    usuarios_list = fetch_all(query, params)
-
-    
-
-    start_item = offset + 1 if usuarios_list else 0
-
-    end_item = min(offset + per_page, total_items)
-
-    
-
+    consulta = LISTA_USUARIOS.consulta(request.args)
+    usuarios_list, pagina = list_page(consulta)
     return render_template(
-
         "usuarios/list.html",
-
         usuarios=usuarios_list,
+        search_term=consulta.busca,
+        perfil_filter=consulta.valores["perfil"],
+        status_filter=consulta.valores["status"],
+        **pagina,
+    )
 
-        search_term=search_term,
-
-        perfil_filter=perfil_filter,
-
-        status_filter=status_filter,
-
-        current_page=page,
-
-        total_pages=total_pages,
-
-        total_items=total_items,
-
-        start_item=start_item,
-
-        end_item=end_item,
 
-    )
 
 
 
@@ -2309,127 +3400,267 @@ def excluir_usuario(id_usuario):
 
 
 
+LISTA_REMESSAS = Listagem(
+    "remessas", "remessa r",
+    colunas=[
+        "r.id_remessa", "r.num_remessa", "r.nome_proponente", "r.cpf_cnpj",
+        "r.num_convenio", "r.situacao", "r.dt_remessa",
+    ],
+    # Nomes relacionados via JOIN por PK e a agencia da primeira conta via
+    # LATERAL (LIMIT 1 no indice da conta); so a exportacao os projeta
+    colunas_exportacao=[
+        "r.id_remessa", "r.num_remessa", "r.nome_proponente", "r.cpf_cnpj", "r.num_convenio",
+        "r.situacao", "r.dt_remessa", "c.nome AS concedente_nome", "u.nome AS usuario_nome",
+        "b.nome AS banco_nome", "pc.nome_agencia",
+    ],
+    joins={
+        "c": "LEFT JOIN concedente c ON c.id_concedente = r.id_concedente",
+        "u": "LEFT JOIN usuario u ON u.id_usuario = r.id_usuario",
+        "b": "LEFT JOIN banco b ON b.id_banco = r.id_banco",
+        "pc": """LEFT JOIN LATERAL (
+            SELECT ag.nome_agencia
+            FROM conta_convenio cc
+            JOIN agencia ag ON ag.id_agencia = cc.id_agencia
+            WHERE cc.id_remessa = r.id_remessa
+            ORDER BY cc.id_agencia
+            LIMIT 1
+        ) pc ON TRUE""",
+    },
+    ordenacoes={
+        "proponente": [(texto_pt_br("r.nome_proponente"), "nome_proponente"), ("r.id_remessa", "id_remessa")],
+        "data": [("r.dt_remessa", "dt_remessa"), ("r.id_remessa", "id_remessa")],
+    },
+    busca=["r.nome_proponente"],
+    busca_documento="r.cpf_cnpj_digits",
+    # Periodo em intervalo semiaberto na coluna: com a situacao, usa o indice
+    # (situacao, dt_remessa); sem ela, (dt_remessa, id_remessa)
+    filtros={
+        "situacao": "r.situacao",
+        "date_from": ("r.dt_remessa", data_iso, DESDE),
+        "date_to": ("r.dt_remessa", data_iso, ATE),
+    },
+    agrupamentos={"situacao": ("situacao", "Situação"), "concedente": ("concedente_nome", "Concedente")},
+)
+
+
 @views_bp.route("/remessas")
 @login_required
 def remessas():
-    page = request.args.get("page", 1, type=int)
-    per_page = 5
-    offset = (page - 1) * per_page
-
-    search_term = request.args.get("search", "").strip()
-    situacao_filter = request.args.get("situacao", "").strip()
-    date_from = request.args.get("date_from", "").strip()
-    situacao_filter = request.args.get("situacao", "").strip()
-
-    base_query = """
-        SELECT
-            r.*,
-            (
-                SELECT ag.nome_agencia
-                FROM agencia ag
-                WHERE ag.id_agencia = (
-                    SELECT MIN(cc.id_agencia)
-                    FROM conta_convenio cc
-                    WHERE cc.id_remessa = r.id_remessa
-                )
-            ) AS nome_agencia,
-            (SELECT c.nome FROM concedente c WHERE c.id_concedente = r.id_concedente) AS concedente_nome,
-            (SELECT u.nome FROM usuario u WHERE u.id_usuario = r.id_usuario) AS usuario_nome,
-            (SELECT b.nome FROM banco b WHERE b.id_banco = r.id_banco) AS banco_nome
-        FROM remessa r
-    """
-    
-    filters = []
-    params = []
-    if search_term:
-        filters.append("r.nome_proponente ILIKE %s")
-        params.append(f"%{search_term}%")
-    if situacao_filter:
-        filters.append("r.situacao = %s")
-        params.append(situacao_filter)
-    if situacao_filter:
-        filters.append("r.situacao = %s")
-        params.append(situacao_filter)
-    if situacao_filter:
-        filters.append("r.situacao = %s")
-        params.append(situacao_filter)
-    if date_from:
-        filters.append("DATE(r.dt_remessa) = %s")
-        params.append(date_from)
-    
-    where_clause = ""
-    if filters:
-        where_clause = " WHERE " + " AND ".join(filters)
-    
-    count_query = f"SELECT COUNT(*) as count FROM remessa r{where_clause}"
-    result = fetch_one(count_query, params)
-    total_items = result['count'] if result else 0
-    total_pages = (total_items + per_page - 1) // per_page
-    
-    base_query += where_clause
-    base_query += " ORDER BY r.nome_proponente LIMIT %s OFFSET %s"
-    params.extend([per_page, offset])
-    
-    remessas_list = fetch_all(base_query, params)
+    formato = export_format()
+    if formato:
+        return export_list(LISTA_REMESSAS, formato)
 
-    agencias_modal = fetch_all(
-        """
-        SELECT
-            a.*,
-            (SELECT nome FROM banco b WHERE b.id_banco = a.id_banco) AS banco_nome
-        FROM agencia a
-        ORDER BY a.nome_agencia
-        """
-    )
-    
-    start_item = offset + 1 if remessas_list else 0
-    end_item = min(offset + per_page, total_items)
-    
+    consulta = LISTA_REMESSAS.consulta(request.args)
+    remessas_list, pagina = list_page(consulta)
     return render_template(
         "remessas/list.html",
         remessas=remessas_list,
-        search_term=search_term,
-        date_from=date_from,
-        situacao_filter=situacao_filter,
-        current_page=page,
-        total_pages=total_pages,
-        total_items=total_items,
-        start_item=start_item,
-        end_item=end_item,
-        agencias_modal=agencias_modal,
+        search_term=consulta.busca,
+        date_from=consulta.valores["date_from"],
+        date_to=consulta.valores["date_to"],
+        situacao_filter=consulta.valores["situacao"],
+        situacoes=SITUACOES_REMESSA,
         date=date,
+        **pagina,
     )
 
 
-@views_bp.route("/remessas/vincular-conta", methods=["POST"])
+# Situacao -> situacoes para as quais a remessa pode ir na alteracao em lote.
+# Conta Aberta e final; chegar nela exige conta vinculada (ver abaixo).
+TRANSICOES_SITUACAO = {
+    "Em Preparação": ("Pendente de envio", "Enviado", "Erro"),
+    "Pendente de envio": ("Em Preparação", "Enviado", "Erro"),
+    "Enviado": ("Aguardando retorno", "Erro"),
+    "Aguardando retorno": ("Conta Aberta", "Pendente de envio", "Erro"),
+    "Erro": ("Em Preparação", "Pendente de envio"),
+    "Conta Aberta": (),
+}
+
+# Ids marcados na tela por requisicao (o filtro inteiro nao tem limite)
+MAX_IDS_LOTE = 10000
+
+
+def origens_permitidas(destino):
+    return [origem for origem, destinos in TRANSICOES_SITUACAO.items() if destino in destinos]
+
+
+def alterar_situacao_lote(destino, ids=None, consulta=None):
+    """
+    Passa para ``destino`` as remessas de ``ids`` ou, sem ids, todas as da
+    ``consulta`` (filtros da listagem, LISTA_REMESSAS.consulta), num único
+    UPDATE. As regras de transição ficam no WHERE: só muda quem está numa
+    situação de origem permitida e, para Conta Aberta, tem conta vinculada.
+    Retorna (alteradas, {situacao_atual: quantidade} das ignoradas).
+    """
+    if ids is not None:
+        alvo_sql, params_alvo = "remessa r WHERE r.id_remessa = ANY(%s)", [ids]
+    else:
+        alvo_sql, params_alvo = consulta.from_sql + consulta.where_clause, consulta.params
+
+    # A condicao de transicao fica em r (e nao em alvo) para ser reavaliada
+    # se outra transacao alterar a remessa antes do UPDATE trava-la
+    query = f"""
+        WITH alvo AS (
+            SELECT r.id_remessa, r.situacao FROM {alvo_sql}
+        ),
+        alteradas AS (
+            UPDATE remessa r
+               SET situacao = %s::situacao_enum
+              FROM alvo a
+             WHERE r.id_remessa = a.id_remessa
+               AND r.situacao = ANY(%s::situacao_enum[])
+               AND (%s <> 'Conta Aberta'
+                    OR EXISTS (SELECT 1 FROM conta_convenio cc WHERE cc.id_remessa = r.id_remessa))
+            RETURNING r.id_remessa
+        )
+        SELECT a.situacao::text AS situacao, count(*) AS quantidade, count(x.id_remessa) AS alteradas
+          FROM alvo a
+          LEFT JOIN alteradas x ON x.id_remessa = a.id_remessa
+         GROUP BY a.situacao
+    """
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params_alvo + [destino, origens_permitidas(destino), destino])
+            linhas = cur.fetchall()
+
+    alteradas = sum(row[2] for row in linhas)
+    ignoradas = {row[0]: row[1] - row[2] for row in linhas if row[1] > row[2]}
+    return alteradas, ignoradas
+
+
+@views_bp.route("/remessas/situacao-lote", methods=["POST"])
 @login_required
-def vincular_conta_remessa():
-    num_conta = request.form.get("num_conta")
-    dv_conta = request.form.get("dv_conta")
-    dt_abertura = request.form.get("dt_abertura")
-    id_remessa = request.form.get("id_remessa")
-    id_agencia = request.form.get("id_agencia")
-
-    if not all([num_conta, dv_conta, dt_abertura, id_remessa, id_agencia]):
-        flash("Preencha agencia, conta, dgito e data de abertura.", "error")
-        return redirect(url_for("views.remessas"))
+def alterar_situacao_remessas():
+    destino = request.form.get("nova_situacao", "")
+    consulta = LISTA_REMESSAS.consulta(request.form)
+    voltar = redirect(url_for("views.remessas", **consulta.argumentos()))
 
-    # Inserir conta e atualizar situacao da remessa para Conta Aberta
-    conta_result = execute(
-        """
-        INSERT INTO conta_convenio (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia)
-        VALUES (%s, %s, %s, %s, %s)
-        """,
-        (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia),
+    if destino not in TRANSICOES_SITUACAO:
+        flash("Selecione a nova situacao.", "error")
+        return voltar
+
+    ids = None
+    if request.form.get("escopo") != "filtro":
+        try:
+            ids = sorted({int(valor) for valor in request.form.getlist("ids")})
+        except ValueError:
+            ids = []
+        if not ids:
+            flash("Selecione ao menos uma remessa.", "error")
+            return voltar
+        if len(ids) > MAX_IDS_LOTE:
+            flash(f"Selecione no maximo {MAX_IDS_LOTE} remessas ou aplique ao filtro.", "error")
+            return voltar
+
+    inicio = time.perf_counter()
+    try:
+        alteradas, ignoradas = alterar_situacao_lote(destino, ids=ids, consulta=consulta)
+    except psycopg2.Error as e:
+        print(f"[ERRO SITUACAO LOTE] {e}")
+        flash("Erro ao alterar a situacao das remessas.", "error")
+        return voltar
+
+    print(
+        f"[SITUACAO LOTE] {alteradas} -> {destino}, {sum(ignoradas.values())} ignoradas "
+        f"em {time.perf_counter() - inicio:.2f}s"
     )
-    if conta_result and conta_result > 0:
-        execute(
-            "UPDATE remessa SET situacao = 'Conta Aberta' WHERE id_remessa = %s",
-            (id_remessa,),
-        )
-        flash("Conta vinculada e remessa marcada como Conta Aberta.", "success")
-    else:
-        flash("Erro ao vincular conta  remessa.", "error")
+    mensagem = f"{alteradas} remessa(s) passaram para {destino}."
+    if ignoradas:
+        detalhe = ", ".join(f"{quantidade} em {situacao}" for situacao, quantidade in sorted(ignoradas.items()))
+        mensagem += f" Ignoradas (transicao nao permitida ou sem conta vinculada): {detalhe}."
+    flash(mensagem, "success" if not ignoradas else "warning")
+    return voltar
+
+
+# Contas por envio do modal de vinculacao
+MAX_CONTAS_LOTE = 500
+
+
+def _contas_do_formulario(form):
+    """
+    Lê as contas do modal (listas paralelas id_remessa[], id_agencia[],
+    num_conta[], dv_conta[], dt_abertura[]). Retorna (colunas, erros):
+    colunas no formato dos arrays do unnest, erros por posição.
+    """
+    campos = ("id_remessa", "id_agencia", "num_conta", "dv_conta", "dt_abertura")
+    listas = [form.getlist(campo) for campo in campos]
+    total = len(listas[0])
+    if any(len(lista) != total for lista in listas):
+        return None, ["Dados das contas incompletos."]
+
+    colunas = {campo: [] for campo in campos}
+    erros = []
+    vistas = set()
+    for n, (id_remessa, id_agencia, num_conta, dv_conta, dt_abertura) in enumerate(zip(*listas), start=1):
+        num_conta, dv_conta = num_conta.strip(), dv_conta.strip().upper()
+        try:
+            id_remessa, id_agencia = int(id_remessa), int(id_agencia)
+            dt_abertura = datetime.strptime(dt_abertura, "%Y-%m-%d").date()
+        except ValueError:
+            erros.append(f"Conta {n}: preencha remessa, agencia e data de abertura.")
+            continue
+        if not (num_conta.isascii() and num_conta.isdigit()) or len(num_conta) > 20 or len(dv_conta) != 1:
+            erros.append(f"Conta {n}: numero ou digito da conta invalido.")
+            continue
+        if (id_remessa, num_conta, dv_conta) in vistas:
+            erros.append(f"Conta {n}: conta repetida no lote.")
+            continue
+        vistas.add((id_remessa, num_conta, dv_conta))
+        for campo, valor in zip(campos, (id_remessa, id_agencia, num_conta, dv_conta, dt_abertura)):
+            colunas[campo].append(valor)
+    return colunas, erros
+
+
+@views_bp.route("/remessas/vincular-conta", methods=["POST"])
+@login_required
+def vincular_conta_remessa():
+    colunas, erros = _contas_do_formulario(request.form)
+    if not erros and not colunas["id_remessa"]:
+        erros = ["Preencha agencia, conta, digito e data de abertura."]
+    elif not erros and len(colunas["id_remessa"]) > MAX_CONTAS_LOTE:
+        erros = [f"Envie no maximo {MAX_CONTAS_LOTE} contas por vez."]
+    if erros:
+        for erro in erros[:10]:
+            flash(erro, "error")
+        return redirect(url_for("views.remessas"))
+
+    # Um unico comando: as contas num INSERT (arrays desaninhados pelo
+    # unnest) e, a partir do RETURNING, as remessas em Conta Aberta. Um round
+    # trip, e o lote entra inteiro ou nada entra
+    try:
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    WITH novas AS (
+                        INSERT INTO conta_convenio (id_remessa, id_agencia, num_conta, dv_conta, dt_abertura)
+                        SELECT *
+                          FROM unnest(%s::integer[], %s::integer[], %s::varchar[], %s::varchar[], %s::date[])
+                        RETURNING id_remessa
+                    ),
+                    abertas AS (
+                        UPDATE remessa r
+                           SET situacao = %s
+                          FROM (SELECT DISTINCT id_remessa FROM novas) n
+                         WHERE r.id_remessa = n.id_remessa
+                           AND r.situacao IS DISTINCT FROM %s
+                        RETURNING r.id_remessa
+                    )
+                    SELECT (SELECT count(*) FROM novas) AS contas,
+                           (SELECT count(*) FROM abertas) AS remessas
+                    """,
+                    (colunas["id_remessa"], colunas["id_agencia"], colunas["num_conta"],
+                     colunas["dv_conta"], colunas["dt_abertura"],
+                     SITUACAO_CONTA_ABERTA, SITUACAO_CONTA_ABERTA),
+                )
+                contas, _remessas = cur.fetchone()
+        if contas == 1:
+            flash("Conta vinculada e remessa marcada como Conta Aberta.", "success")
+        else:
+            flash(f"{contas} contas vinculadas e remessas marcadas como Conta Aberta.", "success")
+    except psycopg2.Error as e:
+        print(f"[ERRO VINCULAR CONTA] {e}")
+        flash("Erro ao vincular conta  remessa. Nenhuma conta do lote foi gravada.", "error")
 
     return redirect(url_for("views.remessas"))
 
@@ -2450,9 +3681,9 @@ def criar_remessa():
 
     # Buscar dados para formulrio 
 
-    concedentes = fetch_all("SELECT * FROM concedente ORDER BY nome")
+    concedentes = ref_concedentes()
 
-    bancos = fetch_all("SELECT * FROM banco ORDER BY nome")
+    bancos = ref_bancos()
 
 
 
@@ -2496,17 +3727,9 @@ def criar_remessa():
 
 
 
-        # Proximo numero de remessa
-
-        resultado_max = fetch_one(
-
-            "SELECT COALESCE(MAX(num_remessa), 0) + 1 AS proximo_num FROM remessa"
-
-        )
-
-        proximo_num_remessa = resultado_max["proximo_num"] if resultado_max else 1
-
+        # num_remessa vem da sequence (DEFAULT nextval): sem MAX() e sem corrida
 
+        # entre operadores; o numero gerado volta no mesmo round trip
 
         query_insert = """
 
@@ -2514,21 +3737,23 @@ def criar_remessa():
 
                 num_processo, nome_proponente, cpf_cnpj, num_convenio,
 
-                situacao, num_remessa, id_concedente, id_usuario, id_banco
+                situacao, id_concedente, id_usuario, id_banco
 
             ) VALUES (
 
-                %s, %s, %s, %s, %s::situacao_enum, %s, %s, %s, %s
+                %s, %s, %s, %s, %s::situacao_enum, %s, %s, %s
 
             )
 
+            RETURNING id_remessa, num_remessa
+
         """
 
     #inserir remessa
 
         try:
 
-            result = execute(
+            result = fetch_one(
 
                 query_insert,
 
@@ -2544,8 +3769,6 @@ def criar_remessa():
 
                     situacao,
 
-                    proximo_num_remessa,
-
                     id_concedente,
 
                     session["user_id"],
@@ -2572,11 +3795,9 @@ def criar_remessa():
 
             )
 
+        if result:
 
-
-        if result and result > 0:
-
-            flash("Remessa criada com sucesso!", "success")
+            flash(f"Remessa nº {result['num_remessa']} criada com sucesso!", "success")
 
             return redirect(url_for("views.remessas"))
 
@@ -2652,9 +3873,9 @@ def editar_remessa(id_remessa):
 
 
 
-    concedentes = fetch_all("SELECT * FROM concedente ORDER BY nome")
+    concedentes = ref_concedentes()
 
-    bancos = fetch_all("SELECT * FROM banco ORDER BY nome")
+    bancos = ref_bancos()
 
 
 
@@ -2889,123 +4110,869 @@ def visualizar_remessa(id_remessa):
 
 # ===========================
 
-# CRUD - CONTAS CONVENIO
+# PROPONENTES (historico por CPF/CNPJ e grafias do nome)
 
 # ===========================
 
 
 
+# Remessas e contas exibidas no historico de um proponente
+HISTORICO_LIMITE = 500
 
+# Documentos processados por transacao no job de deduplicacao
+DEDUP_LOTE = 500
 
-@views_bp.route("/contas-convenio", methods=["GET", "POST"])
 
+def deduplicar_proponentes(lote=DEDUP_LOTE, limiar=proponentes.LIMIAR_SIMILARIDADE):
+    """
+    Processa um lote da fila proponente_pendente (migration e3a9c7b5d2f1):
+    regrava as grafias de cada documento com o nome canônico do grupo.
+
+    A similaridade trigram só é calculada entre grafias do mesmo documento,
+    nunca entre todos os nomes; documentos sem mudança desde a última
+    execução não saem da fila, então não são reprocessados.
+    Retorna quantos documentos foram processados (0 = fila vazia).
+    """
+    with transaction():
+        # SKIP LOCKED: duas execucoes simultaneas pegam lotes diferentes
+        documentos = [
+            row["documento"]
+            for row in fetch_all(
+                """
+                DELETE FROM proponente_pendente
+                 WHERE documento IN (
+                        SELECT documento FROM proponente_pendente
+                         ORDER BY desde
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                 )
+                RETURNING documento
+                """,
+                (lote,),
+            )
+        ]
+        if not documentos:
+            return 0
+
+        grafias = {}
+        for row in fetch_all(
+            """
+            SELECT cpf_cnpj_digits AS documento, nome_proponente,
+                   COUNT(*) AS remessas, MIN(id_remessa) AS primeira
+              FROM remessa
+             WHERE cpf_cnpj_digits = ANY(%s)
+             GROUP BY cpf_cnpj_digits, nome_proponente
+            """,
+            (documentos,),
+        ):
+            grafias.setdefault(row["documento"], {})[row["nome_proponente"]] = (row["remessas"], row["primeira"])
+
+        pares = {}
+        for row in fetch_all(
+            """
+            WITH grafias AS (
+                SELECT DISTINCT cpf_cnpj_digits AS documento, nome_proponente,
+                       lower(f_unaccent(nome_proponente)) AS normalizado
+                  FROM remessa
+                 WHERE cpf_cnpj_digits = ANY(%s)
+            )
+            SELECT a.documento, a.nome_proponente AS nome_a, b.nome_proponente AS nome_b
+              FROM grafias a
+              JOIN grafias b ON b.documento = a.documento AND b.nome_proponente > a.nome_proponente
+             WHERE similarity(a.normalizado, b.normalizado) >= %s
+            """,
+            (documentos, limiar),
+        ):
+            pares.setdefault(row["documento"], []).append((row["nome_a"], row["nome_b"]))
+
+        colunas = ([], [], [], [])
+        for documento, nomes in grafias.items():
+            canonicos = proponentes.agrupar_grafias(nomes, pares.get(documento, []))
+            for nome, (remessas, _primeira) in nomes.items():
+                for coluna, valor in zip(colunas, (documento, nome, canonicos[nome], remessas)):
+                    coluna.append(valor)
+
+        execute("DELETE FROM proponente_grafia WHERE documento = ANY(%s)", (documentos,))
+        execute(
+            """
+            INSERT INTO proponente_grafia (documento, nome_proponente, nome_canonico, remessas)
+            SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[], %s::integer[])
+            """,
+            colunas,
+        )
+    return len(documentos)
+
+
+@views_bp.cli.command("deduplicar-proponentes")
+@click.option("--lote", type=int, default=DEDUP_LOTE, show_default=True, help="documentos por transacao")
+@click.option("--limiar", type=float, default=proponentes.LIMIAR_SIMILARIDADE, show_default=True,
+              help="similaridade trigram minima entre grafias")
+def deduplicar_proponentes_comando(lote, limiar):
+    """Agrupa as grafias dos proponentes alterados desde a última execução."""
+    inicio = time.perf_counter()
+    total = 0
+    while True:
+        processados = deduplicar_proponentes(lote, limiar)
+        if not processados:
+            break
+        total += processados
+    click.echo(f"{total} documentos processados ({time.perf_counter() - inicio:.1f}s)")
+
+
+@views_bp.route("/proponentes/<documento>")
 @login_required
+def visualizar_proponente(documento):
+    documento = re.sub(r"\D", "", documento)
 
-def contas_convenio():
-    page = request.args.get("page", 1, type=int)
-    per_page = 5
-    offset = (page - 1) * per_page
+    # Tudo por igualdade em cpf_cnpj_digits (ix_remessa_cpf_cnpj_digits)
+    remessas = fetch_all(
+        """
+        SELECT r.id_remessa, r.num_remessa, r.num_processo, r.nome_proponente, r.cpf_cnpj,
+               r.num_convenio, r.situacao, r.dt_remessa, c.sigla AS concedente_sigla
+          FROM remessa r
+          LEFT JOIN concedente c ON c.id_concedente = r.id_concedente
+         WHERE r.cpf_cnpj_digits = %s
+         ORDER BY r.dt_remessa DESC, r.id_remessa DESC
+         LIMIT %s
+        """,
+        (documento, HISTORICO_LIMITE + 1),
+    )
+    if not remessas:
+        flash("Nenhuma remessa encontrada para este CPF/CNPJ.", "error")
+        return redirect(url_for("views.remessas"))
+
+    contas = fetch_all(
+        """
+        SELECT cc.id_conta_convenio, cc.num_conta, cc.dv_conta, cc.dt_abertura,
+               r.id_remessa, r.num_processo, ag.nome_agencia, ag.num_agencia, b.nome AS banco_nome
+          FROM remessa r
+          JOIN conta_convenio cc ON cc.id_remessa = r.id_remessa
+          LEFT JOIN agencia ag ON ag.id_agencia = cc.id_agencia
+          LEFT JOIN banco b ON b.id_banco = ag.id_banco
+         WHERE r.cpf_cnpj_digits = %s
+         ORDER BY cc.dt_abertura DESC, cc.id_conta_convenio DESC
+         LIMIT %s
+        """,
+        (documento, HISTORICO_LIMITE + 1),
+    )
 
-    search_term = request.args.get("search", "").strip()
-    situacao_filter = request.args.get("situacao", "").strip()
+    # Grafias agrupadas pelo job deduplicar-proponentes: [(canonico, [grafias])]
+    nomes = {}
+    for row in fetch_all(
+        """
+        SELECT nome_proponente, nome_canonico, remessas
+          FROM proponente_grafia
+         WHERE documento = %s
+         ORDER BY remessas DESC, nome_proponente
+        """,
+        (documento,),
+    ):
+        nomes.setdefault(row["nome_canonico"], []).append(row)
+    pendente = fetch_one("SELECT 1 AS pendente FROM proponente_pendente WHERE documento = %s", (documento,))
 
-    base_query = """
-        SELECT
-            cc.*,
-            r.num_processo,
-            r.nome_proponente,
-            r.num_remessa,
-            r.cpf_cnpj,
-            r.situacao,
-            (SELECT a.nome_agencia FROM agencia a WHERE a.id_agencia = cc.id_agencia) AS nome_agencia,
-            (
-                SELECT b.nome
-                FROM banco b
-                WHERE b.id_banco = (
-                    SELECT ag.id_banco FROM agencia ag WHERE ag.id_agencia = cc.id_agencia
+    return render_template(
+        "proponentes/view.html",
+        documento=documento,
+        cpf_cnpj=remessas[0]["cpf_cnpj"],
+        remessas=remessas[:HISTORICO_LIMITE],
+        contas=contas[:HISTORICO_LIMITE],
+        truncado=len(remessas) > HISTORICO_LIMITE or len(contas) > HISTORICO_LIMITE,
+        limite=HISTORICO_LIMITE,
+        nomes=list(nomes.items()),
+        pendente=pendente is not None,
+    )
+
+
+
+
+
+
+
+# ===========================
+
+# ARQUIVOS DE REMESSA (envio ao banco)
+
+# ===========================
+
+
+
+SITUACAO_EM_PREPARACAO = "Em Preparação"
+SITUACAO_ENVIADO = "Enviado"
+SITUACAO_CONTA_ABERTA = "Conta Aberta"
+
+# O sequencial do registro de detalhe tem 5 posicoes
+MAX_REMESSAS_ARQUIVO = 99999
+
+# Remessas que nao cabem no layout ficam em preparacao; a tela lista ate estas
+MAX_REJEITADAS_EXIBIDAS = 20
+
+TAMANHO_INSCRICAO = cnab.tamanho_campo(cnab.DETALHE, "inscricao")
+
+
+def arquivos_remessa_dir():
+    pasta = os.environ.get("ARQUIVOS_REMESSA_DIR") or os.path.join(current_app.instance_path, "arquivos_remessa")
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def gerar_arquivo_banco(id_banco, id_usuario):
+    """
+    Gera o arquivo de remessa de um banco com todas as suas remessas em
+    preparação e as marca como enviadas.
+
+    Tudo numa transação: a linha do banco fica travada (gerações do mesmo
+    banco em série, NSA sem buraco), um único UPDATE move as remessas para
+    Enviado gravando o arquivo em que saíram, e as linhas são lidas de volta
+    por cursor nomeado, EXPORT_LOTE por vez, direto para o disco. O arquivo
+    só ganha o nome final depois do COMMIT. Retorna o registro de
+    arquivo_remessa, ou None se não houver remessa a enviar.
+
+    Remessas cujo CPF/CNPJ tem mais dígitos do que o campo de inscrição
+    ficam de fora já na seleção (continuam em preparação) e voltam em
+    ``rejeitadas`` pelo num_processo; as demais seguem no arquivo.
+    """
+    gerado_em = datetime.now()
+    pasta = arquivos_remessa_dir()
+    temporario = None
+    with transaction() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT id_banco, nome FROM banco WHERE id_banco = %s FOR UPDATE", (id_banco,))
+            banco = cur.fetchone()
+            if not banco:
+                return None
+
+            cur.execute(
+                """
+                INSERT INTO arquivo_remessa (id_banco, nsa, nome_arquivo, dt_geracao, id_usuario)
+                SELECT %s, COALESCE(MAX(nsa), 0) + 1, '', %s, %s
+                  FROM arquivo_remessa
+                 WHERE id_banco = %s
+                RETURNING id_arquivo_remessa, nsa
+                """,
+                (id_banco, gerado_em, id_usuario, id_banco),
+            )
+            arquivo = cur.fetchone()
+
+            cur.execute(
+                """
+                SELECT num_processo
+                  FROM remessa
+                 WHERE id_banco = %s AND situacao = %s
+                   AND length(cpf_cnpj_digits) > %s
+                 ORDER BY id_remessa
+                """,
+                (id_banco, SITUACAO_EM_PREPARACAO, TAMANHO_INSCRICAO),
+            )
+            rejeitadas = [row["num_processo"] for row in cur.fetchall()]
+
+            cur.execute(
+                """
+                UPDATE remessa
+                   SET situacao = %s,
+                       id_arquivo_remessa = %s
+                 WHERE id_remessa IN (
+                        SELECT id_remessa
+                          FROM remessa
+                         WHERE id_banco = %s AND situacao = %s
+                           AND COALESCE(length(cpf_cnpj_digits), 0) <= %s
+                         ORDER BY id_remessa
+                         LIMIT %s
+                       )
+                """,
+                (SITUACAO_ENVIADO, arquivo["id_arquivo_remessa"], id_banco,
+                 SITUACAO_EM_PREPARACAO, TAMANHO_INSCRICAO, MAX_REMESSAS_ARQUIVO),
+            )
+            if cur.rowcount == 0:
+                # Nada a enviar: desfaz o registro do arquivo
+                raise _SemRemessas(rejeitadas)
+
+        nome = cnab.nome_arquivo(id_banco, arquivo["nsa"], gerado_em)
+        leitura = conn.cursor(name="arquivo_remessa", cursor_factory=RealDictCursor)
+        leitura.itersize = EXPORT_LOTE
+        leitura.execute(
+            """
+            SELECT id_remessa, num_remessa, nome_proponente, cpf_cnpj,
+                   num_convenio, num_processo, dt_remessa
+              FROM remessa
+             WHERE id_arquivo_remessa = %s
+             ORDER BY id_remessa
+            """,
+            (arquivo["id_arquivo_remessa"],),
+        )
+
+        def lotes():
+            while True:
+                lote = leitura.fetchmany(EXPORT_LOTE)
+                if not lote:
+                    return
+                yield lote
+
+        descritor, temporario = tempfile.mkstemp(prefix=".gerando-", dir=pasta)
+        try:
+            with os.fdopen(descritor, "w", encoding="ascii", newline="") as destino:
+                quantidade = cnab.escrever_arquivo(destino, banco, arquivo["nsa"], gerado_em, lotes())
+            leitura.close()
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE arquivo_remessa SET nome_arquivo = %s, qtd_remessas = %s WHERE id_arquivo_remessa = %s",
+                    (nome, quantidade, arquivo["id_arquivo_remessa"]),
                 )
-            ) AS banco_nome
-        FROM conta_convenio cc
-        JOIN remessa r ON r.id_remessa = cc.id_remessa
+        except Exception:
+            os.remove(temporario)
+            raise
+
+    os.replace(temporario, os.path.join(pasta, nome))
+    arquivo.update(nome_arquivo=nome, qtd_remessas=quantidade, banco_nome=banco["nome"], rejeitadas=rejeitadas)
+    return arquivo
+
+
+class _SemRemessas(Exception):
+    """Nenhuma remessa em preparação para o banco (desfaz a transação)."""
+
+    def __init__(self, rejeitadas=()):
+        super().__init__()
+        self.rejeitadas = list(rejeitadas)
+
+
+def _avisar_rejeitadas(rejeitadas):
+    if not rejeitadas:
+        return
+    processos = ", ".join(str(p) for p in rejeitadas[:MAX_REJEITADAS_EXIBIDAS])
+    if len(rejeitadas) > MAX_REJEITADAS_EXIBIDAS:
+        processos += f" e mais {len(rejeitadas) - MAX_REJEITADAS_EXIBIDAS}"
+    flash(
+        f"{len(rejeitadas)} remessa(s) ficaram fora do arquivo: CPF/CNPJ com mais de "
+        f"{TAMANHO_INSCRICAO} dígitos (processos: {processos}). Corrija e gere novamente.",
+        "warning",
+    )
+
+
+@views_bp.route("/remessas/arquivos")
+@login_required
+def arquivos_remessa():
+    pendentes = fetch_all(
+        """
+        SELECT b.id_banco, b.nome, p.quantidade
+          FROM (
+                SELECT id_banco, COUNT(*) AS quantidade
+                  FROM remessa
+                 WHERE situacao = %s AND id_banco IS NOT NULL
+                 GROUP BY id_banco
+          ) p
+          JOIN banco b ON b.id_banco = p.id_banco
+         ORDER BY b.nome
+        """,
+        (SITUACAO_EM_PREPARACAO,),
+    )
+    arquivos = fetch_all(
+        """
+        SELECT ar.*, b.nome AS banco_nome, u.nome AS usuario_nome
+          FROM arquivo_remessa ar
+          JOIN banco b ON b.id_banco = ar.id_banco
+          LEFT JOIN usuario u ON u.id_usuario = ar.id_usuario
+         ORDER BY ar.id_arquivo_remessa DESC
+         LIMIT 50
+        """
+    )
+    return render_template("remessas/arquivos.html", pendentes=pendentes, arquivos=arquivos)
+
+
+@views_bp.route("/remessas/arquivos/gerar", methods=["POST"])
+@login_required
+def gerar_arquivo_remessa():
+    id_banco = request.form.get("id_banco", type=int)
+    if not id_banco:
+        flash("Selecione o banco.", "error")
+        return redirect(url_for("views.arquivos_remessa"))
+
+    inicio = time.perf_counter()
+    try:
+        arquivo = gerar_arquivo_banco(id_banco, session.get("user_id"))
+    except _SemRemessas as e:
+        if e.rejeitadas:
+            _avisar_rejeitadas(e.rejeitadas)
+            return redirect(url_for("views.arquivos_remessa"))
+        arquivo = None
+    except (psycopg2.Error, OSError, ValueError) as e:
+        print(f"[ERRO ARQUIVO REMESSA] {e}")
+        flash(f"Erro ao gerar o arquivo de remessa: {e}", "error")
+        return redirect(url_for("views.arquivos_remessa"))
+
+    if not arquivo:
+        flash("Nenhuma remessa em preparação para este banco.", "warning")
+        return redirect(url_for("views.arquivos_remessa"))
+
+    print(
+        f"[ARQUIVO REMESSA] {arquivo['nome_arquivo']}: {arquivo['qtd_remessas']} remessas "
+        f"em {time.perf_counter() - inicio:.1f}s"
+    )
+    flash(
+        f"Arquivo {arquivo['nome_arquivo']} gerado com {arquivo['qtd_remessas']} remessa(s) "
+        f"para {arquivo['banco_nome']}.",
+        "success",
+    )
+    _avisar_rejeitadas(arquivo["rejeitadas"])
+    return redirect(url_for("views.arquivos_remessa"))
+
+
+@views_bp.route("/remessas/arquivos/<int:id_arquivo_remessa>/download")
+@login_required
+def baixar_arquivo_remessa(id_arquivo_remessa):
+    arquivo = fetch_one(
+        "SELECT nome_arquivo FROM arquivo_remessa WHERE id_arquivo_remessa = %s",
+        (id_arquivo_remessa,),
+    )
+    caminho = os.path.join(arquivos_remessa_dir(), arquivo["nome_arquivo"]) if arquivo else None
+    if not caminho or not os.path.isfile(caminho):
+        flash("Arquivo de remessa nao encontrado.", "error")
+        return redirect(url_for("views.arquivos_remessa"))
+    return send_file(caminho, mimetype="text/plain", as_attachment=True, download_name=arquivo["nome_arquivo"])
+
+
+
+
+
+
+
+# ===========================
+
+# RETORNO DO BANCO (conciliacao das contas abertas)
+
+# ===========================
+
+
+
+RELATORIO_REJEITADOS = re.compile(r"^rejeitados-\d{3}-\d{8}-\d{6}\.csv$")
+
+# Linhas aceitas ficam em memoria ate este tamanho; acima, em disco
+COPY_BUFFER_MEMORIA = 8 * 1024 * 1024
+
+
+def retornos_dir():
+    pasta = os.environ.get("RETORNOS_DIR") or os.path.join(current_app.instance_path, "retornos")
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def importar_retorno(stream, formato, id_banco):
     """
-    params = []
-    filters = []
-
-    if search_term:
-        filters.append("r.nome_proponente ILIKE %s")
-        params.append(f"%{search_term}%")
-    if situacao_filter:
-        filters.append("r.situacao = %s")
-        params.append(situacao_filter)
-
-    where_clause = ""
-    if filters:
-        where_clause = " WHERE " + " AND ".join(filters)
-
-    count_query = f"SELECT COUNT(*) as count FROM conta_convenio cc JOIN remessa r ON r.id_remessa = cc.id_remessa{where_clause}"
-    total_items_row = fetch_one(count_query, params)
-    total_items = total_items_row["count"] if total_items_row else 0
-    total_pages = (total_items + per_page - 1) // per_page
-
-    base_query += """
-        {where}
-        ORDER BY
-            r.nome_proponente,
-            (SELECT a.nome_agencia FROM agencia a WHERE a.id_agencia = cc.id_agencia),
-            cc.dt_abertura DESC
-        LIMIT %s OFFSET %s
-    """.format(where=where_clause)
-    params.extend([per_page, offset])
-
-    contas_list = fetch_all(base_query, params)
-
-    start_item = offset + 1 if contas_list else 0
-    end_item = min(offset + per_page, total_items)
+    Concilia um arquivo de retorno (CNAB ou CSV) do banco ``id_banco``.
+
+    As remessas sem conta aberta do banco e as agências do banco viram
+    índices em memória (retorno.Conciliador). O arquivo é lido linha a linha;
+    cada linha aceita vai para um buffer no formato do COPY e cada rejeitada
+    para o relatório. No fim, numa transação: COPY para uma tabela
+    temporária, um INSERT ... SELECT em conta_convenio e um UPDATE que passa
+    as remessas conciliadas para Conta Aberta.
+    """
+    agora = datetime.now()
+    nome_relatorio = f"rejeitados-{id_banco:03d}-{agora:%Y%m%d-%H%M%S}.csv"
+    caminho_relatorio = os.path.join(retornos_dir(), nome_relatorio)
+    resultado = {"lidas": 0, "aceitas": 0, "contas_criadas": 0, "remessas_abertas": 0}
+
+    with open(caminho_relatorio, "w", newline="", encoding="utf-8-sig") as saida, \
+            tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_MEMORIA, mode="w+", encoding="utf-8") as dados:
+        relatorio = retorno.RelatorioRejeitados(saida)
+        try:
+            with transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT id_remessa, num_processo, cpf_cnpj FROM remessa "
+                        "WHERE id_banco = %s AND situacao IS DISTINCT FROM %s",
+                        (id_banco, SITUACAO_CONTA_ABERTA),
+                    )
+                    remessas = cur.fetchall()
+                    cur.execute("SELECT id_agencia, num_agencia FROM agencia WHERE id_banco = %s", (id_banco,))
+                    conciliador = retorno.Conciliador(remessas, cur.fetchall())
+                    del remessas
+
+                leitor = retorno.ler_cnab(stream, id_banco) if formato == "cnab" else retorno.ler_csv(stream)
+                for numero, registro, erro in leitor:
+                    resultado["lidas"] += 1
+                    if erro is None:
+                        try:
+                            dados.write(retorno.linha_copy(conciliador.conciliar(registro)))
+                            resultado["aceitas"] += 1
+                            continue
+                        except retorno.RegistroInvalido as e:
+                            erro = str(e)
+                    relatorio.adicionar(numero, erro, registro)
+                dados.seek(0)
+
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        CREATE TEMP TABLE retorno_conta (
+                            id_remessa INTEGER NOT NULL,
+                            id_agencia INTEGER NOT NULL,
+                            num_conta VARCHAR(20) NOT NULL,
+                            dv_conta CHAR(1) NOT NULL,
+                            dt_abertura DATE NOT NULL
+                        ) ON COMMIT DROP
+                        """
+                    )
+                    cur.copy_expert(
+                        "COPY retorno_conta (id_remessa, id_agencia, num_conta, dv_conta, dt_abertura) FROM STDIN",
+                        dados,
+                    )
+                    # Reimportar o mesmo retorno nao duplica contas
+                    cur.execute(
+                        """
+                        INSERT INTO conta_convenio (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia)
+                        SELECT t.num_conta, t.dv_conta, t.dt_abertura, t.id_remessa, t.id_agencia
+                          FROM retorno_conta t
+                         WHERE NOT EXISTS (
+                                SELECT 1
+                                  FROM conta_convenio cc
+                                 WHERE cc.id_remessa = t.id_remessa
+                                   AND cc.num_conta = t.num_conta
+                                   AND cc.dv_conta = t.dv_conta
+                               )
+                        """
+                    )
+                    resultado["contas_criadas"] = cur.rowcount
+                    cur.execute(
+                        """
+                        UPDATE remessa r
+                           SET situacao = %s
+                          FROM (SELECT DISTINCT id_remessa FROM retorno_conta) t
+                         WHERE r.id_remessa = t.id_remessa
+                           AND r.situacao IS DISTINCT FROM %s
+                        """,
+                        (SITUACAO_CONTA_ABERTA, SITUACAO_CONTA_ABERTA),
+                    )
+                    resultado["remessas_abertas"] = cur.rowcount
+        except Exception:
+            saida.close()
+            os.remove(caminho_relatorio)
+            raise
+
+    resultado["rejeitadas"] = relatorio.total
+    resultado["amostra_rejeitadas"] = relatorio.amostra
+    if relatorio.total:
+        resultado["relatorio"] = nome_relatorio
+    else:
+        os.remove(caminho_relatorio)
+    return resultado
+
+
+@views_bp.route("/remessas/retorno", methods=["GET", "POST"])
+@login_required
+def retorno_banco():
+    resultado = None
+    form_data = request.form.to_dict() if request.method == "POST" else {}
+
+    if request.method == "POST":
+        id_banco = request.form.get("id_banco", type=int)
+        arquivo = request.files.get("arquivo")
+        if not id_banco or not arquivo or not arquivo.filename:
+            flash("Informe o banco e o arquivo de retorno.", "error")
+            return render_template("remessas/retorno.html", bancos=ref_bancos(), form_data=form_data)
+
+        formato = request.form.get("formato", "auto")
+        if formato not in ("cnab", "csv"):
+            formato = retorno.detectar_formato(arquivo.stream.readline())
+            arquivo.stream.seek(0)
+
+        inicio = time.perf_counter()
+        try:
+            resultado = importar_retorno(arquivo.stream, formato, id_banco)
+        except retorno.RegistroInvalido as e:
+            flash(f"Arquivo de retorno rejeitado: {e}", "error")
+        except (psycopg2.Error, OSError) as e:
+            print(f"[ERRO RETORNO] {e}")
+            flash("Erro ao importar o arquivo de retorno.", "error")
+        else:
+            resultado["formato"] = formato
+            resultado["segundos"] = time.perf_counter() - inicio
+            print(
+                f"[RETORNO] banco {id_banco}: {resultado['lidas']} linhas, {resultado['contas_criadas']} contas, "
+                f"{resultado['rejeitadas']} rejeitadas em {resultado['segundos']:.1f}s"
+            )
+            flash(
+                f"Retorno importado: {resultado['contas_criadas']} conta(s) criada(s), "
+                f"{resultado['remessas_abertas']} remessa(s) com conta aberta, "
+                f"{resultado['rejeitadas']} linha(s) rejeitada(s).",
+                "success" if not resultado["rejeitadas"] else "warning",
+            )
+
+    return render_template(
+        "remessas/retorno.html",
+        bancos=ref_bancos(),
+        form_data=form_data,
+        resultado=resultado,
+    )
+
+
+@views_bp.route("/remessas/retorno/rejeitados/<nome>")
+@login_required
+def baixar_rejeitados_retorno(nome):
+    caminho = os.path.join(retornos_dir(), nome)
+    if not RELATORIO_REJEITADOS.match(nome) or not os.path.isfile(caminho):
+        flash("Relatorio nao encontrado.", "error")
+        return redirect(url_for("views.retorno_banco"))
+    return send_file(caminho, mimetype="text/csv", as_attachment=True, download_name=nome)
+
+
+
+
+
+
+
+
+# ===========================
+
+# IMPORTACAO DE REMESSAS (planilha CSV/XLSX)
+
+# ===========================
+
+
+
+SITUACOES_REMESSA = tuple(DASHBOARD_SITUACOES.values())
+
+
+def importar_remessas(stream, nome_arquivo, id_usuario):
+    """
+    Importa remessas de uma planilha (CSV ou XLSX com cabeçalho).
+
+    Cada linha é validada em memória (importacao.ValidadorRemessas, com os
+    concedentes e bancos do cache de referência); linhas com erro são
+    devolvidas e não impedem as demais. As válidas vão para um buffer CSV e,
+    numa transação, para uma tabela temporária via COPY; um único
+    INSERT ... SELECT cria as remessas, com num_remessa da sequence na ordem
+    do arquivo. Processos já cadastrados são ignorados e reportados.
+    """
+    validador = importacao.ValidadorRemessas(
+        ref_concedentes(), ref_bancos(), SITUACOES_REMESSA, SITUACAO_EM_PREPARACAO
+    )
+    resultado = {"lidas": 0, "validas": 0, "criadas": 0, "erros": []}
+
+    with tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_MEMORIA, mode="w+", newline="", encoding="utf-8") as dados:
+        writer = csv.writer(dados)
+        for numero, linha in importacao.ler_linhas(stream, nome_arquivo):
+            resultado["lidas"] += 1
+            remessa, erros = validador.validar(numero, linha)
+            if erros:
+                resultado["erros"].append({"linha": numero, "num_processo": remessa["num_processo"], "erros": erros})
+                continue
+            importacao.escrever_staging(writer, remessa)
+            resultado["validas"] += 1
+        if not resultado["validas"]:
+            return resultado
+        dados.seek(0)
+
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    CREATE TEMP TABLE remessa_importacao (
+                        linha INTEGER NOT NULL,
+                        num_processo VARCHAR(100) NOT NULL,
+                        nome_proponente VARCHAR(100) NOT NULL,
+                        cpf_cnpj VARCHAR(18) NOT NULL,
+                        num_convenio VARCHAR(100) NOT NULL,
+                        id_concedente INTEGER NOT NULL,
+                        id_banco INTEGER,
+                        situacao TEXT NOT NULL,
+                        dt_remessa DATE
+                    ) ON COMMIT DROP
+                    """
+                )
+                cur.copy_expert(
+                    f"COPY remessa_importacao ({', '.join(importacao.COLUNAS_STAGING)}) FROM STDIN WITH (FORMAT csv)",
+                    dados,
+                )
+                # Devolve as linhas que nao entraram (processo ja cadastrado)
+                cur.execute(
+                    """
+                    WITH criadas AS (
+                        INSERT INTO remessa (
+                            num_processo, nome_proponente, cpf_cnpj, num_convenio, situacao,
+                            dt_remessa, id_concedente, id_usuario, id_banco
+                        )
+                        SELECT t.num_processo, t.nome_proponente, t.cpf_cnpj, t.num_convenio,
+                               t.situacao::situacao_enum, COALESCE(t.dt_remessa, CURRENT_DATE),
+                               t.id_concedente, %s, t.id_banco
+                          FROM remessa_importacao t
+                         ORDER BY t.linha
+                        ON CONFLICT (num_processo) DO NOTHING
+                        RETURNING num_processo
+                    )
+                    SELECT t.linha, t.num_processo
+                      FROM remessa_importacao t
+                     WHERE NOT EXISTS (SELECT 1 FROM criadas c WHERE c.num_processo = t.num_processo)
+                     ORDER BY t.linha
+                    """,
+                    (id_usuario,),
+                )
+                ignoradas = cur.fetchall()
+
+    for linha, num_processo in ignoradas:
+        resultado["erros"].append(
+            {"linha": linha, "num_processo": num_processo, "erros": ["num_processo ja cadastrado"]}
+        )
+    resultado["erros"].sort(key=lambda erro: erro["linha"])
+    resultado["criadas"] = resultado["validas"] - len(ignoradas)
+    return resultado
+
+
+@views_bp.route("/remessas/importar", methods=["GET", "POST"])
+@login_required
+def importar_remessas_planilha():
+    resultado = None
+
+    if request.method == "POST":
+        arquivo = request.files.get("arquivo")
+        if not arquivo or not arquivo.filename:
+            flash("Selecione a planilha de remessas.", "error")
+            return redirect(url_for("views.importar_remessas_planilha"))
+
+        inicio = time.perf_counter()
+        try:
+            resultado = importar_remessas(arquivo.stream, arquivo.filename, session["user_id"])
+        except importacao.ErroImportacao as e:
+            flash(f"Planilha rejeitada: {e}", "error")
+        except (psycopg2.Error, OSError) as e:
+            print(f"[ERRO IMPORTACAO] {e}")
+            flash("Erro ao importar a planilha de remessas.", "error")
+        else:
+            resultado["segundos"] = time.perf_counter() - inicio
+            print(
+                f"[IMPORTACAO] {resultado['lidas']} linhas, {resultado['criadas']} remessas criadas, "
+                f"{len(resultado['erros'])} com erro em {resultado['segundos']:.1f}s"
+            )
+            flash(
+                f"Importacao concluida: {resultado['criadas']} remessa(s) criada(s), "
+                f"{len(resultado['erros'])} linha(s) com erro.",
+                "success" if not resultado["erros"] else "warning",
+            )
+
+    return render_template(
+        "remessas/importar.html",
+        resultado=resultado,
+        colunas_obrigatorias=importacao.COLUNAS_OBRIGATORIAS,
+        colunas_opcionais=importacao.COLUNAS_OPCIONAIS,
+        xlsx=importacao.xlsx_leitura_disponivel(),
+    )
+
+
+# flask --app manage views importar-remessas planilha.csv --usuario 1
+@views_bp.cli.command("importar-remessas")
+@click.argument("caminho", type=click.Path(exists=True, dir_okay=False))
+@click.option("--usuario", "id_usuario", type=int, required=True, help="id_usuario gravado nas remessas")
+def importar_remessas_comando(caminho, id_usuario):
+    """Importa remessas de uma planilha CSV/XLSX."""
+    inicio = time.perf_counter()
+    with open(caminho, "rb") as stream:
+        try:
+            resultado = importar_remessas(stream, os.path.basename(caminho), id_usuario)
+        except importacao.ErroImportacao as e:
+            raise click.ClickException(f"planilha rejeitada: {e}")
+
+    for erro in resultado["erros"]:
+        click.echo(f"linha {erro['linha']}: {'; '.join(erro['erros'])}", err=True)
+    click.echo(
+        f"{resultado['lidas']} linhas lidas, {resultado['criadas']} remessas criadas, "
+        f"{len(resultado['erros'])} com erro ({time.perf_counter() - inicio:.1f}s)"
+    )
+
+
+
+
+
+
+
+# ===========================
+
+# CRUD - CONTAS CONVENIO
+
+# ===========================
+
+
+
+
+
+LISTA_CONTAS_CONVENIO = Listagem(
+    "contas_convenio", "conta_convenio cc",
+    colunas=[
+        "cc.id_conta_convenio", "cc.num_conta", "cc.dv_conta", "cc.dt_abertura",
+        "r.nome_proponente", "r.situacao", "ag.nome_agencia",
+    ],
+    colunas_exportacao=[
+        "cc.id_conta_convenio", "cc.num_conta", "cc.dv_conta", "cc.dt_abertura", "cc.id_remessa", "cc.id_agencia",
+        "r.num_processo", "r.nome_proponente", "r.num_remessa", "r.cpf_cnpj", "r.situacao",
+        "c.nome AS concedente_nome", "ag.nome_agencia", "b.nome AS banco_nome",
+    ],
+    joins={
+        "r": "JOIN remessa r ON r.id_remessa = cc.id_remessa",
+        "c": "LEFT JOIN concedente c ON c.id_concedente = r.id_concedente",
+        "ag": "LEFT JOIN agencia ag ON ag.id_agencia = cc.id_agencia",
+        "b": "LEFT JOIN banco b ON b.id_banco = ag.id_banco",
+    },
+    # Padrao em ix_conta_convenio_dt_abertura_id. "proponente" e a excecao a
+    # regra do indice composto: a chave cruza conta_convenio e remessa, entao
+    # cada pagina faz join e sort; fica so como escolha explicita no cabecalho
+    ordenacoes={
+        "abertura": [("cc.dt_abertura", "dt_abertura"), ("cc.id_conta_convenio", "id_conta_convenio")],
+        "proponente": [
+            (texto_pt_br("r.nome_proponente"), "nome_proponente"),
+            ("r.id_remessa", "id_remessa"),
+            ("cc.id_conta_convenio", "id_conta_convenio"),
+        ],
+    },
+    busca=["r.nome_proponente"],
+    busca_documento="r.cpf_cnpj_digits",
+    filtros={
+        "situacao": "r.situacao",
+        "date_from": ("cc.dt_abertura", data_iso, DESDE),
+        "date_to": ("cc.dt_abertura", data_iso, ATE),
+    },
+    agrupamentos={"situacao": ("situacao", "Situação"), "concedente": ("concedente_nome", "Concedente")},
+)
 
-    form_defaults = {"id_remessa": None, "dt_abertura": date.today().isoformat()}
 
+@views_bp.route("/contas-convenio", methods=["GET", "POST"])
+@login_required
+def contas_convenio():
+    formato = export_format()
+    if formato:
+        return export_list(LISTA_CONTAS_CONVENIO, formato)
+
+    consulta = LISTA_CONTAS_CONVENIO.consulta(request.args)
+    contas_list, pagina = list_page(consulta)
+    form_defaults = {"id_remessa": None, "dt_abertura": date.today().isoformat()}
     return render_template(
         "contas-convenio/list.html",
         contas=contas_list,
-        search_term=search_term,
-        situacao_filter=situacao_filter,
-        current_page=page,
-        total_pages=total_pages,
-        total_items=total_items,
-        start_item=start_item,
-        end_item=end_item,
+        search_term=consulta.busca,
+        situacao_filter=consulta.valores["situacao"],
+        date_from=consulta.valores["date_from"],
+        date_to=consulta.valores["date_to"],
         remessas_options=[],
         selected_remessa=None,
         agencias=[],
         form_defaults=form_defaults,
+        **pagina,
     )
-@views_bp.route("/contas-convenio/criar", methods=["GET", "POST"])
-
-@login_required
 
-def criar_conta_convenio():
 
-    form_data = {}
 
 
 
-    remessas = fetch_all("SELECT * FROM remessa ORDER BY nome_proponente, num_processo")
 
-    agencias = fetch_all(
 
-        """
+@views_bp.route("/contas-convenio/criar", methods=["GET", "POST"])
 
-        SELECT a.*,
+@login_required
 
-               (SELECT nome FROM banco b WHERE b.id_banco = a.id_banco) AS banco_nome
+def criar_conta_convenio():
 
-          FROM agencia a
+    form_data = {}
 
-         ORDER BY banco_nome, a.nome_agencia;
 
-        """
 
-    )
+    remessas = fetch_all("SELECT * FROM remessa ORDER BY nome_proponente, num_processo")
 
 
 
@@ -3035,7 +5002,7 @@ def criar_conta_convenio():
 
                 remessas=remessas,
 
-                agencias=agencias,
+                agencia_selecionada=agencia_por_id(id_agencia),
 
                 form_data=form_data,
 
@@ -3043,25 +5010,32 @@ def criar_conta_convenio():
 
 
 
-        result = execute(
-
+        # Conta e situacao da remessa num unico comando (CTE com INSERT):
+        # um round trip, e nao ha conta sem a remessa em Conta Aberta
+        result = fetch_one(
             """
-
-            INSERT INTO conta_convenio (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia)
-
-            VALUES (%s, %s, %s, %s, %s)
-
+            WITH nova AS (
+                INSERT INTO conta_convenio (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id_remessa
+            ),
+            aberta AS (
+                UPDATE remessa r
+                   SET situacao = %s
+                  FROM nova
+                 WHERE r.id_remessa = nova.id_remessa
+                   AND r.situacao IS DISTINCT FROM %s
+                RETURNING r.id_remessa
+            )
+            SELECT id_remessa FROM nova
             """,
-
-            (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia),
-
+            (num_conta, dv_conta, dt_abertura, id_remessa, id_agencia,
+             SITUACAO_CONTA_ABERTA, SITUACAO_CONTA_ABERTA),
         )
 
+        if result:
 
-
-        if result and result > 0:
-
-            flash("Conta de convenio criada com sucesso!", "success")
+            flash("Conta de convenio criada e remessa marcada como Conta Aberta.", "success")
 
             return redirect(url_for("views.contas_convenio", id_remessa=id_remessa))
 
@@ -3077,7 +5051,7 @@ def criar_conta_convenio():
 
         remessas=remessas,
 
-        agencias=agencias,
+        agencia_selecionada=agencia_por_id(form_data.get("id_agencia")),
 
         form_data=form_data,
 
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmark das exportacoes (CSV, NDJSON, XLSX): tempo de geracao e pico de
+# memoria (RSS). Cada formato roda em um processo proprio, para o pico de um
+# nao contaminar o outro. Com memoria constante, o pico nao deve crescer com
+# o numero de linhas.
+#
+# Uso (na raiz do projeto):
+#   python scripts/benchmark_exportacao.py [linhas]         # linhas sinteticas
+#   python scripts/benchmark_exportacao.py [linhas] --db    # remessas reais (cursor nomeado)
+
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.getcwd())
+
+from produto.planilhas import PlanilhaAgrupada, xlsx_disponivel
+
+LOTE = 2000
+
+COLUNAS = [
+    "id_remessa", "num_remessa", "nome_proponente", "cpf_cnpj", "num_convenio",
+    "situacao", "dt_remessa", "concedente_nome", "usuario_nome", "banco_nome", "nome_agencia",
+]
+
+SITUACOES = ["Em Preparação", "Enviado", "Aguardando retorno", "Pendente de envio", "Conta Aberta", "Erro"]
+
+QUERY_DB = """
+    SELECT r.id_remessa, r.num_remessa, r.nome_proponente, r.cpf_cnpj, r.num_convenio,
+           r.situacao, r.dt_remessa, c.nome AS concedente_nome, u.nome AS usuario_nome,
+           b.nome AS banco_nome, NULL AS nome_agencia
+      FROM remessa r
+      LEFT JOIN concedente c ON c.id_concedente = r.id_concedente
+      LEFT JOIN usuario u ON u.id_usuario = r.id_usuario
+      LEFT JOIN banco b ON b.id_banco = r.id_banco
+     ORDER BY r.nome_proponente, r.id_remessa
+     LIMIT %s
+"""
+
+
+def lotes_sinteticos(total):
+    inicio = datetime(2024, 1, 1)
+    for base in range(0, total, LOTE):
+        yield [
+            (
+                i, i, f"Proponente {i:07d}", f"{i:011d}", f"CV-{i % 9999:04d}",
+                SITUACOES[i % len(SITUACOES)], inicio + timedelta(minutes=i),
+                f"Concedente {i % 40:02d}", "Usuario Teste", "Banco Teste", f"Agencia {i % 500}",
+            )
+            for i in range(base, min(base + LOTE, total))
+        ]
+
+
+def lotes_db(total):
+    from config import get_conn
+
+    conn = get_conn()
+    try:
+        cur = conn.cursor(name="benchmark_exportacao")
+        cur.itersize = LOTE
+        cur.execute(QUERY_DB, (total,))
+        while True:
+            lote = cur.fetchmany(LOTE)
+            if not lote:
+                break
+            yield lote
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def gerar_csv(lotes, destino):
+    with open(destino, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUNAS)
+        for lote in lotes:
+            writer.writerows(lote)
+
+
+def gerar_ndjson(lotes, destino):
+    with open(destino, "w", encoding="utf-8") as f:
+        for lote in lotes:
+            f.write("".join(
+                json.dumps(dict(zip(COLUNAS, linha)), ensure_ascii=False, default=str) + "\n"
+                for linha in lote
+            ))
+
+
+def gerar_xlsx(lotes, destino):
+    planilha = PlanilhaAgrupada(destino, COLUNAS, "situacao", "Situação")
+    for lote in lotes:
+        planilha.escrever(lote)
+    planilha.fechar()
+
+
+FORMATOS = {"csv": gerar_csv, "ndjson": gerar_ndjson, "xlsx": gerar_xlsx}
+
+
+def medir(formato, total, usar_db, fila):
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    lotes = lotes_db(total) if usar_db else lotes_sinteticos(total)
+    with tempfile.TemporaryDirectory() as pasta:
+        destino = os.path.join(pasta, f"export.{formato}")
+        inicio = time.perf_counter()
+        FORMATOS[formato](lotes, destino)
+        segundos = time.perf_counter() - inicio
+        tamanho = os.path.getsize(destino)
+    rss_pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss em KB no Linux
+    fila.put((formato, segundos, rss_inicial / 1024, rss_pico / 1024, tamanho / 1024 / 1024))
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    total = int(args[0]) if args else 200000
+    usar_db = "--db" in sys.argv
+
+    formatos = ["csv", "ndjson"] + (["xlsx"] if xlsx_disponivel() else [])
+    if "xlsx" not in formatos:
+        print("XlsxWriter nao instalado: XLSX fora do benchmark (pip install XlsxWriter)")
+
+    print(f"Linhas: {total} ({'banco' if usar_db else 'sinteticas'})")
+    print(f"{'formato':<8} {'tempo (s)':>10} {'linhas/s':>10} {'RSS ini (MB)':>13} {'RSS pico (MB)':>14} {'arquivo (MB)':>13}")
+
+    fila = multiprocessing.Queue()
+    for formato in formatos:
+        processo = multiprocessing.Process(target=medir, args=(formato, total, usar_db, fila))
+        processo.start()
+        processo.join()
+        if processo.exitcode != 0:
+            print(f"{formato:<8} falhou (exit {processo.exitcode})")
+            continue
+        formato, segundos, rss_ini, rss_pico, tamanho = fila.get()
+        print(
+            f"{formato:<8} {segundos:>10.2f} {total / segundos:>10.0f} "
+            f"{rss_ini:>13.1f} {rss_pico:>14.1f} {tamanho:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
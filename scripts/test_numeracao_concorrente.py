@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Teste de carga da numeracao de remessas (sequence + INSERT ... RETURNING).
+# Varias threads criam remessas em paralelo, cada uma com sua conexao, e no
+# final o script confere que nenhum num_remessa se repetiu.
+#
+# Uso: python scripts/test_numeracao_concorrente.py [threads] [remessas_por_thread]
+
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.getcwd())
+
+from config import get_conn
+
+PREFIXO = f"STRESS-{uuid.uuid4().hex[:8]}"
+DOCUMENTO = "000.000.000-00"
+
+QUERY_INSERT = """
+    INSERT INTO remessa (num_processo, nome_proponente, cpf_cnpj, num_convenio,
+                         id_concedente, id_usuario)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING id_remessa, num_remessa
+"""
+
+
+def referencias():
+    """Concedente e usuario existentes para as remessas de teste."""
+    conn = get_conn()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT (SELECT MIN(id_concedente) FROM concedente), (SELECT MIN(id_usuario) FROM usuario)")
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def worker(indice, quantidade, id_concedente, id_usuario):
+    """Cria `quantidade` remessas, uma transacao por remessa (como a view)."""
+    conn = get_conn()
+    numeros = []
+    try:
+        cursor = conn.cursor()
+        for n in range(quantidade):
+            cursor.execute(QUERY_INSERT, (
+                f"{PREFIXO}-{indice}-{n}",
+                f"Proponente Teste {indice}-{n}",
+                DOCUMENTO,
+                f"{PREFIXO}-CONV",
+                id_concedente,
+                id_usuario,
+            ))
+            numeros.append(cursor.fetchone()[1])
+            conn.commit()
+    finally:
+        conn.close()
+    return numeros
+
+
+def limpar():
+    """
+    Remove as remessas de teste (o trigger tira as linhas de busca_indice).
+    O DELETE reenfileira o documento em proponente_pendente; se nenhuma
+    remessa real usa o documento, a fila e as grafias dele saem aqui
+    tambem, como o job deduplicar-proponentes faria.
+    """
+    documento = "".join(c for c in DOCUMENTO if c.isdigit())
+    conn = get_conn()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM remessa WHERE num_processo LIKE %s", (f"{PREFIXO}-%",))
+        removidas = cursor.rowcount
+        cursor.execute("SELECT 1 FROM remessa WHERE cpf_cnpj_digits = %s LIMIT 1", (documento,))
+        if cursor.fetchone() is None:
+            cursor.execute("DELETE FROM proponente_grafia WHERE documento = %s", (documento,))
+            cursor.execute("DELETE FROM proponente_pendente WHERE documento = %s", (documento,))
+        conn.commit()
+        return removidas
+    finally:
+        conn.close()
+
+
+def test_numeracao_concorrente(threads=16, por_thread=250):
+    print(f"🧪 Criando {threads * por_thread} remessas com {threads} threads em paralelo...")
+
+    id_concedente, id_usuario = referencias()
+    if not id_concedente or not id_usuario:
+        print("❌ Cadastre ao menos um concedente e um usuario antes do teste")
+        return False
+
+    # Remove as remessas de teste mesmo se alguma thread falhar. Ficam so as
+    # tuplas mortas (remessa, busca_indice), que o autovacuum recupera, e os
+    # numeros consumidos da sequence
+    try:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futuros = [pool.submit(worker, i, por_thread, id_concedente, id_usuario) for i in range(threads)]
+            numeros = [num for futuro in futuros for num in futuro.result()]
+        duracao = time.perf_counter() - inicio
+    finally:
+        removidas = limpar()
+        print(f"🧹 {removidas} remessas de teste removidas")
+
+    duplicados = len(numeros) - len(set(numeros))
+    print(f"📊 {len(numeros)} remessas em {duracao:.2f}s ({len(numeros) / duracao:.0f} remessas/s)")
+    print(f"🔢 Faixa gerada: {min(numeros)} .. {max(numeros)}")
+
+    if duplicados:
+        print(f"❌ {duplicados} num_remessa duplicados!")
+        return False
+    print("✅ Nenhum num_remessa duplicado")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    ok = test_numeracao_concorrente(*args)
+    print("\n🎯 Teste concluído!")
+    sys.exit(0 if ok else 1)
@@ -202,40 +202,6 @@ function closeModal(modalId) {
     }
 }
 
-// Table utilities
-function filterTable(tableId, searchValue) {
-    const table = document.getElementById(tableId);
-    if (!table) return;
-    
-    const tbody = table.querySelector('tbody');
-    const rows = tbody.querySelectorAll('tr');
-    const searchTerm = searchValue.toLowerCase();
-    
-    rows.forEach(row => {
-        const cells = row.querySelectorAll('td');
-        let found = false;
-        cells.forEach(cell => {
-            if (cell.textContent.toLowerCase().includes(searchTerm)) {
-                found = true;
-            }
-        });
-        row.style.display = found ? '' : 'none';
-    });
-}
-
-function sortTable(table, column, direction) {
-    const tbody = table.querySelector('tbody');
-    const rows = Array.from(tbody.querySelectorAll('tr'));
-    
-    rows.sort((a, b) => {
-        const aVal = a.children[column].textContent.trim();
-        const bVal = b.children[column].textContent.trim();
-        return direction === 'asc' ? aVal.localeCompare(bVal) : bVal.localeCompare(aVal);
-    });
-    
-    rows.forEach(row => tbody.appendChild(row));
-}
-
 // Proteção adicional para formulários de exclusão
 function protectDeleteForms() {
     console.log('🔒 Configurando proteção para formulários de exclusão...');
@@ -413,3 +379,84 @@ window.logout = function() {
         }
     });
 };
+
+// ===========================
+// BUSCA DE AGENCIAS (autocomplete)
+// ===========================
+// <input data-agencia-busca="#id-do-select" data-url="/api/agencias">
+// Preenche o <select> com o resultado da API enquanto o usuario digita,
+// em vez de a pagina trazer o catalogo inteiro de agencias.
+window.initAgenciaBusca = function(input) {
+    const select = document.querySelector(input.dataset.agenciaBusca);
+    const url = input.dataset.url;
+    if (!select || !url) {
+        return;
+    }
+
+    let timer = null;
+    let controller = null;
+
+    function preencher(agencias, mais) {
+        const atual = select.value;
+        select.innerHTML = '';
+        const vazio = document.createElement('option');
+        vazio.value = '';
+        vazio.textContent = agencias.length ? 'Selecione' : 'Nenhuma agencia encontrada';
+        select.appendChild(vazio);
+        agencias.forEach(function(agencia) {
+            const option = document.createElement('option');
+            option.value = agencia.id_agencia;
+            option.textContent = agencia.rotulo;
+            select.appendChild(option);
+        });
+        if (mais) {
+            const aviso = document.createElement('option');
+            aviso.disabled = true;
+            aviso.textContent = 'Mais resultados: refine a busca';
+            select.appendChild(aviso);
+        }
+        select.value = atual;
+        if (agencias.length === 1) {
+            select.value = agencias[0].id_agencia;
+        }
+    }
+
+    function buscar() {
+        const termo = input.value.trim();
+        if (controller) {
+            controller.abort();
+        }
+        if (!/^\d+$/.test(termo) && termo.length < 2) {
+            return;
+        }
+        controller = new AbortController();
+        fetch(url + '?q=' + encodeURIComponent(termo), {
+            signal: controller.signal,
+            headers: { 'Accept': 'application/json' }
+        })
+            .then(response => response.json())
+            .then(data => preencher(data.agencias || [], data.mais))
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    console.error('Erro ao buscar agencias:', error);
+                }
+            });
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(buscar, 250);
+    });
+    input.addEventListener('keydown', function(event) {
+        // Enter busca na hora em vez de enviar o formulario
+        if (event.key === 'Enter') {
+            event.preventDefault();
+            clearTimeout(timer);
+            buscar();
+        }
+    });
+};
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-agencia-busca]').forEach(initAgenciaBusca);
+});